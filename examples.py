@@ -52,6 +52,10 @@ def experiment():
         # reveal scores
         # score MothNet
         mothra.score_moth_on_MNIST(EN_resp_trained)
+        # score held-out digits with the trained (frozen) moth, without re-simulating,
+        # against the post-training response stats of the simulation
+        holdout_X, holdout_y = mothra.holdout_set()
+        mothra.predict(holdout_X, sim_results, EN_resp_trained, holdout_y)
         # score KNN
         mothra.score_knn(train_X, train_y, test_X, test_y)
         # score SVM
@@ -1,44 +1,44 @@
 #!/usr/bin/env python3
 
-import numpy as _np
-from keras.datasets import mnist as _mnist # also requires tensorflow
+import os as _os
+from . import MNIST_read
+from .MNIST_store import save_store
 
-def make_MNIST(mnist_fpath):
+def make_MNIST(store_dir, raw_dir=None, download=True):
 	'''
-	Save the following data to .npy file:
-		train_images: np.array[28x28x60000]
-		test_images: np.array[28x28x10000]
+	Save the following data to a (memory-mappable) store of .npy files (see \
+	:func:`MNIST_store.save_store`):
+		train_images: np.array[60000x28x28]
+		test_images: np.array[10000x28x28]
 		train_labels: np.array[60000x1]
 		test_labels: np.array[10000x1]
 
-	Args:
-		mnist_fpath (str): Path and filename for data to be saved under in the \
-		user's Home (~) directory.
-	'''
-
-	# from MNIST_all import MNIST_read
+	The data is read from the MNIST IDX files (eg 'train-images-idx3-ubyte.gz', \
+	gzipped or not) in `raw_dir`, with numpy only. If they are not there, they \
+	are downloaded to it first (see :func:`MNIST_read.read`).
 
-	# # download and save data from Yann Lecun's website
-	# [train_imgs, train_lbls, test_imgs, test_lbls] = MNIST_read.read();
+	Args:
+		store_dir (str): Path of the folder for the data.
+		raw_dir (str): Folder of the IDX files (default: 'raw', next to \
+			`store_dir`).
+		download (bool): Download the IDX files if absent (else raise \
+			FileNotFoundError).
 
-	## download and save data from Keras
-	# directory to save image data
-	# im_dir = 'MNIST_all'
+	>>> make_MNIST('/tmp/MNIST_all', raw_dir='/data/mnist', download=False)
+	'''
 
-	(train_imgs, train_lbls), (test_imgs, test_lbls) = _mnist.load_data()
+	if raw_dir is None:
+		raw_dir = _os.path.join(_os.path.dirname(_os.path.abspath(store_dir)), 'raw')
 
-	mnist = {
-				'train_images':train_imgs,
-				'test_images':test_imgs,
-				'train_labels':train_lbls,
-				'test_labels':test_lbls,
-			}
+	# read (and download, if absent) the data from Yann Lecun's IDX files
+	[train_imgs, train_lbls, test_imgs, test_lbls] = MNIST_read.read(raw_dir, download)
 
-	_np.save(mnist_fpath, mnist)
-	print('MNIST data saved:', mnist_fpath)
+	save_store(store_dir, train_imgs, train_lbls, test_imgs, test_lbls)
+	print('MNIST data saved:', store_dir)
 
 if __name__ == "__main__":
-    make_MNIST()
+	import sys
+	make_MNIST(*sys.argv[1:3])
 
 # MIT license:
 # Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
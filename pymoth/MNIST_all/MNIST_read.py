@@ -1,11 +1,84 @@
-def read():
+import numpy as _np
+import os as _os
+import gzip as _gzip
+
+# IDX data type codes, see http://yann.lecun.com/exdb/mnist/
+_IDX_DTYPES = { 0x08:'u1', 0x09:'i1', 0x0B:'>i2', 0x0C:'>i4', 0x0D:'>f4', 0x0E:'>f8' }
+
+# the MNIST files, by (set, kind): standard names first, then the names
+# used by earlier versions of :func:`read`
+_MNIST_FILES = {
+	('train', 'images'):('train-images-idx3-ubyte', 'train_images'),
+	('train', 'labels'):('train-labels-idx1-ubyte', 'train_labels'),
+	('test', 'images'):('t10k-images-idx3-ubyte', 'test_images'),
+	('test', 'labels'):('t10k-labels-idx1-ubyte', 'test_labels'),
+}
+# download locations of the (gzipped) files, tried in turn
+_MNIST_URLS = ('http://yann.lecun.com/exdb/mnist/',
+	'https://storage.googleapis.com/cvdf-datasets/mnist/')
+
+def read_idx(fpath):
 	'''
-	Read in MNIST digit set in Le Cun's format
+	Read an array from an IDX file (the format of the MNIST files), gzipped \
+	('.gz') or not. The data is streamed (and decompressed) straight into \
+	the output array, with no intermediate copies.
+
+	INPUT:
+	fpath: path of the IDX file
+
+	OUTPUT:
+	array: numpy array with the shape and data type given in the file header
+
+	>>> train_images = read_idx('MNIST_all/raw/train-images-idx3-ubyte.gz')
+	'''
+	with open(fpath, 'rb') as raw:
+		gzipped = raw.read(2) == b'\x1f\x8b'
+	with (_gzip.open(fpath, 'rb') if gzipped else open(fpath, 'rb')) as f:
+		header = f.read(4)
+		if len(header) < 4 or header[:2] != b'\x00\x00' or header[2] not in _IDX_DTYPES:
+			raise ValueError('{} is not an IDX file'.format(fpath))
+		dtype = _np.dtype(_IDX_DTYPES[header[2]])
+		shape = tuple(_np.frombuffer(f.read(4*header[3]), dtype='>u4').astype(int))
+		array = _np.empty(shape, dtype=dtype)
+		if f.readinto(memoryview(array).cast('B')) != array.nbytes:
+			raise ValueError('{} is truncated'.format(fpath))
+	return array.astype(dtype.newbyteorder('='), copy=False)
+
+def find_files(raw_dir):
+	'''
+	Find the four MNIST IDX files in a folder, under their standard names \
+	(eg 'train-images-idx3-ubyte') or those of earlier versions (eg \
+	'train_images'), gzipped or not.
+
+	INPUT:
+	raw_dir: folder of the files
+
+	OUTPUT:
+	fpaths: dict of the paths by (set, kind), eg ('train', 'images'), or None \
+	if any file is missing
+
+	>>> fpaths = find_files('MNIST_all/raw')
+	'''
+	fpaths = {}
+	for key, names in _MNIST_FILES.items():
+		found = [ _os.path.join(raw_dir, name + ext) for name in names for ext in ('', '.gz')
+			if _os.path.isfile(_os.path.join(raw_dir, name + ext)) ]
+		if not found:
+			return None
+		fpaths[key] = found[0]
+	return fpaths
+
+def read(raw_dir=_os.path.join('.', 'MNIST_all', 'raw'), download=True):
+	'''
+	Read in MNIST digit set in Le Cun's format (IDX files, see :func:`read_idx`)
 	[trainImages, trainLabels, testImages, testLabels] = MNIST_read()
 
 	The data is available at:
 	http://yann.lecun.com/exdb/mnist/
 
+	The files are read from `raw_dir` if they are there (see \
+	:func:`find_files`), else they are downloaded to it (if `download`).
+
 	OUTPUT:
 	trainImages is a numpy matrix of size 60,000x28x28
 			 (0 = background, 255 = foreground)
@@ -19,77 +92,33 @@ def read():
 	MIT License
 	'''
 
-	import numpy as np
-	import os
+	fpaths = find_files(raw_dir)
 
-	im_dir = 'MNIST_all'
-	raw_dir = 'raw'
-	file_list = ['train_images.npy','train_labels.npy','test_images.npy','test_labels.npy']
-	# Check if all processed files exist
-	missingFileTest = any(
-			[not os.path.isfile(os.path.join('.',im_dir,raw_dir,fn)) for fn in file_list])
+	if fpaths is None:
+		if not download:
+			raise FileNotFoundError('MNIST IDX files not found in {}'.format(raw_dir))
 
-	if missingFileTest:
+		import urllib.request as _request
 
 		print('Downloading data')
-
-		import wget
-		import gzip
-		import struct
-
-		image_urls = {
-			'train':{
-				'images':'http://yann.lecun.com/exdb/mnist/train-images-idx3-ubyte.gz',
-				'labels':'http://yann.lecun.com/exdb/mnist/train-labels-idx1-ubyte.gz'},
-			'test':{
-				'images':'http://yann.lecun.com/exdb/mnist/t10k-images-idx3-ubyte.gz',
-				'labels':'http://yann.lecun.com/exdb/mnist/t10k-labels-idx1-ubyte.gz'}
-		}
-
-		# Define function to process (via numpy) image files
-		def extract_images(gz_file):
-			with gzip.open(os.path.join('.',im_dir,raw_dir,gz_file)) as f:
-				zero, data_type, dims = struct.unpack('>HBB', f.read(4))
-				shape = tuple(struct.unpack('>I', f.read(4))[0] for d in range(dims))
-				images = np.fromstring(f.read(), dtype=np.uint8).reshape(shape)
-			print(f'Image array shape: {shape}')
-			return images
-		# Define function to process (via numpy) image label files
-		def extract_labels(gz_file):
-			with gzip.open(os.path.join('.',im_dir,raw_dir,gz_file)) as f:
-				f.read(8)
-				labels = np.frombuffer(f.read(), dtype=np.uint8).astype(np.int64)
-			print(f'Image label array shape: {labels.shape}')
-			return labels
-
-		# Loop each exp. set [training and test]
-		for set_label, urls in image_urls.items():
-			# Check for /raw folder, create one if doesn't exist
-			if not os.path.isdir(os.path.join('.',im_dir,raw_dir)):
-				os.mkdir(os.path.join('.',im_dir,raw_dir))
-			# Check for raw (compressed) images
-			if not os.path.isfile(os.path.join('.',im_dir,raw_dir,set_label+'_images.gz')):
-				print(f'Downloading {set_label} images')
-				wget.download(urls['images'],os.path.join('.',im_dir,raw_dir,set_label+'_images.gz'))
-			# Check for raw (compressed) labels
-			if not os.path.isfile(os.path.join('.',im_dir,raw_dir,set_label+'_labels.gz')):
-				print(f'Downloading {set_label} labels')
-				wget.download(urls['labels'],os.path.join('.',im_dir,raw_dir,set_label+'_labels.gz'))
-
-			print(f'Reading {set_label} images')
-			images = extract_images(set_label+'_images.gz')
-			print(f'Reading {set_label} labels')
-			labels = extract_labels(set_label+'_labels.gz')
-			print(f'Saving {set_label} images and labels')
-			np.save(os.path.join('.',im_dir,raw_dir,set_label+'_images.npy'),images)
-			np.save(os.path.join('.',im_dir,raw_dir,set_label+'_labels.npy'),labels)
-
-	train_imgs = np.load(os.path.join('.',im_dir,raw_dir,'train_images.npy'))
-	train_lbls = np.load(os.path.join('.',im_dir,raw_dir,'train_labels.npy'))
-	test_imgs = np.load(os.path.join('.',im_dir,raw_dir,'test_images.npy'))
-	test_lbls = np.load(os.path.join('.',im_dir,raw_dir,'test_labels.npy'))
-
-	return train_imgs, train_lbls, test_imgs, test_lbls
+		_os.makedirs(raw_dir, exist_ok=True)
+		for names in _MNIST_FILES.values():
+			fpath = _os.path.join(raw_dir, names[0] + '.gz')
+			if not _os.path.isfile(fpath):
+				print('Downloading {}'.format(names[0]))
+				for url in _MNIST_URLS:
+					try:
+						_request.urlretrieve(url + names[0] + '.gz', fpath + '.part')
+						break
+					except OSError as err:
+						error = err
+				else:
+					raise error
+				_os.replace(fpath + '.part', fpath)
+		fpaths = find_files(raw_dir)
+
+	return [ read_idx(fpaths[key]) for key in (('train', 'images'), ('train', 'labels'),
+		('test', 'images'), ('test', 'labels')) ]
 
 # MIT license:
 # Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+"""
+
+.. module:: MNIST_store
+   :platform: Unix
+   :synopsis: Memory-mapped store of the raw MNIST images and labels.
+
+.. moduleauthor:: Adam P. Jones <ajones173@gmail.com>
+
+"""
+
+import numpy as _np
+import os as _os
+import json as _json
+import hashlib as _hashlib
+import shutil as _shutil
+import tempfile as _tempfile
+
+# the arrays of a store, each saved as <name>.npy
+_ARRAYS = ('train_images', 'train_labels', 'test_images', 'test_labels')
+
+def save_store(store_dir, train_images, train_labels, test_images, test_labels):
+	'''
+	Save MNIST to a store: a folder of plain .npy arrays (uint8 images \
+	[#images x 28 x 28] and labels), plus, for each phase, the indices of the \
+	images of each class ('<phase>_class_inds', in their original order, with \
+	class c at [<phase>_class_starts[c]:<phase>_class_starts[c+1]]) and a \
+	checksum of the data. The folder is written under a temporary name and \
+	then renamed, so a partial store is never seen.
+
+	Args:
+		store_dir (str): folder of the store (must not exist yet).
+		train_images, train_labels, test_images, test_labels (numpy array): MNIST.
+
+	Returns
+	-------
+		None
+
+	>>> save_store('/tmp/MNIST_all', train_images, train_labels, test_images, test_labels)
+	'''
+	arrays = dict(zip(_ARRAYS, (train_images, train_labels, test_images, test_labels)))
+	for phase in ('train', 'test'):
+		labels = _np.ravel(arrays[phase + '_labels']).astype(_np.uint8)
+		arrays[phase + '_images'] = _np.ascontiguousarray(arrays[phase + '_images'],
+			dtype=_np.uint8)
+		arrays[phase + '_labels'] = labels
+		arrays[phase + '_class_inds'], arrays[phase + '_class_starts'] = class_index(labels)
+
+	h = _hashlib.sha1()
+	for name in _ARRAYS:
+		h.update(name.encode())
+		h.update(arrays[name].tobytes())
+
+	parent = _os.path.dirname(_os.path.abspath(store_dir))
+	_os.makedirs(parent, exist_ok=True)
+	tmp_dir = _tempfile.mkdtemp(dir=parent, prefix='.tmp_')
+	try:
+		for name, array in arrays.items():
+			_np.save(_os.path.join(tmp_dir, name + '.npy'), array)
+		with open(_os.path.join(tmp_dir, 'checksum.json'), 'w') as f:
+			_json.dump({'sha1':h.hexdigest()}, f)
+		_os.replace(tmp_dir, store_dir)
+	except OSError:
+		_shutil.rmtree(tmp_dir, ignore_errors=True)
+		if not is_store(store_dir): # (else another run saved it first)
+			raise
+
+def class_index(labels, num_classes=10):
+	'''
+	Index the images of each class: the images of class c are \
+	class_inds[class_starts[c]:class_starts[c+1]], in their original order.
+
+	Args:
+		labels (numpy array): class of each image (0 to num_classes-1).
+		num_classes (int): number of classes.
+
+	Returns
+	-------
+		class_inds (numpy array)
+		class_starts (numpy array)
+			[num_classes+1]
+
+	>>> class_inds, class_starts = class_index(train_labels)
+	'''
+	labels = _np.ravel(labels)
+	# a stable sort keeps the images' order within each class
+	class_inds = _np.argsort(labels, kind='stable')
+	class_starts = _np.searchsorted(labels[class_inds], _np.arange(num_classes+1))
+	return class_inds, class_starts
+
+def is_store(store_dir):
+	'''
+	Check if a folder holds an MNIST store (see :func:`save_store`).
+
+	Args:
+		store_dir (str): folder of the store.
+
+	Returns
+	-------
+		exists (bool)
+
+	>>> is_store('/tmp/MNIST_all')
+	'''
+	return _os.path.isfile(_os.path.join(store_dir, 'checksum.json'))
+
+def open_store(store_dir):
+	'''
+	Open an MNIST store with all its arrays memory-mapped (read-only), so \
+	loading takes no time, only the images used are read, and concurrent runs \
+	share one copy of the data (the OS page cache).
+
+	Args:
+		store_dir (str): folder of the store (see :func:`save_store`).
+
+	Returns
+	-------
+		mnist (dict)
+			'train_images', 'train_labels', 'test_images', 'test_labels', the \
+			per-class indices ('train_class_inds', 'train_class_starts', etc) \
+			and 'checksum' (of the data).
+
+	>>> mnist = open_store('/tmp/MNIST_all')
+	'''
+	mnist = {}
+	for fname in _os.listdir(store_dir):
+		if fname.endswith('.npy'):
+			mnist[fname[:-4]] = _np.load(_os.path.join(store_dir, fname), mmap_mode='r')
+	with open(_os.path.join(store_dir, 'checksum.json')) as f:
+		mnist['checksum'] = _json.load(f)['sha1']
+	return mnist
+
+def convert_npy(mnist_fpath, store_dir):
+	'''
+	Convert MNIST saved as a pickled dict in a .npy file (by earlier versions \
+	of :func:`MNIST_make_all.make_MNIST`) to a store.
+
+	Args:
+		mnist_fpath (str): .npy file of the pickled dict.
+		store_dir (str): folder of the store.
+
+	Returns
+	-------
+		None
+
+	>>> convert_npy('/tmp/MNIST_all.npy', '/tmp/MNIST_all')
+	'''
+	mnist = _np.load(mnist_fpath, allow_pickle=True).item()
+	save_store(store_dir, *[ mnist[name] for name in _ARRAYS ])
+
+# MIT license:
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial
+# portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN
+# AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
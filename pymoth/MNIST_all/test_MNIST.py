@@ -1,14 +1,71 @@
 #!/usr/bin/env python3
 
+import os
+import gzip
+import struct
+import shutil
+import numpy as np
 from .MNIST_make_all import make_MNIST
+from .MNIST_read import read_idx
+from .MNIST_store import save_store, open_store, convert_npy
+
+def write_idx(fpath, array, code=0x08):
+    '''Write an array to an IDX file (gzipped, if fpath ends in '.gz').'''
+    data = struct.pack('>BBBB', 0, 0, code, array.ndim) + \
+        struct.pack('>' + 'I'*array.ndim, *array.shape) + array.astype(array.dtype.newbyteorder('>')).tobytes()
+    with (gzip.open if fpath.endswith('.gz') else open)(fpath, 'wb') as f:
+        f.write(data)
 
 def main():
 
     print('Testing MNIST module:')
 
-    make_MNIST('/tmp/foo')
+    # a small dummy dataset
+    train_images = np.random.randint(0, 256, (50, 28, 28), dtype=np.uint8)
+    train_labels = np.random.randint(0, 10, 50)
+    test_images = np.random.randint(0, 256, (20, 28, 28), dtype=np.uint8)
+    test_labels = np.random.randint(0, 10, 20)
+
+    # test read_idx (plain, gzipped and non-uint8 files)
+    os.makedirs('/tmp/foo_raw', exist_ok=True)
+    write_idx('/tmp/foo_raw/train-images-idx3-ubyte.gz', train_images)
+    write_idx('/tmp/foo_raw/train-labels-idx1-ubyte', train_labels.astype(np.uint8))
+    write_idx('/tmp/foo_raw/t10k-images-idx3-ubyte', test_images)
+    write_idx('/tmp/foo_raw/t10k-labels-idx1-ubyte.gz', test_labels.astype(np.uint8))
+    assert np.array_equal( read_idx('/tmp/foo_raw/train-images-idx3-ubyte.gz'), train_images )
+    assert np.array_equal( read_idx('/tmp/foo_raw/t10k-images-idx3-ubyte'), test_images )
+    floats = np.random.rand(3, 4).astype(np.float32)
+    write_idx('/tmp/foo_raw/floats.gz', floats, 0x0D)
+    assert np.array_equal( read_idx('/tmp/foo_raw/floats.gz'), floats )
+    print('\tMNIST_read read_idx test passed')
 
+    # test make_MNIST (from the local IDX files, without downloading)
+    make_MNIST('/tmp/foo', raw_dir='/tmp/foo_raw', download=False)
+    assert np.array_equal( open_store('/tmp/foo')['train_labels'], train_labels )
+    shutil.rmtree('/tmp/foo')
+    shutil.rmtree('/tmp/foo_raw')
     print('\tMNIST_make_all class test passed')
 
+    # test save_store and open_store
+    save_store('/tmp/foo_store', train_images, train_labels, test_images, test_labels)
+    mnist = open_store('/tmp/foo_store')
+    assert np.array_equal( mnist['train_images'], train_images )
+    assert np.array_equal( mnist['test_labels'], test_labels )
+    starts = mnist['train_class_starts']
+    for c in range(10):
+        inds = mnist['train_class_inds'][starts[c]:starts[c+1]]
+        assert np.array_equal( inds, np.nonzero(train_labels==c)[0] )
+    print('\tMNIST_store save_store and open_store test passed')
+
+    # test convert_npy
+    np.save('/tmp/foo_store.npy', {'train_images':train_images, 'train_labels':train_labels,
+        'test_images':test_images, 'test_labels':test_labels})
+    convert_npy('/tmp/foo_store.npy', '/tmp/foo_converted')
+    assert open_store('/tmp/foo_converted')['checksum'] == mnist['checksum']
+    shutil.rmtree('/tmp/foo_store')
+    shutil.rmtree('/tmp/foo_converted')
+    os.remove('/tmp/foo_store.npy')
+    print('\tMNIST_store convert_npy test passed')
+
 if __name__ == '__main__':
     main()
@@ -114,6 +114,7 @@ class MothNet:
 		self.RESULTS_FILENAME = settings.get('results_filename', 'results') # string
 		self.DATA_FOLDER = settings.get('data_folder', '/tmp') # string
 		self.DATA_FILENAME = settings.get('data_filename', 'MNIST_all') # string
+		self._settings = dict(settings) # kept for the workers of run_many
 
 		# Test parameters for compatibility
 		if self.SHOW_ACC_PLOTS or self.SHOW_TIME_PLOTS:
@@ -157,9 +158,7 @@ class MothNet:
 		>>> mothra.load_mnist()
 		"""
 
-		from .modules.generate import generate_ds_mnist
-
-		self._class_labels = _np.array(range(10)) # MNIST classes: digits 0-9
+		self._load_dataset()
 		self._val_per_class = 15  # number of digits used in validation sets and in baseline sets
 
 		# make a vector of the classes of the training samples, randomly mixed:
@@ -168,43 +167,8 @@ class MothNet:
 		# repeat these inputs if taking multiple sniffs of each training sample:
 		self._tr_classes = _np.tile( self._tr_classes, [1, self.NUM_SNIFFS] )[0]
 
-		# Specify pools of indices from which to draw baseline, train, val sets.
-		self._ind_pool_baseline = list(range(100)) # 1:100
-		self._ind_pool_train = list(range(100,300)) # 101:300
-		self._ind_pool_post = list(range(300,400)) # 301:400
-
-		## Create preprocessing parameters
-		# Population pre-processing pools of indices:
-		self._inds_to_ave = list(range(550,1000))
-		self._inds_to_calc_RF = list(range(550,1000)) # pixel indices for receptive field
-		self._max_ind = max( [ self._inds_to_calc_RF + self._ind_pool_train ][0] ) # we'll throw out unused samples
-
-		## 2. Pre-processing parameters for the thumbnails:
-		self._downsample_rate = 2 # image downsampling ratio (n:1)
-		self._crop = 2 # image cropping parameter
-		self._num_features = 85 # number of pixels in the receptive field
-		self._pixel_sum = 6 # normalization factor
-		self._show_thumbnails = self.N_THUMBNAILS
-		self._downsample_method = 1 # 0 means sum square patches of pixels
-							# 1 means use bicubic interpolation
-
-		# generate the data array:
-		# _feat_array is a feature array ready for running experiments.
-		# Each experiment uses a random draw from this dataset.
-		self._feat_array, self._active_pixel_inds, self._len_side = generate_ds_mnist(
-			self._max_ind, self._class_labels, self._crop, self._downsample_rate,
-			self._downsample_method, self._inds_to_ave, self._pixel_sum,
-			self._inds_to_calc_RF, self._num_features, self.SCREEN_SIZE,
-			self.RESULTS_FOLDER, self._show_thumbnails,
-			data_dir = self.DATA_FOLDER, data_fname = self.DATA_FILENAME
-			)
-
-		_, self._num_per_class, self._class_num = self._feat_array.shape
-		# _feat_array = n x m x 10 array where n = #active pixels, m = #digits from each class
-		# that will be used. The 3rd dimension gives the class: 0:9.
-
 		# Line up the images for the experiment (in 10 parallel queues)
-		digit_queues = _np.zeros_like(self._feat_array)
+		digit_queues = _np.zeros(self._feat_array.shape)
 
 		for i in self._class_labels:
 
@@ -247,6 +211,65 @@ class MothNet:
 
 #-------------------------------------------------------------------------------
 
+	def _load_dataset(self):
+		"""
+
+		Set the pre-processing parameters, and generate the (pre-processed) \
+		dataset the first time it is needed. The dataset does not depend on the \
+		run, so later calls (eg by :func:`load_mnist` in each run) reuse it.
+
+		Args:
+			None
+
+		Returns
+		-------
+			None
+
+		>>> mothra._load_dataset()
+
+		"""
+		from .modules.generate import generate_ds_mnist
+
+		self._class_labels = _np.array(range(10)) # MNIST classes: digits 0-9
+
+		# Specify pools of indices from which to draw baseline, train, val sets.
+		self._ind_pool_baseline = list(range(100)) # 1:100
+		self._ind_pool_train = list(range(100,300)) # 101:300
+		self._ind_pool_post = list(range(300,400)) # 301:400
+		# held-out digits, never shown to the moth (see :func:`holdout_set`):
+		self._ind_pool_holdout = list(range(400,550)) # 401:550
+
+		## Create preprocessing parameters
+		# Population pre-processing pools of indices:
+		self._inds_to_ave = list(range(550,1000))
+		self._inds_to_calc_RF = list(range(550,1000)) # pixel indices for receptive field
+		self._max_ind = max( [ self._inds_to_calc_RF + self._ind_pool_train ][0] ) # we'll throw out unused samples
+
+		## 2. Pre-processing parameters for the thumbnails:
+		self._downsample_rate = 2 # image downsampling ratio (n:1)
+		self._crop = 2 # image cropping parameter
+		self._num_features = 85 # number of pixels in the receptive field
+		self._pixel_sum = 6 # normalization factor
+		self._show_thumbnails = self.N_THUMBNAILS
+		self._downsample_method = 1 # 0 means sum square patches of pixels
+							# 1 means use bicubic interpolation
+
+		# generate the data array (once, it does not depend on the run):
+		# _feat_array is a feature array ready for running experiments.
+		# Each experiment uses a random draw from this dataset.
+		if getattr(self, '_feat_array', None) is None:
+			self._feat_array, self._active_pixel_inds, self._len_side = generate_ds_mnist(
+				self._max_ind, self._class_labels, self._crop, self._downsample_rate,
+				self._downsample_method, self._inds_to_ave, self._pixel_sum,
+				self._inds_to_calc_RF, self._num_features, self.SCREEN_SIZE,
+				self.RESULTS_FOLDER, self._show_thumbnails,
+				data_dir = self.DATA_FOLDER, data_fname = self.DATA_FILENAME
+				)
+
+		_, self._num_per_class, self._class_num = self._feat_array.shape
+		# _feat_array = n x m x 10 array where n = #active pixels, m = #digits from each class
+		# that will be used. The 3rd dimension gives the class: 0:9.
+
 	def train_test_split(self, feature_array):
 		"""
 
@@ -291,6 +314,42 @@ class MothNet:
 
 		return train_X, test_X, train_y, test_y
 
+	def holdout_set(self, n_per_class=None):
+		"""
+
+		Draw digits that are not used in the simulation (neither as baseline, \
+		training nor post-training digits) nor in the pre-processing, to score \
+		the trained moth on (see :func:`predict`).
+
+		Args:
+			n_per_class (int): [optional] number of digits of each class. \
+			Defaults to the number of validation digits per class.
+
+		Returns
+		-------
+			holdout_X (numpy array)
+				Feature matrix of the held-out digits
+			holdout_y (numpy array)
+				Labels of the held-out digits
+
+		>>> holdout_X, holdout_y = mothra.holdout_set()
+
+		"""
+
+		if n_per_class is None:
+			n_per_class = self._val_per_class
+
+		holdout_X = _np.zeros((10*n_per_class, self._feat_array.shape[0]))
+		holdout_y = _np.zeros((10*n_per_class, 1))
+
+		for i in self._class_labels:
+			# choose some images from the holdoutIndPool
+			_these_inds = _np.random.choice(self._ind_pool_holdout, n_per_class, replace=False)
+			holdout_X[i*n_per_class:(i+1)*n_per_class,:] = self._feat_array[:,_these_inds,i].T
+			holdout_y[i*n_per_class:(i+1)*n_per_class,:] = i
+
+		return holdout_X, holdout_y
+
 	def load_moth(self):
 		"""
 
@@ -339,7 +398,8 @@ class MothNet:
 		from .modules.params import ExpParams
 		self.experiment_params =  ExpParams( self._tr_classes, self._class_labels, self._val_per_class )
 
-	def simulate(self, feature_array):
+	def simulate(self, feature_array, recorders=None, seed=None, calibration_cache=None,
+		checkpoint=None):
 		"""
 
 		Run the SDE time-stepped evolution of neural firing rates.
@@ -353,6 +413,14 @@ class MothNet:
 		Args:
 			feature_array (numpy array): array of stimuli [num_features X \
 			num_stims_per_class X num_classes]
+			recorders (list): [optional] :class:`record.Recorder` objects, eg a \
+			:class:`record.StatsRecorder` to collect EN stats during the simulation.
+			seed (int): [optional] seed for the noise of the simulation (if None, \
+			it is drawn from numpy's global random state).
+			calibration_cache (str): [optional] folder of calibration snapshots, so \
+			repeated simulations of this moth skip the spontaneous settling phase.
+			checkpoint (str): [optional] .npz file for periodic checkpoints. If it \
+			exists, an interrupted simulation carries on from it.
 
 		Returns
 		-------
@@ -368,7 +436,61 @@ class MothNet:
 			self.GOAL, self.TR_PER_CLASS, self.NUM_SNIFFS))
 
 		# run this experiment as sde time-step evolution:
-		return sde_wrap(self.model_params, self.experiment_params, feature_array )
+		return sde_wrap(self.model_params, self.experiment_params, feature_array,
+			recorders=recorders, seed=seed, calibration_cache=calibration_cache,
+			checkpoint=checkpoint )
+
+	def predict(self, test_X, sim_results, EN_resp_trained, test_y=None, seed=None,
+		noise=True):
+		"""
+
+		Score digits with the trained moth, without re-running the simulation: \
+		each digit is presented once to the moth with its weights frozen at \
+		P2Kfinal and K2Efinal (no octopamine, no Hebbian updates), and is \
+		classified from its peak EN responses by log-likelihood over all ENs.
+
+		Args:
+			test_X (numpy array): Feature matrix of the digits [n x num_features]
+			sim_results (dict): output of :func:`simulate` for this moth.
+			EN_resp_trained (list): class response stats to classify against, \
+			eg the output of :func:`collect_stats` (the post-training responses \
+			of the simulation), or of :func:`modules.predict.en_resp` on the \
+			peaks of a separate labeled calibration set. These must not come \
+			from the digits being scored (use eg :func:`holdout_set`).
+			test_y (numpy array): [optional] labels of the digits, only used to \
+			compute the accuracy.
+			seed (int): [optional] seed for the noise.
+			noise (bool): [optional] if False, use the (much faster) deterministic \
+			response of the moth instead.
+
+		Returns
+		-------
+			output (dict)
+				peaks [n x nE], EN_resp, predicted classes and likelihoods (and \
+				total_acc and acc_perc, if test_y is given).
+
+		>>> output = mothra.predict(holdout_X, sim_results, EN_resp_trained, holdout_y)
+
+		"""
+		from .modules.predict import en_peak_responses, classify_log_likelihood
+
+		peaks = en_peak_responses(self.model_params, self.experiment_params,
+			sim_results, test_X, seed=seed, noise=noise)
+
+		pred_idx, likelihoods = classify_log_likelihood(peaks, EN_resp_trained)
+		output = dict(peaks=peaks, EN_resp=EN_resp_trained,
+			pred_classes=_np.asarray(self._class_labels)[pred_idx],
+			likelihoods=likelihoods)
+
+		if test_y is not None:
+			test_y = _np.ravel(test_y)
+			output['total_acc'] = 100*_np.mean(output['pred_classes'] == test_y)
+			output['acc_perc'] = _np.array([ 100*_np.mean(output['pred_classes'][test_y == c] == c)
+				for c in self._class_labels ])
+			print('Frozen-weights MothNet Accuracy: {}%,'.format(round(output['total_acc'])) + \
+				'by class: {}%'.format(_np.round(output['acc_perc'])))
+
+		return output
 
 	def score_moth_on_MNIST(self, EN_resp_trained):
 		"""
@@ -447,7 +569,8 @@ class MothNet:
 
 		Returns
 		-------
-			None
+			output_knn (dict)
+				total_acc and acc_perc (accuracy by class), in %.
 
 		>>> mothra.score_knn(train_X, train_y, test_X, test_y)
 
@@ -492,6 +615,9 @@ class MothNet:
 			'Trained Accuracy = {}%,'.format(_np.round(100*nn_acc)),
 			'by class: {}% '.format(class_acc) )
 
+		self.output_knn = {'total_acc':100*nn_acc, 'acc_perc':class_acc}
+		return self.output_knn
+
 	def score_svm(self, train_X, train_y, test_X, test_y):
 		"""
 
@@ -506,7 +632,8 @@ class MothNet:
 
 		Returns
 		-------
-			None
+			output_svm (dict)
+				total_acc and acc_perc (accuracy by class), in %.
 
 		>>> mothra.score_svm(train_X, train_y, test_X, test_y)
 
@@ -550,3 +677,288 @@ class MothNet:
 		print('Nearest neighbor (k[# of neighbors]={}):\n'.format(self.NUM_NEIGHBORS),
 			'Trained Accuracy = {}%,'.format(_np.round(100*svm_acc)),
 			'by class: {}% '.format(class_acc))
+
+		self.output_svm = {'total_acc':100*svm_acc, 'acc_perc':class_acc}
+		return self.output_svm
+
+	def run_many(self, n_runs=None, workers=None, seed=None, blas_threads=1):
+		"""
+
+		Run the full experiment (load_mnist, train_test_split, load_moth, load_exp, \
+		simulate, collect_stats and the scoring methods) `n_runs` times, fanned \
+		out to a pool of worker processes.
+
+		Each run gets its own moth, built with the settings of this MothNet, and \
+		independent random streams: a child of `seed` (a numpy SeedSequence) \
+		seeds both numpy's global random state in the worker (digit draws and \
+		connection matrices) and the noise of the simulation. The pre-processed \
+		dataset does not depend on the run, so it is generated once, here, and \
+		sent once to each worker. The BLAS thread \
+		pool of each worker is capped at `blas_threads`, so the workers do not \
+		oversubscribe the cores. Images are saved with the run number appended \
+		to RESULTS_FILENAME.
+
+		Args:
+			n_runs (int): [optional] number of runs (default NUM_RUNS).
+			workers (int): [optional] number of worker processes (default: the \
+			number of cores over `blas_threads`). With 1, the runs are done in \
+			this process, one after another.
+			seed (int): [optional] seed of the runs (if None, fresh entropy).
+			blas_threads (int): [optional] max BLAS threads per worker.
+
+		Returns
+		-------
+			scores (list)
+				for each run, a dict of the output dicts of the scoring methods \
+				('log_loss', 'thresholding', 'knn' and 'svm').
+
+		>>> scores = mothra.run_many(32, workers=32, seed=0)
+
+		"""
+		if n_runs is None:
+			n_runs = self.NUM_RUNS
+		run_seeds = _np.random.SeedSequence(seed).spawn(n_runs)
+		tasks = [ (self._settings, run, run_seeds[run], [{}], None) for run in range(n_runs) ]
+		return [ scores[0] for scores in self._map_tasks(tasks, workers, blas_threads) ]
+
+	def sweep(self, grid, n_runs=1, workers=None, seed=None, results_file='sweep.jsonl',
+		calibration_cache=None, blas_threads=1):
+		"""
+
+		Run a grid of experiments over the settings 'goal', 'tr_per_class', \
+		'num_sniffs', 'num_neighbors' and 'box_constraint', with `n_runs` runs \
+		per cell, in a pool of worker processes (see :func:`run_many`).
+
+		The setup is shared between the cells as far as possible:
+			* the pre-processed dataset is generated once, and sent once to each worker.
+			* run r of every cell uses the same moth (connection matrices), the \
+			same digits (for equal tr_per_class and num_sniffs) and the same \
+			simulation seed; the moth is built once per run in each worker and \
+			retrained at each goal (see :func:`ModelParams.set_goal`).
+			* so the calibrated (settled) state of run r is shared by all cells, \
+			through the snapshots in `calibration_cache` (see :func:`simulate`).
+			* cells that only differ in 'num_neighbors' or 'box_constraint' share \
+			one simulation, and only redo the KNN or SVM scoring.
+
+		Each result is appended to `results_file` (JSON lines) as soon as it is \
+		in, and the cells and runs already in the file are skipped, so an \
+		interrupted sweep carries on where it stopped. Plots are switched off.
+
+		Args:
+			grid (dict): lists of values of the settings to sweep, eg \
+			{'goal':[5, 10, 15], 'tr_per_class':[1, 3]}. Other settings are \
+			those of this MothNet.
+			n_runs (int): [optional] number of runs of each cell.
+			workers (int): [optional] number of worker processes (see :func:`run_many`).
+			seed (int): [optional] seed of the sweep (if None, fresh entropy).
+			results_file (str): [optional] JSON lines file of the results.
+			calibration_cache (str): [optional] folder of calibration snapshots \
+			(if None, a temporary folder for this sweep).
+			blas_threads (int): [optional] max BLAS threads per worker.
+
+		Returns
+		-------
+			results (list)
+				one dict per cell and run (including those already in \
+				`results_file`): the settings of the cell, the run, and the \
+				accuracies (in %) of MothNet (log-likelihood and thresholding), \
+				KNN and SVM.
+
+		>>> results = mothra.sweep({'goal':[5, 10, 15], 'tr_per_class':[1, 3]}, n_runs=5)
+
+		"""
+		import itertools as _itertools
+		import json as _json
+		import tempfile as _tempfile
+
+		unknown = set(grid) - set(_SWEEP_KEYS)
+		if unknown:
+			raise ValueError('cannot sweep over {}, only over {}'.format(sorted(unknown),
+				_SWEEP_KEYS))
+		settings = dict(self._settings, show_acc_plots=False, show_time_plots=False,
+			show_roc_plots=False, n_thumbnails=0)
+		sweep_keys = sorted(grid)
+		cells = [ dict(zip(sweep_keys, values))
+			for values in _itertools.product(*[ grid[k] for k in sweep_keys ]) ]
+
+		# results already in the file:
+		results = []
+		if _os.path.isfile(results_file):
+			with open(results_file) as f:
+				results = [ _json.loads(line) for line in f if line.strip() ]
+		done = { _cell_id(r, sweep_keys) + (r['run'],) for r in results }
+
+		# one task per simulation (ie per run of each cell, up to the scoring
+		# settings), each scoring all the cells that share it:
+		sims = {}
+		for cell in cells:
+			sim_cell = { k : v for k, v in cell.items() if k not in _SCORING_KEYS }
+			sims.setdefault(_cell_id(sim_cell, sweep_keys), (sim_cell, []))[1].append(cell)
+		run_seeds = _np.random.SeedSequence(seed).spawn(n_runs)
+		tasks, task_cells = [], []
+		for sim_cell, sim_cells in sims.values():
+			for run in range(n_runs):
+				todo = [ cell for cell in sim_cells
+					if _cell_id(cell, sweep_keys) + (run,) not in done ]
+				if todo:
+					tasks.append((dict(settings, **sim_cell), run, run_seeds[run], todo, None))
+					task_cells.append(todo)
+
+		with _tempfile.TemporaryDirectory() as tmp_cache:
+			cache = calibration_cache or tmp_cache
+			tasks = [ task[:4] + (cache,) for task in tasks ]
+			with open(results_file, 'a') as f:
+				for i, scores in self._map_tasks(tasks, workers, blas_threads, ordered=False):
+					for cell, score in zip(task_cells[i], scores):
+						record = dict(cell, run=tasks[i][1], **_score_record(score))
+						f.write(_json.dumps(record) + '\n')
+						results.append(record)
+					f.flush()
+
+		return results
+
+	def _map_tasks(self, tasks, workers, blas_threads, ordered=True):
+		"""
+
+		Run tasks (args of :func:`_run_task`) in a pool of worker processes, \
+		sharing the pre-processed dataset of this MothNet with the workers.
+
+		Args:
+			tasks (list): args of each task.
+			workers (int): number of worker processes (default: the number of \
+			cores over `blas_threads`). With 1, the tasks run in this process.
+			blas_threads (int): max BLAS threads per worker.
+			ordered (bool): [optional] if False, yield (index, output) as the \
+			tasks finish, instead of the outputs in order.
+
+		Returns
+		-------
+			outputs (iterator)
+				outputs of :func:`_run_task`.
+
+		>>> outputs = list(mothra._map_tasks(tasks, workers, blas_threads))
+
+		"""
+		import multiprocessing as _mp
+
+		if workers is None:
+			workers = max(1, (_os.cpu_count() or 1)//blas_threads)
+		self._load_dataset()
+		dataset = (self._feat_array, self._active_pixel_inds, self._len_side)
+
+		if workers == 1 or len(tasks) <= 1:
+			_init_worker(dataset, None)
+			try:
+				for i, task in enumerate(tasks):
+					output = _run_task(*task)
+					yield output if ordered else (i, output)
+			finally:
+				_WORKER.clear()
+			return
+
+		# cap the BLAS threads of the workers before they import numpy (they
+		# are spawned, not forked, and inherit this environment):
+		old_env = { var : _os.environ.get(var) for var in _BLAS_THREAD_VARS }
+		_os.environ.update({ var : str(blas_threads) for var in _BLAS_THREAD_VARS })
+		try:
+			# (a multiprocessing Pool, since ProcessPoolExecutor only takes an
+			# mp_context and an initializer from python 3.7 on)
+			with _mp.get_context('spawn').Pool(min(workers, len(tasks)),
+				initializer=_init_worker, initargs=(dataset, blas_threads)) as pool:
+				if ordered:
+					for _, output in pool.imap(_run_indexed_task, enumerate(tasks)):
+						yield output
+				else:
+					for i, output in pool.imap_unordered(_run_indexed_task, enumerate(tasks)):
+						yield i, output
+		finally:
+			for var, val in old_env.items():
+				if val is None:
+					_os.environ.pop(var, None)
+				else:
+					_os.environ[var] = val
+
+# settings that MothNet.sweep can sweep over, and those of them that only
+# affect the scoring (not the simulation)
+_SWEEP_KEYS = ('box_constraint', 'goal', 'num_neighbors', 'num_sniffs', 'tr_per_class')
+_SCORING_KEYS = ('box_constraint', 'num_neighbors')
+
+# environment variables that set the size of the BLAS thread pools
+_BLAS_THREAD_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+	'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+# state of a worker process (or of this process, when run_many runs the tasks
+# itself): the pre-processed dataset, and the moth of each run
+_WORKER = {}
+
+def _init_worker(dataset, blas_threads):
+	_WORKER.clear()
+	_WORKER['dataset'] = dataset
+	_WORKER['moths'] = {}
+	if blas_threads is not None:
+		##TEST to see if threadpoolctl is installed (caps BLAS threads in this process)
+		try:
+			from threadpoolctl import threadpool_limits as _threadpool_limits
+			_threadpool_limits(blas_threads)
+		except ImportError:
+			pass
+
+def _run_task(settings, run, seed_seq, variants, calibration_cache):
+	# one simulation of MothNet.run_many or MothNet.sweep, scored with the
+	# settings overrides of each of `variants` (at module level, so that it can
+	# be pickled). Returns the score dicts, one per variant.
+	settings = dict(settings)
+	settings['results_filename'] = '{}_{}'.format(settings.get('results_filename',
+		'results'), run)
+	data_seed, moth_seed, sim_seed = seed_seq.spawn(3)
+
+	mothra = MothNet(settings)
+	mothra._feat_array, mothra._active_pixel_inds, mothra._len_side = _WORKER['dataset']
+	_np.random.seed(data_seed.generate_state(4))
+	feature_array = mothra.load_mnist()
+	train_X, test_X, train_y, test_y = mothra.train_test_split(feature_array)
+
+	# the moth of this run, retrained at this goal:
+	moths = _WORKER['moths']
+	if run not in moths:
+		_np.random.seed(moth_seed.generate_state(4))
+		mothra.load_moth()
+		moths[run] = _copy.deepcopy(mothra.model_params)
+	mothra.model_params = _copy.deepcopy(moths[run])
+	mothra.model_params.set_goal(mothra.GOAL)
+	mothra.load_exp()
+
+	sim_results = mothra.simulate(feature_array, seed=sim_seed,
+		calibration_cache=calibration_cache)
+	EN_resp_trained = mothra.collect_stats(sim_results, mothra.experiment_params,
+		mothra._class_labels, mothra.SHOW_TIME_PLOTS, mothra.SHOW_ACC_PLOTS,
+		images_filename=mothra.RESULTS_FILENAME, images_folder=mothra.RESULTS_FOLDER,
+		screen_size=mothra.SCREEN_SIZE)
+	mothra.score_moth_on_MNIST(EN_resp_trained)
+
+	all_scores = []
+	for variant in variants:
+		mothra.NUM_NEIGHBORS = variant.get('num_neighbors', mothra.NUM_NEIGHBORS)
+		mothra.BOX_CONSTRAINT = variant.get('box_constraint', mothra.BOX_CONSTRAINT)
+		all_scores.append({'run':run, 'log_loss':mothra.output_trained_log_loss,
+			'thresholding':mothra.output_trained_thresholding,
+			'knn':mothra.score_knn(train_X, train_y, test_X, test_y),
+			'svm':mothra.score_svm(train_X, train_y, test_X, test_y)})
+	return all_scores
+
+def _run_indexed_task(indexed_task):
+	# _run_task of an (index, args) pair, for Pool.imap (which passes one arg)
+	i, task = indexed_task
+	return i, _run_task(*task)
+
+def _cell_id(cell, keys):
+	# hashable id of a (partial) sweep cell
+	return tuple( (k, cell[k]) for k in keys if k in cell )
+
+def _score_record(scores):
+	# accuracies of a score dict of _run_task, for the JSON lines of MothNet.sweep
+	record = {}
+	for name in ('log_loss', 'thresholding', 'knn', 'svm'):
+		record[name + '_acc'] = float(scores[name]['total_acc'])
+		record[name + '_acc_perc'] = _np.asarray(scores[name]['acc_perc']).tolist()
+	return record
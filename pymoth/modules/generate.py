@@ -12,11 +12,15 @@
 
 import numpy as _np
 import os as _os
-from skimage.transform import downscale_local_mean
+import json as _json
+import hashlib as _hashlib
+import shutil as _shutil
+import tempfile as _tempfile
+from ..MNIST_all.MNIST_store import is_store, open_store, convert_npy, class_index
 
 def generate_ds_mnist( max_ind, class_labels, crop, downsample_ratio, downsample_method,
 inds_to_ave, pixel_sum, inds_to_calc_RF, num_features, screen_size, save_results_folder,
-show_thumbnails, data_dir='/tmp', data_fname='MNIST_all'):
+show_thumbnails, data_dir='/tmp', data_fname='MNIST_all', cache=True, chunk_size=1000):
 	"""
 	Preprocessing:
 		#. Load MNIST
@@ -31,6 +35,12 @@ show_thumbnails, data_dir='/tmp', data_fname='MNIST_all'):
 	a 12 x 12 thumbnail (eg for viewing, or for CNN use) the active pixel indices \
 	can be embedded in a 144 x 1 col vector of zeros, then reshaped into a 12 x 12 image.
 
+	The output only depends on the preprocessing arguments and the MNIST data, \
+	so (with `cache`) it is saved in a folder `<data_fname>_cache` next to the \
+	data, keyed by :func:`dataset_key`, and later calls load it as memory-mapped \
+	(read-only) arrays instead of redoing the preprocessing. The thumbnails of \
+	:func:`select_active_pixels` are only shown when the preprocessing is done.
+
 	Args:
 		max_ind (int): maximum number of samples to use
 		class_labels (numpy array): numeric classes (for MNIST, digits 0:9)
@@ -46,6 +56,9 @@ show_thumbnails, data_dir='/tmp', data_fname='MNIST_all'):
 		show_thumbnails (int): number of thumbnails to show for each class (0 means none)
 		data_dir (str): optional keyword arg specifying where to save data
 		data_fname (str): optional keyword arg specifying filename of saved data
+		cache (bool): optional keyword arg, False to skip the cache of preprocessed data
+		chunk_size (int): optional keyword arg, number of images preprocessed at once \
+		(see :func:`iter_feature_chunks`)
 
 	Returns
 	-------
@@ -82,103 +95,372 @@ show_thumbnails, data_dir='/tmp', data_fname='MNIST_all'):
 		_os.mkdir(data_dir)
 		print('\nCreating data directory: {}\n'.format(data_dir))
 
-	mnist_fpath = data_dir + _os.sep + data_fname + '.npy'
-
-	# test for npy file before loading. run creation script, if absent.
-	if not _os.path.isfile(mnist_fpath):
-		# download and save data from the web
-		from ..MNIST_all import MNIST_make_all
-		MNIST_make_all.make_MNIST(mnist_fpath)
-
-	# 1. extract mnist:
-	mnist = _np.load(mnist_fpath, allow_pickle = True).item()
-	# loads dictionary 'mnist' with keys:value pairs =
-	# .train_images, .test_images, .train_labels, .test_labels (ie the original data from PMTK3)
-	# AND parsed by class. These fields are used to assemble the image_array:
-	# .trI_* = train_images of class *
-	# .teI_* = test_images of class *
-	# .trL_* = train_labels of class *
-	# .teL_* = test_labels of class *
-
-	# extract the required images and classes
+	store_dir = data_dir + _os.sep + data_fname
+
+	# test for the MNIST store before loading. create it, if absent:
+	if not is_store(store_dir):
+		if _os.path.isfile(store_dir + '.npy'):
+			# convert the data saved (as a pickled dict) by earlier versions
+			convert_npy(store_dir + '.npy', store_dir)
+		else:
+			# download and save data from the web
+			from ..MNIST_all import MNIST_make_all
+			MNIST_make_all.make_MNIST(store_dir)
+
+	# 1. open mnist (memory-mapped, so only the images used are read):
+	mnist = open_store(store_dir)
+	# dictionary 'mnist' with keys:value pairs =
+	# .train_images, .test_images, .train_labels, .test_labels (ie the original data)
+	# AND the per-class indices and the checksum of the data.
+
+	# reuse the output of an earlier call with the same arguments and data:
+	if cache:
+		cache_path = data_dir + _os.sep + data_fname + '_cache' + _os.sep + \
+			'mnist_' + dataset_key(mnist['checksum'], max_ind, class_labels, crop,
+			downsample_ratio, downsample_method, inds_to_ave, pixel_sum,
+			inds_to_calc_RF, num_features)
+		cached = load_cached_dataset(cache_path)
+		if cached is not None:
+			return cached
+
+	# a. the overall average image and the active pixels, from the images in
+	# 'inds_to_ave' and 'inds_to_calc_RF' only
+	overall_ave, active_pixel_inds = preprocessing_stats(mnist, class_labels, crop,
+		downsample_ratio, downsample_method, inds_to_ave, pixel_sum, inds_to_calc_RF,
+		num_features, screen_size, save_results_folder, show_thumbnails)
+
+	len_side = len(overall_ave) # save to allow sde_EM_evolution to print thumbnails.
+
+	# b. preprocess the images of each class in chunks, projected straight onto
+	# the active pixels, so only one chunk is ever held at full size
 	image_indices = range(max_ind+1)
-	image_array = extract_mnist_feature_array(mnist, class_labels, image_indices, 'train')
-	# image_array = numberImages x h x w x numberClasses 4-D array. class order: 1 to 10 (10 = '0')
-
-	# calc new dimensions
-	im_z, im_height, im_width, label_len = image_array.shape
-	crop_val = crop*_np.ones(4,dtype = int)
-	new_width = (im_width-_np.sum(crop_val[2:]))/downsample_ratio
-	new_height = (im_height-_np.sum(crop_val[0:2]))/downsample_ratio
-	new_length = int(new_width*new_height)
-
-	feature_array = _np.zeros((new_length, im_z, label_len)) # pre-allocate
-
-	# crop, downsample, and vectorize the average images and the image stacks
-	for c in range(label_len):
-		# feature_array[...,n] : [a x numImages] array,
-		# 	where a = number of pixels in the cropped and downsampled images
-		feature_array[...,c] = crop_downsample_vectorize_images(image_array[...,c],
-			crop, downsample_ratio, downsample_method)
-
-	del image_array # to save memory
-
-	# subtract a mean image from all feature vectors, then make values non-negative
-
-	# a. Make an overall average feature vector, using the samples specified in 'indsToAverage'
-	overall_ave = _np.zeros((new_length, )) # pre-allocate col vector
-	class_ave_raw = _np.zeros((new_length, label_len))
-	for c in range(label_len):
-		class_ave_raw[:,c] = average_image_stack(feature_array[:, inds_to_ave, c],
-			list(range(len(inds_to_ave))) )
-		overall_ave += class_ave_raw[:,c]
-	overall_ave /= label_len
-
-	# b. Subtract this overall_ave image from all images
-	ave_2D = _np.tile(overall_ave,(im_z,1)).T
-	ave_3D = _np.repeat(ave_2D[:,:,_np.newaxis],label_len,2)
-	feature_array -= ave_3D
-	del ave_2D, ave_3D
-
-	feature_array = _np.maximum(feature_array, 0) # remove any negative pixel values
-
-	# c. Normalize each image so the pixels sum to the same amount
-	f_sums = _np.sum(feature_array, axis=0)
-	norm_array = _np.repeat(f_sums[_np.newaxis,:,:],new_length,0)
-	feature_array *= pixel_sum
-	feature_array /= norm_array
+	feature_array = _np.zeros((len(active_pixel_inds), max_ind+1, len(class_labels)))
+	for i, c in enumerate(class_labels):
+		images = class_images(mnist, c, image_indices, 'train')
+		start = 0
+		for chunk in iter_feature_chunks(images, crop, downsample_ratio, downsample_method,
+			overall_ave, pixel_sum, active_pixel_inds, chunk_size):
+			feature_array[:, start:start+chunk.shape[1], i] = chunk
+			start += chunk.shape[1]
+	feature_array = feature_array.squeeze()
 	# feature_array now consists of mean-subtracted, non-negative,
-	# normalized (by sum of pixels) columns, each column a vectorized thumbnail.
-	# size = 144 x numDigitsPerClass x 10
+	# normalized (by sum of pixels) columns of the active pixels of the thumbnails.
+	# size = num_features x numDigitsPerClass x 10
 
-	len_side = new_length # save to allow sde_EM_evolution to print thumbnails.
+	if cache:
+		save_cached_dataset(cache_path, feature_array, active_pixel_inds, len_side)
 
-	# d. Define a Receptive Field, ie the active pixels
-	# Reduce the number of features by getting rid of less-active pixels.
-	# If we are using an existing moth then active_pixel_inds is already defined, so
-	# we need to load the modelParams to get the number of features
-	# (since this is defined by the AL architecture):
+	return feature_array, active_pixel_inds, len_side
+
+# version of the preprocessing, part of the keys of the cached outputs (2: the
+# sum of square patches of downsample_method 0 is aligned with the image, 3: the
+# images are extracted as float32)
+_PREPROCESSING_VERSION = 3
+
+def dataset_key( data_checksum, max_ind, class_labels, crop, downsample_ratio,
+downsample_method, inds_to_ave, pixel_sum, inds_to_calc_RF, num_features ):
+	"""
+
+	Hash the inputs of the preprocessing of :func:`generate_ds_mnist`, ie its \
+	arguments and the checksum of the MNIST data, to name the cached output.
+
+	Args:
+		data_checksum (str): checksum of the MNIST data (see \
+		:func:`MNIST_store.open_store`).
+		max_ind, class_labels, crop, downsample_ratio, downsample_method, \
+		inds_to_ave, pixel_sum, inds_to_calc_RF, num_features: as for \
+		:func:`generate_ds_mnist`.
+
+	Returns
+	-------
+		key (str)
+			hex digest.
+
+	>>> key = dataset_key(mnist['checksum'], 999, class_labels, 2, 2, 1, inds_to_ave, 6, inds_to_calc_RF, 85)
+
+	"""
+	def ints(x):
+		return [ int(i) for i in _np.ravel(x) ]
+
+	params = [ int(max_ind), ints(class_labels), ints(crop), int(downsample_ratio),
+		int(downsample_method), ints(inds_to_ave), float(pixel_sum), ints(inds_to_calc_RF),
+		int(num_features), str(data_checksum), _PREPROCESSING_VERSION ]
+	return _hashlib.sha1(_json.dumps(params).encode()).hexdigest()
+
+def save_cached_dataset( cache_path, feature_array, active_pixel_inds, len_side ):
+	"""
+
+	Save the output of :func:`generate_ds_mnist` as a folder of .npy files. \
+	The folder is written under a temporary name and then renamed, so \
+	concurrent runs never see a partial one.
+
+	Args:
+		cache_path (str): folder to create.
+		feature_array, active_pixel_inds, len_side: output of :func:`generate_ds_mnist`.
+
+	Returns
+	-------
+		None
+
+	>>> save_cached_dataset(cache_path, feature_array, active_pixel_inds, len_side)
+
+	"""
+	parent = _os.path.dirname(cache_path)
+	_os.makedirs(parent, exist_ok=True)
+	tmp_path = _tempfile.mkdtemp(dir=parent, prefix='.tmp_')
+	try:
+		_np.save(tmp_path + _os.sep + 'feature_array.npy', _np.ascontiguousarray(feature_array))
+		_np.save(tmp_path + _os.sep + 'active_pixel_inds.npy', active_pixel_inds)
+		_np.save(tmp_path + _os.sep + 'len_side.npy', len_side)
+		_os.replace(tmp_path, cache_path)
+	except OSError:
+		# eg another run saved it first
+		_shutil.rmtree(tmp_path, ignore_errors=True)
+
+def load_cached_dataset( cache_path ):
+	"""
+
+	Load the output of :func:`generate_ds_mnist` saved by \
+	:func:`save_cached_dataset`, with the feature array memory-mapped (read-only).
+
+	Args:
+		cache_path (str): folder of the cached output.
+
+	Returns
+	-------
+		dataset (tuple)
+			(feature_array, active_pixel_inds, len_side), or None if it is not cached.
+
+	>>> dataset = load_cached_dataset(cache_path)
+
+	"""
+	if not _os.path.isdir(cache_path):
+		return None
+	feature_array = _np.load(cache_path + _os.sep + 'feature_array.npy', mmap_mode='r')
+	active_pixel_inds = _np.load(cache_path + _os.sep + 'active_pixel_inds.npy')
+	len_side = int(_np.load(cache_path + _os.sep + 'len_side.npy'))
+	return feature_array, active_pixel_inds, len_side
 
-	# reduce pixel number (downsample) to reflect # of features in moth brain
-	fA_sub = feature_array[:, inds_to_calc_RF, :]
+def preprocessing_stats(mnist, class_labels, crop, downsample_ratio, downsample_method,
+inds_to_ave, pixel_sum, inds_to_calc_RF, num_features, screen_size, save_results_folder='',
+show_thumbnails=0, phase_label='train'):
+	"""
+
+	Computes what the preprocessing of :func:`generate_ds_mnist` needs from the \
+	dataset: the overall average image, subtracted from all images, and the \
+	active pixels (receptive field). Only the images in `inds_to_ave` and \
+	`inds_to_calc_RF` are read. With these, any number of images can then be \
+	preprocessed in chunks (see :func:`iter_feature_chunks`).
+
+	Args:
+		mnist (dict): MNIST, from :func:`MNIST_store.open_store`
+		class_labels (numpy array): numeric classes (for MNIST, digits 0:9)
+		crop (int): image cropping parameter
+		downsample_ratio (int): image downsample ratio (n:1)
+		downsample_method (int): method for downsampling image
+		inds_to_ave (numpy array): images of each class to average
+		pixel_sum (int): normalization factor
+		inds_to_calc_RF (numpy array): images of each class for the receptive field
+		num_features (int): number of pixels in the receptive field
+		screen_size (tuple): screen size (width, height) for images
+		save_results_folder (str): where to save the thumbnails (if empty, don't save)
+		show_thumbnails (int): number of thumbnails to show for each class (0 means none)
+		phase_label (str): Image set to draw from ('train' or 'test')
+
+	Returns
+	-------
+		overall_ave (numpy array)
+			average of the class average thumbnails [#pixels]
+		active_pixel_inds (numpy array)
+			indices of the active pixels of the thumbnails
+
+	>>> overall_ave, active_pixel_inds = preprocessing_stats(mnist, class_labels, \
+	2, 2, 1, range(550,1000), 6, range(550,1000), 85, (1920, 1080))
+
+	"""
+
+	# a. Make an overall average feature vector, using the samples specified in 'inds_to_ave'
+	class_aves = [ crop_downsample_vectorize_images(
+		class_images(mnist, c, inds_to_ave, phase_label).astype(_np.float32)/256,
+		crop, downsample_ratio, downsample_method).mean(axis=1, dtype=_np.float64)
+		for c in class_labels ]
+	overall_ave = _np.mean(class_aves, axis=0)
+
+	# b. Define a Receptive Field, ie the active pixels
+	# Reduce the number of features by getting rid of less-active pixels.
+	fA_sub = _np.stack([ preprocess_images(class_images(mnist, c, inds_to_calc_RF, phase_label),
+		crop, downsample_ratio, downsample_method, overall_ave, pixel_sum)
+		for c in class_labels ], axis=2)
 	active_pixel_inds = select_active_pixels(fA_sub, num_features,
 		screen_size, save_image_folder=save_results_folder,
 		show_thumbnails=show_thumbnails)
-	feature_array = feature_array[active_pixel_inds,:,:].squeeze() # Project onto the active pixels
 
-	return feature_array, active_pixel_inds, len_side
+	return overall_ave, active_pixel_inds
 
-def extract_mnist_feature_array(mnist, labels, image_indices, phase_label):
+def preprocess_images(images, crop, downsample_ratio, downsample_method, overall_ave, pixel_sum):
 	"""
 
-	Extracts a subset of the samples from each class, converts the images to doubles \
-	on [0 1], and returns a 4-D array.
+	Preprocesses a stack of images: crop, downsample and vectorize them, \
+	subtract the overall average image, make the values non-negative, and \
+	normalize each image so its pixels sum to `pixel_sum`.
 
 	Args:
-		mnist (dict): loaded from `MNIST_all.npy`
+		images (numpy array): [#images x height x width], uint8 (on [0 255]) or \
+		floats on [0 1]
+		crop (int): image cropping parameter
+		downsample_ratio (int): image downsample ratio (n:1)
+		downsample_method (int): method for downsampling image
+		overall_ave (numpy array): overall average thumbnail [#pixels], from \
+		:func:`preprocessing_stats`
+		pixel_sum (int): normalization factor
+
+	Returns
+	-------
+		features (numpy array)
+			[#pixels x #images]
+
+	>>> features = preprocess_images(mnist['test_images'][:100], 2, 2, 1, overall_ave, 6)
+
+	"""
+
+	if images.dtype == _np.uint8:
+		images = images.astype(_np.float32)/256
+
+	features = crop_downsample_vectorize_images(images, crop, downsample_ratio,
+		downsample_method).astype(_np.float64)
+
+	# subtract the overall average image (broadcast over the images), then make
+	# values non-negative
+	features -= overall_ave[:, _np.newaxis]
+	_np.maximum(features, 0, out=features)
+
+	# normalize each image so the pixels sum to the same amount
+	f_sums = _np.sum(features, axis=0)
+	features *= pixel_sum
+	features /= f_sums
+
+	return features
+
+def iter_feature_chunks(images, crop, downsample_ratio, downsample_method, overall_ave,
+pixel_sum, active_pixel_inds=None, chunk_size=1000):
+	"""
+
+	Generator that preprocesses a stack of images (see :func:`preprocess_images`) \
+	in chunks of `chunk_size` images, in order, optionally projected onto the \
+	active pixels. Memory use is bounded by the chunk size, so whole image sets \
+	(eg the memory-mapped mnist['train_images']) can be processed.
+
+	Args:
+		images (numpy array): [#images x height x width], uint8 (on [0 255]) or \
+		floats on [0 1]
+		crop (int): image cropping parameter
+		downsample_ratio (int): image downsample ratio (n:1)
+		downsample_method (int): method for downsampling image
+		overall_ave (numpy array): overall average thumbnail, from \
+		:func:`preprocessing_stats`
+		pixel_sum (int): normalization factor
+		active_pixel_inds (numpy array): pixels to keep (None keeps all)
+		chunk_size (int): number of images per chunk
+
+	Yields
+	------
+		features (numpy array)
+			[#features x #images in the chunk]
+
+	>>> for chunk in iter_feature_chunks(mnist['test_images'], 2, 2, 1, \
+	overall_ave, 6, active_pixel_inds):
+
+	"""
+
+	for start in range(0, len(images), chunk_size):
+		features = preprocess_images(images[start:start+chunk_size], crop,
+			downsample_ratio, downsample_method, overall_ave, pixel_sum)
+		if active_pixel_inds is not None:
+			features = features[active_pixel_inds]
+		yield features
+
+def write_feature_array(fpath, images, crop, downsample_ratio, downsample_method,
+overall_ave, pixel_sum, active_pixel_inds, chunk_size=1000):
+	"""
+
+	Preprocesses a stack of images chunk by chunk (see :func:`iter_feature_chunks`) \
+	into a .npy file, so feature arrays larger than memory can be built.
+
+	Args:
+		fpath (str): path of the .npy file
+		images (numpy array): [#images x height x width]
+		crop, downsample_ratio, downsample_method, overall_ave, pixel_sum, \
+		active_pixel_inds, chunk_size: see :func:`iter_feature_chunks`
+
+	Returns
+	-------
+		feature_array (numpy array)
+			the file, memory-mapped (read-only) [#active pixels x #images]
+
+	>>> test_X = write_feature_array('/tmp/test_X.npy', mnist['test_images'], 2, 2, 1, \
+	overall_ave, 6, active_pixel_inds)
+
+	"""
+
+	out = _np.lib.format.open_memmap(fpath, mode='w+', dtype=_np.float64,
+		shape=(len(active_pixel_inds), len(images)))
+	start = 0
+	for chunk in iter_feature_chunks(images, crop, downsample_ratio, downsample_method,
+		overall_ave, pixel_sum, active_pixel_inds, chunk_size):
+		out[:, start:start+chunk.shape[1]] = chunk
+		start += chunk.shape[1]
+	out.flush()
+	del out
+
+	return _np.load(fpath, mmap_mode='r')
+
+def class_images(mnist, label, image_indices, phase_label):
+	"""
+
+	Picks out images of one class, by their position in the class, with the \
+	per-class index of the store (see :func:`MNIST_store.class_index`).
+
+	Args:
+		mnist (dict): MNIST, from :func:`MNIST_store.open_store`
+		label (int): class
+		image_indices (range): images you want from the class
+		phase_label (str): Image set to draw from ('train' or 'test')
+
+	Returns
+	-------
+		images (numpy array)
+			[#images x image_height x image_width], uint8
+
+	>>> images = class_images(mnist, 3, range(1000), 'train')
+
+	"""
+
+	# per-class index of the images (built here, if missing from mnist)
+	if phase_label + '_class_inds' in mnist:
+		class_inds = mnist[phase_label + '_class_inds']
+		class_starts = mnist[phase_label + '_class_starts']
+	else:
+		class_inds, class_starts = class_index(mnist[phase_label + '_labels'])
+
+	inds = class_inds[class_starts[label]:class_starts[label+1]][_np.asarray(image_indices)]
+
+	return mnist[phase_label + '_images'][inds]
+
+def extract_mnist_feature_array(mnist, labels, image_indices, phase_label, dtype=_np.float32):
+	"""
+
+	Extracts a subset of the samples from each class, converts the images to floats \
+	on [0 1], and returns a 4-D array. Only the requested images are read and \
+	converted, picked out with the per-class index of the store (see \
+	:func:`MNIST_store.class_index`).
+
+	Args:
+		mnist (dict): MNIST, from :func:`MNIST_store.open_store`
 		labels (numpy array): numeric classes (for MNIST, digits 0:9)
 		image_indices (range): images you want from each class
 		phase_label (str): Image set to draw from ('train' or 'test')
+		dtype (numpy dtype): data type of the output (pixel values k/256 are \
+		exact in float32)
 
 	Returns
 	-------
@@ -191,26 +473,19 @@ def extract_mnist_feature_array(mnist, labels, image_indices, phase_label):
 	"""
 
 	# get some dimensions:
-	(h,w) = mnist['train_images'].shape[1:3]
-	max_ind = max(image_indices)
+	(h,w) = mnist[phase_label + '_images'].shape[1:3]
+	image_indices = _np.asarray(image_indices)
+	max_ind = image_indices.max()
 
 	# initialize outputs:
-	im_array = _np.zeros((max_ind+1, h, w, len(labels)))
+	im_array = _np.zeros((max_ind+1, h, w, len(labels)), dtype=dtype)
 
 	# process each class in turn:
-	for c in labels:
-		if phase_label=='train': # 1 = extract train, 0 = extract test
-			im_data = mnist['train_images']
-			target_data = mnist['train_labels']
-		else:
-			im_data = mnist['test_images']
-			target_data = mnist['test_labels']
-
-		# Convert from (8-bit) unsigned integers to double precision float
+	for i, c in enumerate(labels):
+		# Convert from (8-bit) unsigned integers to float, only the images used
 		#  see: (https://docs.scipy.org/doc/numpy-1.13.0/user/basics.types.html)
-		class_array = im_data[target_data==c].astype('float64')/256
-
-		im_array[image_indices,:,:,c] = class_array[image_indices,:,:]
+		im_array[image_indices,:,:,i] = class_images(mnist, c, image_indices,
+			phase_label).astype(dtype)/256
 
 	return im_array
 
@@ -225,7 +500,7 @@ def crop_downsample_vectorize_images(im_stack, crop_val, downsample_ratio, downs
 		bottom, left, right]
 		downsample_ratio (int): image downsample ratio (n:1)
 		downsample_method (int): method for downsampling image (0: sum square patches, \
-		1: bicubic interpolation)
+		1: mean of square patches)
 
 	Returns
 	-------
@@ -245,33 +520,27 @@ def crop_downsample_vectorize_images(im_stack, crop_val, downsample_ratio, downs
 	else:
 		im_height,im_width = im_stack.shape
 		im_z = 1
-
-	width = range(crop_val[2], im_width-crop_val[3])
-	height = range(crop_val[0], im_height-crop_val[1])
-
-	new_width = (im_width-_np.sum(crop_val[2:]))/downsample_ratio
-	new_height = (im_height-_np.sum(crop_val[0:2]))/downsample_ratio
-
-	im_col_array = _np.zeros((int(new_width*new_height),im_z))
-	# crop, downsample, vectorize the thumbnails one-by-one
-	for s in range(im_z):
-		t = im_stack[s,...]
-		# crop image
-		ixgrid = _np.ix_(width, height)
-		t = t[ixgrid]
-
-		if downsample_method: # bicubic
-			t2 = downscale_local_mean(t, (downsample_ratio, downsample_ratio))
-
-		else: # sum 2 x 2 blocks
-			t2 = _np.zeros((int(len(height)/downsample_ratio),int(len(width)/downsample_ratio)))
-			for i in range(int(len(height)/downsample_ratio)):
-				for j in range(int(len(width)/downsample_ratio)):
-					b = t[(i-1)*downsample_ratio+1:i*downsample_ratio+1,
-						(j-1)*downsample_ratio+1:j*downsample_ratio+1]
-					t2[i,j] = b.sum()
-
-		im_col_array[:,s] = t2.flatten()/t2.max()
+		im_stack = im_stack[_np.newaxis,...]
+
+	# crop all the images at once (the rows are cropped by the left/right values
+	# and the cols by the top/bottom values, as in the original per-image loop)
+	t = im_stack[:, crop_val[2]:im_width-crop_val[3], crop_val[0]:im_height-crop_val[1]]
+	_, num_rows, num_cols = t.shape
+	r = downsample_ratio
+	if num_rows % r or num_cols % r:
+		raise ValueError('The cropped images ({} x {}) are not a whole number of {} x {} '
+			'patches'.format(num_rows, num_cols, r, r))
+
+	# downsample all the images at once, over a [#images x rows/r x r x cols/r x r] view
+	patches = t.reshape(im_z, num_rows//r, r, num_cols//r, r)
+	if downsample_method: # mean of square patches (as skimage's downscale_local_mean)
+		t2 = patches.mean(axis=(2,4))
+	else: # sum square patches
+		t2 = patches.sum(axis=(2,4))
+
+	# vectorize, and normalize each thumbnail by its max
+	t2 = t2.reshape(im_z, -1)
+	im_col_array = (t2/t2.max(axis=1, keepdims=True)).T
 
 	return im_col_array
 
@@ -335,9 +604,7 @@ def select_active_pixels( feature_array, num_features, screen_size, save_image_f
 	# each col a class ave 1 to 10 (ie 0), and add a col for the overall_ave
 	num_pix, num_per_class, num_classes  = feature_array.shape
 	cA = _np.zeros((num_pix, num_classes+1))
-
-	for i in range(num_classes):
-		cA[:,i] = average_image_stack(feature_array[:,:,i], list(range(num_per_class)))
+	cA[:,:-1] = _class_averages(feature_array)
 
 	# last col = average image over all digits
 	cA[:,-1] = _np.sum(cA[:,:-1], axis=1) / num_classes
@@ -348,24 +615,7 @@ def select_active_pixels( feature_array, num_features, screen_size, save_image_f
 	cA_norm = cA/_np.tile(z, (num_pix,1))
 
 	# select most active 'num_features' pixels
-	peak_pix = cA[:, :-1]
-	peak_pix_logical = _np.zeros(peak_pix.shape)
-
-	# all the pixel values from all the class averages, in descending order
-	vals = _np.sort(peak_pix.flatten())[::-1]
-
-	# start selecting the highest-valued pixels
-	stop = 0
-	while not stop:
-		thresh = vals.max()
-		peak_pix_logical[peak_pix>=thresh] = 1
-		active_pix = peak_pix_logical.sum(axis=1) # sum the rows
-		# If a class ave had the i'th pixel, selected, keptPixels(i) > 0
-		stop = (active_pix > 0).sum() >= num_features # check if we have enough pixels
-
-		vals = vals[vals < thresh]  # peel off the value(s) just used
-
-	active_pixel_inds = _np.nonzero(active_pix > 0)[0]
+	active_pixel_inds = _most_active_pixels(cA[:, :-1], [num_features])[0]
 
 	if show_thumbnails and save_image_folder:
 
@@ -387,6 +637,55 @@ def select_active_pixels( feature_array, num_features, screen_size, save_image_f
 
 	return active_pixel_inds
 
+def select_active_pixel_sets( feature_array, num_features_list ):
+	"""
+	Select the active pixels (see :func:`select_active_pixels`) for several \
+	receptive field sizes at once, eg for sweeps over the number of features. \
+	The class averages are computed, and the pixels ranked, only once.
+
+	Args:
+		feature_array (numpy array): 3-D array # of features X # samples per class X \
+		# of classes, created by :func:`generate_ds_mnist`.
+		num_features_list (list): numbers of pixels in the receptive fields
+
+	Returns
+	-------
+		active_pixel_inds_list (list)
+			active_pixel_inds (numpy array) for each number of features, as \
+			returned by :func:`select_active_pixels`.
+
+	>>> inds_60, inds_85 = select_active_pixel_sets(feature_array, [60, 85])
+
+	"""
+
+	return _most_active_pixels(_class_averages(feature_array), num_features_list)
+
+def _class_averages( feature_array ):
+	# average image of each class [#pixels x #classes]
+	num_pix, num_per_class, num_classes  = feature_array.shape
+	class_aves = _np.zeros((num_pix, num_classes))
+	for i in range(num_classes):
+		class_aves[:,i] = average_image_stack(feature_array[:,:,i], list(range(num_per_class)))
+	return class_aves
+
+def _most_active_pixels( class_aves, num_features_list ):
+	# Lowering a threshold through the pixel values of the class averages, a pixel
+	# is selected once the threshold reaches its max over the classes. So the
+	# first threshold selecting at least num_features pixels is the
+	# num_features'th highest of these maxes, and all the pixels at or above it
+	# are active (ties included, so there can be more than num_features).
+	peak_pix = _np.max(class_aves, axis=1)
+	vals = _np.sort(peak_pix)[::-1]
+
+	active_pixel_inds_list = []
+	for num_features in num_features_list:
+		if not 0 < num_features <= len(vals):
+			raise ValueError('num_features ({}) must be between 1 and the number of '
+				'pixels ({})'.format(num_features, len(vals)))
+		active_pixel_inds_list.append(_np.nonzero(peak_pix >= vals[num_features-1])[0])
+
+	return active_pixel_inds_list
+
 # MIT license:
 # Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
 # associated documentation files (the "Software"), to deal in the Software without restriction, including
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+
+"""
+
+.. module:: kernels
+   :platform: Unix
+   :synopsis: Compiled (numba) kernel for a time step of the SDE simulation.
+
+.. moduleauthor:: Adam P. Jones <ajones173@gmail.com>
+
+"""
+import numpy as _np
+
+##TEST to see if numba is installed (it is optional):
+try:
+    from numba import njit as _njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+    def _njit(*args, **kwargs):
+        # without numba, the kernel runs as (slow) plain python
+        return lambda f: f
+
+def pack_params( mP, dt, noise_sigs ):
+    """
+    Gather the fixed parameters needed by :func:`fused_step` into contiguous \
+    arrays (the plastic connection matrices are passed separately).
+
+    Args:
+        mP (class): model_params, including connection matrices, etc.
+        dt (float): time step.
+        noise_sigs (tuple): noise vectors (wPsig, wPIsig, wLsig, wRsig, wKsig).
+
+    Returns
+    -------
+        params (tuple)
+            (vectors, matrices, scalars) for :func:`fused_step`.
+
+    >>> params = pack_params(mP, dt, (wPsig, wPIsig, wLsig, wRsig, wKsig))
+
+    """
+    def vec(x):
+        return _np.ascontiguousarray(x, dtype=_np.float64).ravel()
+    def mat(x):
+        return _np.ascontiguousarray(x, dtype=_np.float64)
+
+    RspontRatios = mP.Rspont/mP.Rspont.mean() # used to scale stim inputs
+    wPsig, wPIsig, wLsig, wRsig, wKsig = noise_sigs
+    vectors = ( vec(mP.R2P), vec(mP.R2L), vec(mP.Rspont), vec(RspontRatios),
+        vec(mP.kGlobalDampVec), vec(mP.octo2P), vec(mP.octo2PI), vec(mP.octo2L),
+        vec(mP.octo2R), vec(mP.octo2K), vec(wPsig), vec(wPIsig), vec(wLsig),
+        vec(wRsig), vec(wKsig) )
+    # (R2PI is [nPI x nG], unlike R2P and R2L)
+    matrices = ( mat(mP.L2P), mat(mP.L2PI), mat(mP.R2PI), mat(mP.L2L), mat(mP.L2R) )
+    scalars = _np.array([ dt, mP.tau_P, mP.tau_PI, mP.tau_L, mP.tau_R, mP.tau_K,
+        mP.tau_E, mP.cP, mP.cPI, mP.cL, mP.cR, mP.cK, mP.slope_param,
+        mP.octoNegDiscount ], dtype=_np.float64)
+    return vectors, matrices, scalars
+
+@_njit(cache=True)
+def _sig(x, span, slope):
+    # piecewise linear 'sigmoid' (see sde.piecewise_lin_pseudo_sig)
+    y = x*slope
+    if y < -span/2:
+        y = -span/2
+    if y > span/2:
+        y = span/2
+    return y
+
+@_njit(cache=True)
+def _dot(A, x, i):
+    # row i of A times x
+    s = 0.0
+    for j in range(x.shape[0]):
+        s += A[i, j]*x[j]
+    return s
+
+@_njit(cache=True)
+def fused_step( oldP, oldPI, oldL, oldR, oldK, oldE, stim_drive, octo, num_stds,
+    min_damper, P2K, PI2K, K2E, mean_spont_P, mean_spont_PI, mean_spont_L,
+    mean_spont_R, mean_spont_K, noise, vectors, matrices, scalars ):
+    """
+    One Euler-Maruyama time step of all neurons, fused into a single pass \
+    with no temporaries. It follows the reference (NumPy) step in \
+    :func:`sde.sde_evo_mnist` operation for operation, so for the same noise \
+    the results agree to rounding (sums are accumulated in a different order).
+
+    Args:
+        oldP, oldPI, oldL, oldR, oldK, oldE (numpy array): FRs at this timepoint.
+        stim_drive (numpy array): stimulus inputs to the RNs (F2R times the \
+        features) at this timepoint.
+        octo (float): octopamine at this timepoint.
+        num_stds (float): # st devs of the KC inputs used for the global damping.
+        min_damper (float): minimum global damping on the KCs.
+        P2K, PI2K, K2E (numpy array): (dense) plastic connection matrices.
+        mean_spont_P, mean_spont_PI, mean_spont_L, mean_spont_R, mean_spont_K \
+        (numpy array): current estimates of the mean spontaneous FRs.
+        noise (numpy array): standard normal draws for P, PI, L, R and K (in \
+        that order), as used by the Wiener noise of the reference step.
+        vectors, matrices, scalars (tuple): fixed params from :func:`pack_params`.
+
+    Returns
+    -------
+        new (tuple)
+            (newP, newPI, newL, newR, newK, newE), not yet made non-negative.
+
+    >>> newP, newPI, newL, newR, newK, newE = fused_step(oldP, oldPI, oldL, oldR, oldK, oldE, stim_drive, octo, num_stds, min_damper, P2K, PI2K, K2E, mean_spont_P, mean_spont_PI, mean_spont_L, mean_spont_R, mean_spont_K, noise, vectors, matrices, scalars)
+
+    """
+    R2P, R2L, Rspont, RspontRatios, kGlobalDampVec, octo2P, octo2PI, octo2L, \
+        octo2R, octo2K, wPsig, wPIsig, wLsig, wRsig, wKsig = vectors
+    L2P, L2PI, R2PI, L2L, L2R = matrices
+    dt = scalars[0]
+    tau_P = scalars[1]
+    tau_PI = scalars[2]
+    tau_L = scalars[3]
+    tau_R = scalars[4]
+    tau_K = scalars[5]
+    tau_E = scalars[6]
+    slope = scalars[12]
+    neg_discount = scalars[13]
+    sq_dt = _np.sqrt(dt)
+
+    nP = oldP.shape[0]
+    nPI = oldPI.shape[0]
+    nL = oldL.shape[0]
+    nR = oldR.shape[0]
+    nK = oldK.shape[0]
+    nE = oldE.shape[0]
+    newP = _np.empty(nP)
+    newPI = _np.empty(nPI)
+    newL = _np.empty(nL)
+    newR = _np.empty(nR)
+    newK = _np.empty(nK)
+    newE = _np.empty(nE)
+    n0 = 0 # offset into noise
+
+    # dP:
+    span = scalars[7]
+    for p in range(nP):
+        x = max(1 - octo*octo2P[p]*neg_discount, 0.0)
+        x *= -_dot(L2P, oldL, p)
+        x += (R2P[p]*oldR[p])*(1 + octo*octo2P[p])
+        x = _sig(x, span, slope*span/4)
+        dW = sq_dt*wPsig[p]*mean_spont_P[p]*noise[n0 + p]
+        newP[p] = oldP[p] + dt*(-oldP[p]*tau_P + x) + dW
+    n0 += nP
+
+    # dPI: # no PIs for mnist
+    span = scalars[8]
+    for p in range(nPI):
+        x = max(1 - octo*octo2PI[p]*neg_discount, 0.0)
+        x *= -_dot(L2PI, oldL, p)
+        x += _dot(R2PI, oldR, p)*(1 + octo*octo2PI[p])
+        x = _sig(x, span, slope*span/4)
+        dW = sq_dt*wPIsig[p]*mean_spont_PI[p]*noise[n0 + p]
+        newPI[p] = oldPI[p] + dt*(-oldPI[p]*tau_PI + x) + dW
+    n0 += nPI
+
+    # dL:
+    span = scalars[9]
+    for l in range(nL):
+        x = max(1 - octo*octo2L[l]*neg_discount, 0.0)
+        x *= -_dot(L2L, oldL, l)
+        x += (R2L[l]*oldR[l])*(1 + octo*octo2L[l])
+        x = _sig(x, span, slope*span/4)
+        dW = sq_dt*wLsig[l]*mean_spont_L[l]*noise[n0 + l]
+        newL[l] = oldL[l] + dt*(-oldL[l]*tau_L + x) + dW
+    n0 += nL
+
+    # dR:
+    span = scalars[10]
+    for r in range(nR):
+        x = max(1 - octo*octo2R[r]*neg_discount, 0.0)
+        x *= -_dot(L2R, oldL, r)
+        act = stim_drive[r]*RspontRatios[r]
+        act *= 1 + octo*octo2R[r]
+        x += act + Rspont[r]
+        x = _sig(x, span, slope*span/4)
+        dW = sq_dt*wRsig[r]*mean_spont_R[r]*noise[n0 + r]
+        newR[r] = oldR[r] + dt*(-oldR[r]*tau_R + x) + dW
+    n0 += nR
+
+    # dK: the KC inputs, then the global damping from their mean and std
+    P2K_input = _np.empty(nK)
+    PI2K_input = _np.empty(nK)
+    total = 0.0
+    for k in range(nK):
+        P2K_input[k] = _dot(P2K, oldP, k)
+        PI2K_input[k] = _dot(PI2K, oldPI, k)
+        total += P2K_input[k] - PI2K_input[k]
+    mean = total/nK
+    total = 0.0
+    for k in range(nK):
+        d = (P2K_input[k] - PI2K_input[k]) - mean
+        total += d*d
+    damper = mean + num_stds*_np.sqrt(total/nK)
+    damper = max(damper, min_damper)
+    span = scalars[11]
+    for k in range(nK):
+        dampening = damper*kGlobalDampVec[k] + PI2K_input[k]
+        pos_octo = max(1 - octo2K[k]*octo, 0.0)
+        x = P2K_input[k]*(1 + octo*octo2K[k])
+        x -= dampening*pos_octo
+        x = _sig(x, span, slope*span/4)
+        dW = sq_dt*wKsig[k]*mean_spont_K[k]*noise[n0 + k]
+        newK[k] = oldK[k] + dt*(-oldK[k]*tau_K + x) + dW
+
+    # dE: (no noise in ENs)
+    for e in range(nE):
+        newE[e] = oldE[e] + dt*(-oldE[e]*tau_E + _dot(K2E, oldK, e))
+
+    return newP, newPI, newL, newR, newK, newE
+
+# MIT license:
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial
+# portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN
+# AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
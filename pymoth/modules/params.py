@@ -69,7 +69,6 @@ class ModelParams:
 		"""
 
 		self.nF = nF
-		self.goal = goal
 
 		self.nG = nF
 		self.nP = self.nG # Pn = n of excitatory Pn. (one per glomerulus)
@@ -91,17 +90,9 @@ class ModelParams:
 		#-------------------------------------------------------------------------------
 
 		## Hebbian learning rates:
-
-		# For K2E ie MB -> EN. Very important. Most of the de facto plasticity is in K2E:
-		self.heb_tau_KE = 0.02*goal # controls learning rate for K2E weights. 1/decay rate.
-		# Higher means slower decay.
-
-		self.die_back_tau_KE = 0.5*goal # 1/decay rate. Higher means slower decay.
-		# die_back_tau_KE and heb_tau_KE want to be in balance.
+		self.set_goal(goal)
 
 		# For P2K ie AL -> MB
-		self.heb_tau_PK = 5e3*goal # learning rate for P2K weights. Higher means slower.
-		# Very high heb_tau_PK means that P2K connections are essentially fixed.
 		# Decay: There is no decay for P2K weights
 		self.die_back_tau_PK = 0 # If > 0, divide this fraction of gains evenly among all nonzero
 		# weights, and subtract.
@@ -295,7 +286,6 @@ class ModelParams:
 		self.PI2K_std = 0
 
 		self.hebMaxPK = self.P2K_mu + (3*self.P2K_std) # ceiling for P2K connection weights
-		self.heb_tau_PIK = self.heb_tau_PK  # irrelevant since PI2K weights == 0 (no PIs for mnist)
 		self.hebMaxPIK = self.PI2K_mu + (3*self.PI2K_std) # no PIs for mnist
 
 		#-------------------------------------------------------------------------------
@@ -603,6 +593,36 @@ class ModelParams:
 		self.kGlobalDampVec = self.kGlobalDampFactor + self.kGlobalDamp_std*r.normal(0,1,(self.nK,1))
 		# each KC may be affected a bit differently by LH inhibition
 
+	def set_goal(self, goal):
+		"""
+
+		Set the Hebbian learning rates for a new `goal`. The connection matrices \
+		(if any) are kept, so a moth can be retrained at several learning rates.
+
+		Args:
+			goal (int): measure of learning rate (see :class:`ModelParams`).
+
+		Returns
+		-------
+			None
+
+		>>> model_params.set_goal( 5 )
+
+		"""
+		self.goal = goal
+
+		# For K2E ie MB -> EN. Very important. Most of the de facto plasticity is in K2E:
+		self.heb_tau_KE = 0.02*goal # controls learning rate for K2E weights. 1/decay rate.
+		# Higher means slower decay.
+
+		self.die_back_tau_KE = 0.5*goal # 1/decay rate. Higher means slower decay.
+		# die_back_tau_KE and heb_tau_KE want to be in balance.
+
+		# For P2K ie AL -> MB
+		self.heb_tau_PK = 5e3*goal # learning rate for P2K weights. Higher means slower.
+		# Very high heb_tau_PK means that P2K connections are essentially fixed.
+		self.heb_tau_PIK = self.heb_tau_PK  # irrelevant since PI2K weights == 0 (no PIs for mnist)
+
 class ExpParams:
 
 	def __init__( self, train_classes, class_labels, val_per_class ):
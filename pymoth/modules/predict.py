@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+
+"""
+
+.. module:: predict
+   :platform: Unix
+   :synopsis: Run a trained moth (frozen weights) on new digits.
+
+.. moduleauthor:: Adam P. Jones <ajones173@gmail.com>
+
+"""
+import numpy as _np
+from scipy.special import erfinv
+from .sde import sim_rng, piecewise_lin_pseudo_sig
+
+def stim_pulse( exp_params, dt=0.02, pre=1.0, post=1.0 ):
+    """
+    Timecourse of a single stimulus presentation, low-pass filtered as in \
+    :func:`sde.stim_timecourses`.
+
+    Args:
+        exp_params (class): timing info about experiment (stimLength, stimMag, lpParam).
+        dt (float): [optional] time step.
+        pre (float): [optional] seconds before the stimulus start.
+        post (float): [optional] seconds after the stimulus start.
+
+    Returns
+    -------
+        t (numpy array)
+            timepoints, relative to the stimulus start.
+        pulse (numpy array)
+            stimulus magnitude at each timepoint.
+
+    >>> t, pulse = stim_pulse(exp_params)
+
+    """
+    t = _np.arange(-int(round(pre/dt)), int(round(post/dt)) + 1)*dt
+    pulse = exp_params.stimMag*((0 < t) & (t < exp_params.stimLength))
+    L = round(exp_params.lpParam/dt) # as in stim_timecourses
+    lpWindow = _np.hamming(L)
+    lpWindow /= lpWindow.sum()
+    return t, _np.convolve(pulse, lpWindow, 'same')
+
+def en_peak_responses( model_params, exp_params, sim_results, features, seed=None,
+    batch_size=256, noise=True ):
+    """
+    Present each digit separately to a trained moth, with its weights frozen \
+    (P2Kfinal and K2Efinal from `sim_results`, and no Hebbian updates), and \
+    return the peak EN responses. This is the readout that :func:`sde.collect_stats` \
+    takes from the post-training digits of a simulation, so the cost is \
+    proportional to the number of digits only.
+
+    Each presentation starts from the final state of the simulation (which is \
+    spontaneous activity), with the noise calibration of the simulation, and \
+    lasts from 1 sec before to 1 sec after the stimulus start. The digits are \
+    independent, so they are run as a batch: the FRs are [numDigits x n] \
+    arrays, and each time step is a few matrix products.
+
+    With `noise` False, this gives the deterministic response instead (the \
+    noiseless ODE): each presentation starts from the noiseless spontaneous \
+    fixed point (see :func:`spont_fixed_point`), so the steps before the \
+    stimulus onset are skipped, and the time-stepping stops as soon as the \
+    stimulus is over and every EN is decaying.
+
+    Args:
+        model_params (class): model_params of the moth.
+        exp_params (class): timing info about experiment (stimulus length and \
+        magnitude).
+        sim_results (dict): output of :func:`sde.sde_wrap` for the moth.
+        features (numpy array): [numDigits x numFeatures] digits.
+        seed (int): [optional] seed for the noise (see :func:`sde.sim_rng`).
+        batch_size (int): [optional] number of digits run at once.
+        noise (bool): [optional] if False, run the noiseless dynamics.
+
+    Returns
+    -------
+        peaks (numpy array)
+            [numDigits x nE] max EN FR within 1 sec of each stimulus start.
+
+    >>> peaks = en_peak_responses(model_params, exp_params, sim_results, test_X)
+
+    """
+    mP = model_params
+    features = _np.atleast_2d(features)
+    dt = 0.02 # as in sde.stim_timecourses
+    t, pulse = stim_pulse(exp_params, dt)
+    in_window = (-1 < t) & (t < 1)
+    stim_over = t > exp_params.stimLength + exp_params.lpParam
+
+    if noise:
+        rng = sim_rng(seed)
+        state = sim_results['state']
+        k0 = 0
+    else:
+        state = spont_fixed_point(mP, sim_results)
+        # the FRs are constant until the (low-pass filtered) stimulus starts:
+        k0 = max(_np.argmax(pulse > 0) - 1, 0)
+    step, n_noise = _frozen_step(mP, sim_results, dt)
+
+    peaks = _np.full((len(features), mP.nE), -_np.inf)
+    for b0 in range(0, len(features), batch_size):
+        batch = features[b0:b0 + batch_size]
+        B = len(batch)
+        peaks_b = peaks[b0:b0 + B]
+        drive = (batch @ mP.F2R.T)*(mP.Rspont/mP.Rspont.mean()).ravel() # RN inputs
+        FRs = [ _np.tile(_np.ravel(state[pop]), (B, 1))
+            for pop in ('P', 'PI', 'L', 'R', 'K', 'E') ]
+        if in_window[k0]:
+            _np.maximum(peaks_b, FRs[-1], out=peaks_b)
+        for k in range(k0, len(t) - 1):
+            z = rng.standard_normal((B, n_noise)) if noise else None
+            oldE = FRs[-1]
+            FRs = step(FRs, pulse[k]*drive, z)
+            if in_window[k+1]:
+                _np.maximum(peaks_b, FRs[-1], out=peaks_b)
+            if not noise and stim_over[k] and _np.all(FRs[-1] <= oldE):
+                # no more input, so the ENs only decay from here on
+                break
+
+    return peaks
+
+def spont_fixed_point( model_params, sim_results, tol=1e-9, max_time=100 ):
+    """
+    Spontaneous (no stimulus) steady state of the noiseless dynamics of a \
+    trained moth, found by time-stepping from the final state of the simulation.
+
+    Args:
+        model_params (class): model_params of the moth.
+        sim_results (dict): output of :func:`sde.sde_wrap` for the moth.
+        tol (float): [optional] convergence tolerance on the change of FRs per step.
+        max_time (float): [optional] max seconds of (simulated) time to step.
+
+    Returns
+    -------
+        state (dict)
+            FRs of P, PI, L, R, K and E at the fixed point.
+
+    >>> state = spont_fixed_point(model_params, sim_results)
+
+    """
+    dt = 0.02
+    step, _ = _frozen_step(model_params, sim_results, dt)
+    pops = ('P', 'PI', 'L', 'R', 'K', 'E')
+    FRs = [ _np.ravel(sim_results['state'][pop])[_np.newaxis, :] for pop in pops ]
+    no_drive = _np.zeros((1, model_params.nR))
+    for _ in range(int(max_time/dt)):
+        new = step(FRs, no_drive, None)
+        change = max( _np.abs(a - b).max(initial=0) for a, b in zip(new, FRs) )
+        FRs = new
+        if change < tol:
+            break
+    return { pop : FR[0] for pop, FR in zip(pops, FRs) }
+
+def _frozen_step( mP, sim_results, dt ):
+    # Euler(-Maruyama) step of a batch of FRs of a moth with frozen weights and
+    # no octopamine. Returns (step, n_noise), where step(FRs, stim_drive, z)
+    # gives the new FRs; FRs is [P, PI, L, R, K, E] ([B x n] each) and z holds
+    # standard normal draws ([B x n_noise]), or is None for no noise.
+    state = sim_results['state']
+    P2K = sim_results['P2Kfinal']
+    K2E = sim_results['K2Efinal']
+    PI2K = mP.PI2K # no PIs for mnist
+    R2P, R2L, Rspont = mP.R2P.ravel(), mP.R2L.ravel(), mP.Rspont.ravel()
+    kGlobalDampVec = mP.kGlobalDampVec.ravel()
+    sigs = [ mP.noisePvec, mP.noisePIvec, mP.noiseLvec, mP.noiseRvec, mP.noiseKvec ]
+    sigs = [ _np.sqrt(dt)*sig.ravel()*state['mean_spont_' + pop].ravel()
+        for sig, pop in zip(sigs, ('P', 'PI', 'L', 'R', 'K')) ]
+    bounds = _np.cumsum([0] + [ len(sig) for sig in sigs ])
+
+    # no octopamine, so the KC damping uses the no-octo number of st devs:
+    numStds = _np.sqrt(2)*erfinv(1 - 2*mP.sparsityTarget)
+    minDamperVal = 1.2*state['maxSpontP2KtimesPval']
+
+    def sig(x, c):
+        return piecewise_lin_pseudo_sig(x, c, mP.slope_param*c/4)
+
+    def update(old_, tau_, inputs_, dW_):
+        return _np.maximum(old_ + dt*(-old_*tau_ + inputs_) + dW_, 0)
+
+    def step(FRs, stim_drive, z):
+        if z is None:
+            dW = [0]*len(sigs)
+        else:
+            dW = [ z[:, a:b]*sig_ for a, b, sig_ in zip(bounds[:-1], bounds[1:], sigs) ]
+        P, PI, L, R, K, E = FRs
+        newP = update(P, mP.tau_P, sig(-L @ mP.L2P.T + R2P*R, mP.cP), dW[0])
+        newPI = update(PI, mP.tau_PI, sig(-L @ mP.L2PI.T + R @ mP.R2PI.T, mP.cPI), dW[1])
+        newL = update(L, mP.tau_L, sig(-L @ mP.L2L.T + R2L*R, mP.cL), dW[2])
+        newR = update(R, mP.tau_R, sig(-L @ mP.L2R.T + stim_drive + Rspont, mP.cR), dW[3])
+
+        # global damping of the KCs, for each digit:
+        P2Kinput = P @ P2K.T
+        PI2Kinput = PI @ PI2K.T
+        thisKinput = P2Kinput - PI2Kinput
+        damper = thisKinput.mean(axis=1) + numStds*thisKinput.std(axis=1)
+        damper = _np.maximum(damper, minDamperVal)
+        dampening = damper[:, _np.newaxis]*kGlobalDampVec + PI2Kinput
+        newK = update(K, mP.tau_K, sig(P2Kinput - dampening, mP.cK), dW[4])
+
+        # ENs (no noise, no sigmoid):
+        newE = E + dt*(-E*mP.tau_E + K @ K2E.T)
+        return [newP, newPI, newL, newR, newK, newE]
+
+    return step, bounds[-1]
+
+def en_resp( peaks, labels, class_labels ):
+    """
+    Collect the per-class stats of peak EN responses, in the format of the \
+    post-training fields of :func:`sde.collect_stats`, so they can be passed \
+    to :func:`classify_log_likelihood` or the functions in :mod:`classify`. \
+    Use a labeled calibration set here, separate from the digits to classify.
+
+    Args:
+        peaks (numpy array): [numDigits x nE] peak EN responses (see \
+        :func:`en_peak_responses`).
+        labels (numpy array): class of each digit.
+        class_labels (numpy array): classes, in the order of the stats columns.
+
+    Returns
+    -------
+        EN_resp (list)
+            for each EN, a dict with 'post_train_resp', 'odor_class', \
+            'post_mean_resp' and 'post_std_resp'.
+
+    >>> EN_resp = en_resp(calib_peaks, calib_y, class_labels)
+
+    """
+    labels = _np.ravel(labels)
+    EN_resp = []
+    for e in range(peaks.shape[1]):
+        resp = peaks[:, e]
+        mean_resp = -_np.ones(len(class_labels))
+        std_resp = -_np.ones(len(class_labels))
+        for i, c in enumerate(class_labels):
+            these = resp[labels == c]
+            if these.size:
+                mean_resp[i] = these.mean()
+                std_resp[i] = these.std()
+        EN_resp.append({ 'post_train_resp' : resp, 'odor_class' : labels,
+            'post_mean_resp' : mean_resp, 'post_std_resp' : std_resp })
+    return EN_resp
+
+def classify_log_likelihood( peaks, EN_resp_trained ):
+    """
+    Classify digits from their peak EN responses, by the log-likelihood rule \
+    of :func:`classify.classify_digits_log_likelihood`, against the post-training \
+    class response stats of a simulation.
+
+    Classes without usable stats for every EN (absent from the stats, std -1, or \
+    with a single digit, std 0) are left out: their likelihoods are inf, so \
+    they are never predicted.
+
+    Args:
+        peaks (numpy array): [numDigits x nE] peak EN responses (see \
+        :func:`en_peak_responses`).
+        EN_resp_trained (list): output of :func:`sde.collect_stats`, with \
+        'post_mean_resp' and 'post_std_resp' for each EN.
+
+    Returns
+    -------
+        pred_classes (numpy array)
+            predicted class of each digit.
+        likelihoods (numpy array)
+            [numDigits x numClasses] summed log likelihoods (lowest is best).
+
+    >>> pred_classes, likelihoods = classify_log_likelihood(peaks, EN_resp_trained)
+
+    """
+    # Each row is an EN, each col is a class:
+    mu = _np.array([ resp['post_mean_resp'] for resp in EN_resp_trained ])
+    sig = _np.array([ resp['post_std_resp'] for resp in EN_resp_trained ])
+    usable = _np.all(sig > 0, axis=0)
+    if not usable.any():
+        raise ValueError('classify_log_likelihood needs a class with a response ' + \
+            'std > 0 for every EN (ie at least 2 digits with different responses)')
+    # mahalanobis distance of each digit's response from each EN's response to
+    # each usable class, [numDigits x nE x numUsableClasses]:
+    dist = (peaks[:, :, _np.newaxis] - mu[:, usable])/sig[:, usable]
+    likelihoods = _np.full((len(peaks), len(usable)), _np.inf)
+    likelihoods[:, usable] = _np.sum(dist**4, axis=1) # the ^4 (instead of ^2) is a sharpener
+    return _np.argmin(likelihoods, axis=1), likelihoods
+
+# MIT license:
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial
+# portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN
+# AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+
+"""
+
+.. module:: record
+   :platform: Unix
+   :synopsis: Recorders for neural timecourses of the SDE simulation.
+
+.. moduleauthor:: Adam P. Jones <ajones173@gmail.com>
+
+"""
+import os as _os
+import numpy as _np
+from numpy.lib.format import open_memmap
+
+POPULATIONS = ('P', 'PI', 'L', 'R', 'K', 'E') # in the order used for Y
+
+class Recorder:
+    """
+    Base class for recorders of neural timecourses.
+
+    A recorder is handed to :func:`sde.sde_wrap` (or :func:`sde.sde_evo_mnist`), \
+    which calls `open` before the evolution, `write` at each timepoint, and \
+    `close` at the end (and `state` to checkpoint the evolution). Timepoints are buffered in chunks of `chunk_size` \
+    (recorded) timepoints, and each full chunk is handed to `_flush`, so only \
+    one chunk is held in memory. Subclasses implement `_flush` (and possibly \
+    `_open`, `_close`, and `_state` and `_restore` for any state of their own).
+
+    Args:
+        populations (tuple): [optional] which neuron types to record, out of \
+        'P', 'PI', 'L', 'R', 'K', 'E'.
+        decimate (int): [optional] record every `decimate`-th timepoint.
+        chunk_size (int): [optional] number of recorded timepoints per chunk.
+
+    """
+    def __init__(self, populations=('E',), decimate=1, chunk_size=1000):
+        unknown = set(populations) - set(POPULATIONS)
+        if unknown:
+            raise ValueError(f'Unknown populations: {sorted(unknown)}')
+        # keep the order of Y:
+        self.populations = tuple(p for p in POPULATIONS if p in populations)
+        self.decimate = max(int(decimate), 1)
+        self.chunk_size = max(int(chunk_size), 1)
+
+    def open(self, T, sizes, state=None):
+        """
+        Prepare to record.
+
+        Args:
+            T (numpy array): all timepoints of the evolution.
+            sizes (dict): number of neurons of each population.
+            state (dict): [optional] progress of an interrupted recording, as \
+            returned by `state`, to carry on from.
+
+        """
+        self.T = T[::self.decimate]
+        self.n_rec = len(self.T)
+        # column slices of each population in the chunk buffer
+        self.slices = dict()
+        start = 0
+        for pop in self.populations:
+            self.slices[pop] = slice(start, start + sizes[pop])
+            start += sizes[pop]
+        self.n_cols = start
+        self.resuming = state is not None
+        self._open(sizes)
+        self.buffer = _np.zeros((min(self.chunk_size, self.n_rec), self.n_cols))
+        self.buffer_start = 0 # index (in recorded timepoints) of buffer row 0
+        self.pos = 0 # next free row of the buffer
+        if state is not None:
+            self.buffer_start = int(state['buffer_start'])
+            n_left = self.n_rec - self.buffer_start
+            if n_left < len(self.buffer):
+                self.buffer = self.buffer[:n_left]
+            self.pos = len(state['buffer'])
+            self.buffer[:self.pos] = state['buffer']
+            self._restore(state)
+
+    def state(self):
+        """
+        Progress of the recording, to checkpoint an evolution (see `open`).
+
+        Returns
+        -------
+            state (dict)
+                numpy arrays (the unflushed timepoints, etc).
+
+        """
+        state = {'buffer': self.buffer[:self.pos].copy(),
+            'buffer_start': _np.array(self.buffer_start)}
+        state.update(self._state())
+        return state
+
+    def write(self, i, values, n_steps=1):
+        """
+        Record the FRs at timepoint `i` (or timepoints `i` to `i+n_steps-1`).
+
+        Args:
+            i (int): index of the (first) timepoint.
+            values (dict): FRs of each population: arrays of shape [n] for a \
+            single timepoint, or [n_steps x n].
+            n_steps (int): [optional] number of consecutive timepoints.
+
+        """
+        dec = self.decimate
+        if n_steps == 1:
+            if i % dec == 0:
+                for pop in self.populations:
+                    self.buffer[self.pos, self.slices[pop]] = values[pop]
+                self._advance()
+            return
+        for k in range(-i % dec, n_steps, dec):
+            for pop in self.populations:
+                self.buffer[self.pos, self.slices[pop]] = values[pop][k]
+            self._advance()
+
+    def _advance(self):
+        self.pos += 1
+        if self.pos == len(self.buffer):
+            self._flush(self.buffer_start, self.buffer)
+            self.buffer_start += self.pos
+            self.pos = 0
+            # the last chunk may be short:
+            n_left = self.n_rec - self.buffer_start
+            if 0 < n_left < len(self.buffer):
+                self.buffer = self.buffer[:n_left]
+
+    def close(self):
+        """
+        Finish recording (flush the last, partial, chunk).
+
+        Returns
+        -------
+            recording (dict)
+                recorder-specific results (eg the timecourses).
+
+        """
+        if self.pos:
+            self._flush(self.buffer_start, self.buffer[:self.pos])
+            self.buffer_start += self.pos
+            self.pos = 0
+        return self._close()
+
+    def _open(self, sizes):
+        pass
+
+    def _flush(self, start, chunk):
+        raise NotImplementedError
+
+    def _close(self):
+        return dict()
+
+    def _state(self):
+        return dict()
+
+    def _restore(self, state):
+        pass
+
+class MemoryRecorder(Recorder):
+    """
+    Keep the recorded timecourses in memory, in a single preallocated array \
+    (so there is no copying to assemble them at the end).
+
+    `close` returns a dict with 'T', 'Y' ([# recorded timepoints x # recorded \
+    neurons], columns in the order P, PI, L, R, K, E) and a view into 'Y' for \
+    each recorded population.
+
+    >>> rec = MemoryRecorder(populations=('K', 'E'), decimate=5)
+
+    """
+    def _open(self, sizes):
+        self.chunk_size = self.n_rec # one chunk holds everything
+
+    def _flush(self, start, chunk):
+        pass # the buffer is the recording
+
+    def _close(self):
+        recording = {'T': self.T, 'Y': self.buffer}
+        for pop, sl in self.slices.items():
+            recording[pop] = self.buffer[:, sl]
+        return recording
+
+class NpyRecorder(Recorder):
+    """
+    Stream the recorded timecourses to memory-mapped .npy files in `folder`, \
+    one per population (eg 'E.npy') plus 'T.npy'.
+
+    `close` returns a dict with the recorded arrays, opened read-only with \
+    `mmap_mode='r'`, so they can be used without loading them into memory. \
+    When resuming a recording, the files already in `folder` are carried on.
+
+    Args:
+        folder (str): directory for the .npy files (created if needed).
+        populations (tuple): [optional] which neuron types to record.
+        decimate (int): [optional] record every `decimate`-th timepoint.
+        chunk_size (int): [optional] number of timepoints held in memory.
+
+    >>> rec = NpyRecorder('results/run1', populations=('E',), decimate=5)
+
+    """
+    def __init__(self, folder, populations=('E',), decimate=1, chunk_size=1000):
+        super().__init__(populations, decimate, chunk_size)
+        self.folder = folder
+
+    def _open(self, sizes):
+        if not _os.path.isdir(self.folder):
+            _os.makedirs(self.folder)
+        _np.save(_os.path.join(self.folder, 'T.npy'), self.T)
+        self.files = dict()
+        for pop in self.populations:
+            self.files[pop] = open_memmap(_os.path.join(self.folder, pop + '.npy'),
+                mode='r+' if self.resuming else 'w+', dtype=_np.float64,
+                shape=(self.n_rec, sizes[pop]))
+
+    def _flush(self, start, chunk):
+        for pop, sl in self.slices.items():
+            self.files[pop][start:start + len(chunk)] = chunk[:, sl]
+
+    def _close(self):
+        recording = {'T': _np.load(_os.path.join(self.folder, 'T.npy'))}
+        for pop, f in self.files.items():
+            f.flush()
+            recording[pop] = _np.load(_os.path.join(self.folder, pop + '.npy'),
+                mmap_mode='r')
+        del self.files
+        return recording
+
+class CallbackRecorder(Recorder):
+    """
+    Hand each chunk of recorded timecourses to a function, as \
+    `callback(T_chunk, chunk)`, where `chunk` is a dict with a \
+    [# timepoints x n] array for each recorded population. The arrays are \
+    reused, so copy them if they are to be kept.
+
+    Args:
+        callback (function): called with each chunk.
+        populations (tuple): [optional] which neuron types to record.
+        decimate (int): [optional] record every `decimate`-th timepoint.
+        chunk_size (int): [optional] number of timepoints per chunk.
+
+    >>> rec = CallbackRecorder(lambda t, chunk: print(t[-1], chunk['E'].max()))
+
+    """
+    def __init__(self, callback, populations=('E',), decimate=1, chunk_size=1000):
+        super().__init__(populations, decimate, chunk_size)
+        self.callback = callback
+
+    def _flush(self, start, chunk):
+        self.callback(self.T[start:start + len(chunk)],
+            {pop: chunk[:, sl] for pop, sl in self.slices.items()})
+
+class RunningStats:
+    """
+    Running mean and (population) std of a stream of values, updated a block \
+    at a time with Welford's algorithm (Chan et al.'s version for blocks), so \
+    the values need not be stored.
+
+    Args:
+        shape (tuple): [optional] shape of each value, eg (nE,) to keep separate \
+        stats for each EN. The default, (), pools all values.
+
+    >>> stats = RunningStats()
+    >>> stats.update(E_block)
+    >>> stats.mean, stats.std
+
+    """
+    def __init__(self, shape=()):
+        self.shape = tuple(shape)
+        self.count = 0
+        self.mean = _np.zeros(self.shape)
+        self.M2 = _np.zeros(self.shape) # sum of squared deviations from the mean
+
+    def update(self, x):
+        """
+        Add a block of values.
+
+        Args:
+            x (numpy array): [m x shape] block of m values (any shape, if shape is ()).
+
+        """
+        x = _np.asarray(x, dtype=float).reshape((-1,) + self.shape)
+        n = len(x)
+        if n == 0:
+            return
+        mean = x.mean(axis=0)
+        M2 = ((x - mean)**2).sum(axis=0)
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean = self.mean + delta*(n/total)
+        self.M2 = self.M2 + M2 + delta**2*(self.count*n/total)
+        self.count = total
+
+    @property
+    def var(self):
+        """ Population variance (as numpy's var). nan if there are no values. """
+        if self.count == 0:
+            return _np.full(self.shape, _np.nan)[()]
+        return (self.M2/self.count)[()]
+
+    @property
+    def std(self):
+        """ Population std (as numpy's std). nan if there are no values. """
+        return _np.sqrt(self.var)
+
+class StatsRecorder(Recorder):
+    """
+    Collect the EN statistics used by :func:`sde.collect_stats` as the \
+    evolution runs, so the EN timecourses need not be stored: the peak response \
+    of each EN to each stimulus (max FR within 1 sec of the stimulus start), \
+    and the mean and std of the spontaneous EN FRs before and after training.
+
+    `close` returns a dict with 'stim_starts', 'stim_peaks' ([numStims x nE], \
+    nan if a window has no timepoints, as in collect_stats), 'pre_spont_mean', \
+    'pre_spont_std', \
+    'post_spont_mean' and 'post_spont_std'.
+
+    Args:
+        exp_params (class): timing info about experiment, eg when stimuli are given.
+        chunk_size (int): [optional] number of timepoints held in memory.
+
+    >>> rec = StatsRecorder(exp_params)
+
+    """
+    def __init__(self, exp_params, chunk_size=1000):
+        super().__init__(('E',), 1, chunk_size)
+        # only use non-zero puffs (as collect_stats):
+        self.stim_starts = exp_params.stimStarts*(exp_params.classMags > 0)
+        self.spont_windows = {
+            'pre': (exp_params.preHebSpontStart, exp_params.preHebSpontStop),
+            'post': (exp_params.postHebSpontStart, exp_params.postHebSpontStop)
+            }
+
+    def _open(self, sizes):
+        # [start, stop) indices of timepoints with t-1 < T < t+1, for each stim start t
+        self.stim_lo = _np.searchsorted(self.T, self.stim_starts - 1, side='right')
+        self.stim_hi = _np.searchsorted(self.T, self.stim_starts + 1, side='left')
+        self.stim_peaks = _np.full((len(self.stim_starts), sizes['E']), _np.nan)
+        self.spont_inds = dict()
+        self.spont_stats = dict()
+        for name, (start, stop) in self.spont_windows.items():
+            self.spont_inds[name] = ( _np.searchsorted(self.T, start, side='right'),
+                _np.searchsorted(self.T, stop, side='left') )
+            self.spont_stats[name] = RunningStats()
+
+    def _flush(self, start, chunk):
+        stop = start + len(chunk)
+        lo = _np.maximum(self.stim_lo, start)
+        hi = _np.minimum(self.stim_hi, stop)
+        for k in _np.nonzero(lo < hi)[0]:
+            peaks = chunk[lo[k]-start:hi[k]-start].max(axis=0)
+            if lo[k] == self.stim_lo[k]: # the first chunk of the window
+                self.stim_peaks[k] = peaks
+            else:
+                _np.maximum(self.stim_peaks[k], peaks, out=self.stim_peaks[k])
+        for name, (w_lo, w_hi) in self.spont_inds.items():
+            a, b = max(w_lo, start), min(w_hi, stop)
+            if a < b:
+                self.spont_stats[name].update(chunk[a-start:b-start])
+
+    def _state(self):
+        state = {'stim_peaks': self.stim_peaks.copy()}
+        for name, stats in self.spont_stats.items():
+            state[name + '_count'] = _np.array(stats.count)
+            state[name + '_mean'] = stats.mean
+            state[name + '_M2'] = stats.M2
+        return state
+
+    def _restore(self, state):
+        self.stim_peaks[:] = state['stim_peaks']
+        for name, stats in self.spont_stats.items():
+            stats.count = int(state[name + '_count'])
+            stats.mean = state[name + '_mean']
+            stats.M2 = state[name + '_M2']
+
+    def _close(self):
+        recording = {'stim_starts': self.stim_starts, 'stim_peaks': self.stim_peaks}
+        for name, stats in self.spont_stats.items():
+            recording[name + '_spont_mean'] = stats.mean[()]
+            recording[name + '_spont_std'] = stats.std
+        return recording
+
+# MIT license:
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial
+# portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN
+# AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
@@ -10,12 +10,21 @@
 
 """
 import os as _os
+import time as _time
+import json as _json
+import hashlib as _hashlib
+import warnings as _warnings
 import numpy as _np
 from scipy.special import erfinv
+from scipy import sparse as _sparse
 import matplotlib.pyplot as _plt
 from show_figs import show_acc, show_timecourse
+from .record import MemoryRecorder, RunningStats, POPULATIONS
+from . import kernels as _kernels
 
-def sde_wrap( model_params, exp_params, feature_array ):
+def sde_wrap( model_params, exp_params, feature_array, fast_quiescent=False,
+    quiescent_step=0.2, sparse=False, recorders=None, kernel='numpy', seed=None,
+    calibration_cache=None, checkpoint=None, checkpoint_interval=300 ):
     """
     Runs the SDE time-stepped evolution of neural firing rates.
 
@@ -29,6 +38,26 @@ def sde_wrap( model_params, exp_params, feature_array ):
         model_params (class): object with connection matrices, etc.
         exp_params (class): object with timing info about experiment, eg when stimuli are given.
         feature_array (numpy array): stimuli (numFeatures x numStimsPerClass x numClasses).
+        fast_quiescent (bool): [optional] advance stretches with no stimulus, no \
+        octopamine and no Hebbian learning in coarse steps (see :func:`sde_evo_mnist`).
+        quiescent_step (float): [optional] maximum step size (seconds) used in \
+        quiescent stretches when `fast_quiescent` is set.
+        sparse (bool): [optional] store the sparse connection matrices (P2K, PI2K) \
+        in CSR format during the evolution (see :func:`sde_evo_mnist`).
+        recorders (list): [optional] :class:`record.Recorder` objects, to record \
+        neural timecourses (see :func:`sde_evo_mnist`).
+        kernel (str): [optional] 'numpy' or 'numba' (compiled) time steps (see \
+        :func:`sde_evo_mnist`).
+        seed (int): [optional] seed for the noise of this simulation (or a numpy \
+        SeedSequence or Generator). If None, it is drawn from numpy's global \
+        random state (see :func:`sim_rng`).
+        calibration_cache (str): [optional] folder of calibration snapshots, so \
+        repeated runs of a moth skip the noise calibration (see \
+        :func:`sde_evo_mnist`).
+        checkpoint (str): [optional] .npz file to checkpoint the run to every \
+        `checkpoint_interval` seconds. If it exists, the run carries on from it \
+        (see :func:`sde_evo_mnist`).
+        checkpoint_interval (float): [optional] seconds between checkpoints.
 
     Returns:
         sim_results (dict): EN timecourses and final P2K and K2E connection matrices.
@@ -47,6 +76,80 @@ def sde_wrap( model_params, exp_params, feature_array ):
     F2R = model_params.F2R
 
     ##  2b. Define Stimuli and Octopamine time courses:
+    time, class_mag_mat, octo_hits = stim_timecourses(exp_params)
+    # the stimulus events and their inputs to the RNs:
+    schedule = stim_schedule(class_mag_mat, feature_array, F2R)
+    sim_start = exp_params.sim_start
+    sim_stop =  exp_params.sim_stop
+
+    ## do SDE time-step evolution:
+
+    # Use euler-maruyama SDE method, milstein's version.
+    #  Y (the vector of all neural firing rates) is structured as a row vector as follows: [ P, PI, L, K, E ]
+    Po = _np.ones(nP) # P are the normalized FRs of the excitatory PNs
+    PIo = _np.ones(nPI) # PI are the normed FRs of the inhib PNs
+    Lo = _np.ones(nG)
+    Ro = model_params.Rspont
+    Ko = _np.ones(model_params.nK) # K are the normalized firing rates of the Kenyon cells
+    Eo = _np.zeros(model_params.nE) # start at zeros
+    init_cond = _np.concatenate((Po, PIo, Lo, Ro, Ko, Eo) , axis=None) # initial conditions for Y
+
+    tspan = ( sim_start, sim_stop )
+    seed_val = seed # to free up or fix randn
+    # If None, a random seed value will be chosen. Else, the seed will be defined.
+
+    # run the SDE evolution:
+    this_run = sde_evo_mnist(tspan, init_cond, time, class_mag_mat, feature_array,
+        octo_hits, model_params, exp_params, seed_val, fast_quiescent=fast_quiescent,
+        quiescent_step=quiescent_step, sparse=sparse, recorders=recorders,
+        kernel=kernel, schedule=schedule, calibration_cache=calibration_cache,
+        checkpoint=checkpoint, checkpoint_interval=checkpoint_interval )
+    # time stepping done
+
+    ## Unpack Y and save results:
+    # Y is a matrix numTimePoints x nG
+    # Each col is a PN, each row holds values for a single timestep
+    # Y = this_run['Y']
+
+    # save some inputs and outputs to a struct for argout:
+    sim_results = {
+                    'T' : this_run['T'], # timing information (of E)
+                    'E' : this_run['E'],
+                    'octo_hits' : octo_hits,
+                    'T_sim' : this_run['T_sim'], # full time vector (of octo_hits)
+                    'K2Efinal' : this_run['K2Efinal'],
+                    'P2Kfinal' : this_run['P2Kfinal'],
+                    'state' : this_run['state'], # final FRs and noise calibration
+                    'nE' : nE
+                }
+    if recorders is not None:
+        sim_results['recordings'] = this_run['recordings']
+
+    return sim_results
+
+def stim_timecourses( exp_params ):
+    """
+    Define the stimulus and octopamine time courses of an experiment.
+
+    Stimuli and octopamine are given as step functions, then low-pass filtered \
+    to round off their sharp start-stop edges.
+
+    Args:
+        exp_params (class): object with timing info about experiment, eg when stimuli are given.
+
+    Returns
+    -------
+        time (numpy array)
+            [start:step:stop] vector of timepoints for stepping through the evolution.
+        class_mag_mat (numpy array)
+            [# of different classes X vector of time points] each entry is the \
+            strength of a digit presentation.
+        octo_hits (numpy array)
+            [1 x length(time)] octopamine strengths at each timepoint.
+
+    >>> time, class_mag_mat, octo_hits = stim_timecourses(exp_params)
+
+    """
 
     # set time span and events:
     sim_start = exp_params.sim_start
@@ -54,7 +157,8 @@ def sde_wrap( model_params, exp_params, feature_array ):
     time_step = 2*0.01
 
     total_steps = (sim_stop - sim_start)/time_step
-    time = _np.linspace(sim_start, int(sim_stop-time_step), int(total_steps))
+    # (the time vector of the simulation, see sde_evo_mnist)
+    time = _np.linspace(sim_start, sim_stop-time_step, int(total_steps))
 
     class_labels = exp_params.class_labels
     # classMags = exp_params.classMags
@@ -92,46 +196,462 @@ def sde_wrap( model_params, exp_params, feature_array ):
         octo_hits[ hits ] = exp_params.octoMag
     octo_hits = _np.convolve(octo_hits, lpWindow, 'same') # the low pass filter
 
-    ## do SDE time-step evolution:
+    return time, class_mag_mat, octo_hits
 
-    # Use euler-maruyama SDE method, milstein's version.
-    #  Y (the vector of all neural firing rates) is structured as a row vector as follows: [ P, PI, L, K, E ]
-    Po = _np.ones(nP) # P are the normalized FRs of the excitatory PNs
-    PIo = _np.ones(nPI) # PI are the normed FRs of the inhib PNs
-    Lo = _np.ones(nG)
-    Ro = model_params.Rspont
-    Ko = _np.ones(model_params.nK) # K are the normalized firing rates of the Kenyon cells
-    Eo = _np.zeros(model_params.nE) # start at zeros
-    init_cond = _np.concatenate((Po, PIo, Lo, Ro, Ko, Eo) , axis=None) # initial conditions for Y
+def stim_schedule( class_mag_mat, feature_array, F2R ):
+    """
+    Precompute the stimulus events of an experiment, and their inputs to the RNs.
 
-    tspan = ( sim_start, sim_stop )
-    seed_val = 0 # to free up or fix randn
-    # If = 0, a random seed value will be chosen. If > 0, the seed will be defined.
+    Each event is a run of timepoints where a class has non-zero magnitude, ie \
+    the presentation of one image. Images of each class are used in order: the \
+    image of an event is given by the number of onsets of its class so far (the \
+    `class_counter` of :func:`sde_evo_mnist`). Since the inputs are linear in the \
+    features, each image is projected onto the RNs (`F2R @ image`) just once.
 
-    # run the SDE evolution:
-    this_run = sde_evo_mnist(tspan, init_cond, time, class_mag_mat, feature_array,
-        octo_hits, model_params, exp_params, seed_val )
-    # time stepping done
+    Args:
+        class_mag_mat (numpy array): [# of different classes X vector of time points] \
+        each entry is the strength of a digit presentation.
+        feature_array (numpy array): [numFeatures x numStimsPerClass x numClasses]
+        F2R (numpy array): [nR x numFeatures] feature to RN connection matrix (or \
+        [numMoths x nR x numFeatures] for a batch of moths).
 
-    ## Unpack Y and save results:
-    # Y is a matrix numTimePoints x nG
-    # Each col is a PN, each row holds values for a single timestep
-    # Y = this_run['Y']
+    Returns
+    -------
+        schedule (dict)
+            - ev_class, ev_image, ev_start, ev_stop: class, image index and \
+            [start, stop) time indices of each event
+            - ev_drive: [numEvents x (numMoths x) nR] RN input of each event's image
+            - ptr, ids: the events active at time index i are \
+            ids[ptr[i]:ptr[i+1]]
+            - no_drive: zero RN input, for timepoints with no stimulus
 
-    # save some inputs and outputs to a struct for argout:
-    sim_results = {
-                    'T' : this_run['T'], # timing information
-                    'E' : this_run['E'],
-                    'octo_hits' : octo_hits,
-                    'K2Efinal' : this_run['K2Efinal'],
-                    'P2Kfinal' : this_run['P2Kfinal'],
-                    'nE' : nE
-                }
+    >>> schedule = stim_schedule(class_mag_mat, feature_array, model_params.F2R)
 
-    return sim_results
+    """
+    nC, N = class_mag_mat.shape
+    on = class_mag_mat != 0
+    ev_class, ev_image, ev_start, ev_stop = [], [], [], []
+    for j in range(nC):
+        # runs of non-zero magnitude:
+        edges = _np.diff(_np.concatenate(([0], on[j].astype(int), [0])))
+        starts = _np.nonzero(edges == 1)[0]
+        stops = _np.nonzero(edges == -1)[0]
+        # class_counter counts onsets after time index 0, and the image index is
+        # class_counter - 1 (so a run at time index 0 uses image -1):
+        counter = _np.cumsum(starts > 0)
+        ev_class += [j]*len(starts)
+        ev_image += list(counter - 1)
+        ev_start += list(starts)
+        ev_stop += list(stops)
+    order = _np.argsort(ev_start, kind='stable')
+    ev_class = _np.array(ev_class, dtype=int)[order]
+    ev_image = _np.array(ev_image, dtype=int)[order]
+    ev_start = _np.array(ev_start, dtype=int)[order]
+    ev_stop = _np.array(ev_stop, dtype=int)[order]
+
+    # RN inputs of each event's image (before scaling by its magnitude)
+    images = feature_array[:, ev_image, ev_class] # [numFeatures x numEvents]
+    ev_drive = _np.moveaxis(_np.matmul(F2R, images), -1, 0)
+    no_drive = _np.zeros(F2R.shape[:-1])
+
+    # events active at each time index
+    lengths = ev_stop - ev_start
+    ids = _np.repeat(_np.arange(len(ev_start)), lengths)
+    steps = _np.concatenate([_np.arange(a, b) for a, b in zip(ev_start, ev_stop)] + [[]]).astype(int)
+    order = _np.argsort(steps, kind='stable')
+    ids = ids[order]
+    ptr = _np.concatenate(([0], _np.cumsum(_np.bincount(steps, minlength=N))))
+
+    return {'ev_class': ev_class, 'ev_image': ev_image, 'ev_start': ev_start,
+        'ev_stop': ev_stop, 'ev_drive': ev_drive, 'ptr': ptr, 'ids': ids,
+        'no_drive': no_drive}
+
+def stim_drive( schedule, class_mag_mat, i ):
+    """
+    Look up the stimulus input to the RNs at time index i (ie F2R times the \
+    current features), from a schedule made by :func:`stim_schedule`.
+
+    Args:
+        schedule (dict): output of :func:`stim_schedule`.
+        class_mag_mat (numpy array): [# of different classes X vector of time points] \
+        each entry is the strength of a digit presentation.
+        i (int): time index.
+
+    Returns
+    -------
+        drive (numpy array)
+            [(numMoths x) nR] RN input.
+        classes (list)
+            classes being presented at time index i.
+
+    >>> drive, classes = stim_drive(schedule, class_mag_mat, i)
+
+    """
+    ids = schedule['ids'][schedule['ptr'][i]:schedule['ptr'][i+1]]
+    if len(ids) == 0:
+        return schedule['no_drive'], []
+    classes = [int(j) for j in schedule['ev_class'][ids]]
+    drive = class_mag_mat[classes[0], i]*schedule['ev_drive'][ids[0]]
+    for k, j in zip(ids[1:], classes[1:]):
+        drive = drive + class_mag_mat[j, i]*schedule['ev_drive'][k]
+    return drive, classes
+
+def piecewise_lin_pseudo_sig(x, span, slope):
+    """
+    Piecewise linear 'sigmoid' used for speed when squashing neural inputs in difference eqns.
+    """
+    y = x*slope
+    y = _np.maximum(y, -span/2) # replace values below -span/2
+    y = _np.minimum(y, span/2) # replace values above span/2
+    return y
+
+def quiescent_run_lengths( class_mag_mat, octo_hits, heb_region, settle_steps=0 ):
+    """
+    Count, for each time step, the consecutive quiescent steps starting from it. \
+    A step is quiescent if it has no stimulus, no octopamine and no Hebbian \
+    learning, and at least `settle_steps` steps have passed since the last one \
+    that did (so the neurons have relaxed back to their spontaneous FRs).
+
+    Args:
+        class_mag_mat (numpy array): [# of different classes X vector of time points] \
+        each entry is the strength of a digit presentation.
+        octo_hits (numpy array): [1 x length(t)] octopamine strengths at each timepoint.
+        heb_region (numpy array): [1 x length(t)] 1 where Hebbian learning is active.
+        settle_steps (int): [optional] number of steps to wait after any event.
+
+    Returns
+    -------
+        run_lengths (numpy array)
+            [1 x length(t)] number of quiescent steps from each step on (0 if \
+            the step itself is not quiescent).
+
+    >>> run_lengths = quiescent_run_lengths(class_mag_mat, octo_hits, hebRegion, 50)
+
+    """
+    n = len(octo_hits)
+    steps = _np.arange(n)
+    busy = ~((class_mag_mat == 0).all(axis=0) & (octo_hits == 0) & (heb_region == 0))
+    # steps since the last busy step (n if there was none)
+    last_busy = _np.maximum.accumulate(_np.where(busy, steps, -n))
+    quiet = ~busy & (steps - last_busy > settle_steps)
+    # index of the next non-quiescent step (or n), for each step
+    not_quiet = _np.append(_np.nonzero(~quiet)[0], n)
+    next_not_quiet = not_quiet[_np.searchsorted(not_quiet, steps)]
+    return next_not_quiet - steps
+
+def ou_update(w_sig, mean_spont_, old_, tau_, inputs_, h, z_):
+    """
+    Advance the decay-plus-noise dynamics d_ = (-old_*tau_ + inputs_)dt + noise \
+    by h seconds in a single step, holding the inputs fixed. This is the exact \
+    (Ornstein-Uhlenbeck) solution, so it stays stable for steps much longer than dt. \
+    z_ holds standard normal draws (one per neuron).
+    """
+    decay = _np.exp(-tau_*h)
+    mu_ = inputs_/tau_ # the FR the neurons relax to
+    sd_ = w_sig*mean_spont_*_np.sqrt((1 - decay**2)/(2*tau_))
+    return mu_ + (old_ - mu_)*decay + sd_*z_
+
+def sim_rng( seed=None ):
+    """
+    Make the random number generator for the noise of a simulation.
+
+    Args:
+        seed (int): [optional] seed (or a numpy SeedSequence, eg spawned for \
+        parallel runs, or a Generator, which is used as is). If None (or 0), a \
+        seed is drawn from numpy's global random state, so `np.random.seed` \
+        still makes runs reproducible.
+
+    Returns
+    -------
+        rng (numpy Generator)
+            random number generator owned by the simulation.
+
+    >>> rng = sim_rng(1234)
+
+    """
+    if isinstance(seed, _np.random.Generator):
+        return seed
+    if seed is None or (isinstance(seed, (int, _np.integer)) and seed == 0):
+        seed = _np.random.randint(0, 2**63 - 1, dtype=_np.int64)
+    return _np.random.default_rng(seed)
+
+def noise_blocks( rng, n, block_size=None, position=None ):
+    """
+    Generate the standard normal noise of the time steps, drawing it from `rng` \
+    in large blocks (much faster than a small draw per population per step).
+
+    Args:
+        rng (numpy Generator): random number generator (or a list of them, one \
+        per moth in a batch).
+        n (int): number of draws per time step.
+        block_size (int): [optional] number of time steps per block (by default, \
+        blocks hold about 2**18 draws per moth).
+        position (dict): [optional] kept up to date with the position in the \
+        stream: 'rng_state', the state of `rng` (a list of states, for a list) \
+        at the start of the current block, and 'row', the number of rows used \
+        from it. To resume a stream (eg from a checkpoint), pass a saved copy.
+
+    Yields
+    ------
+        z (numpy array)
+            [n] standard normal draws for a time step (or [numMoths x n]).
+
+    >>> noise = noise_blocks(rng, nP + nPI + nL + nR + nK)
+    >>> z = next(noise)
+
+    """
+    if block_size is None:
+        block_size = max(2**18 // max(n, 1), 1)
+    batch = isinstance(rng, (list, tuple))
+    rngs = rng if batch else [rng]
+    if position is None:
+        position = dict()
+    skip = 0
+    if 'rng_state' in position:
+        # resume the stream
+        for r, state in zip(rngs, position['rng_state'] if batch else [position['rng_state']]):
+            r.bit_generator.state = state
+        skip = int(position['row'])
+    while True:
+        states = [ r.bit_generator.state for r in rngs ]
+        position['rng_state'] = states if batch else states[0]
+        position['row'] = skip
+        if batch:
+            block = _np.stack([r.standard_normal((block_size, n)) for r in rngs], axis=1)
+        else:
+            block = rng.standard_normal((block_size, n))
+        for row in block[skip:]:
+            position['row'] += 1
+            yield row
+        skip = 0
+
+# version of the evolution, hashed into the keys of snapshots and checkpoints:
+# bump it when a change to the evolution makes earlier ones invalid (2: the
+# evolution steps on the time vector of the stimuli, see stim_timecourses)
+_SNAPSHOT_VERSION = 2
+
+# model params that only affect learning (not the spontaneous settling phase),
+# so they are left out of the key of the calibration snapshots:
+_CALIB_IGNORE = ('goal', 'heb', 'die_back', 'trueClassLabels', 'saveAllNeuralTimecourses')
+
+def calibration_key( mP, exP, dt, seed=None ):
+    """
+    Hash the inputs of the spontaneous settling (noise calibration) phase of a \
+    simulation, ie the model params (except the learning rates), the timing \
+    of the calibration windows and the seed, to name its snapshot (see \
+    :func:`sde_evo_mnist`). The version of the evolution is hashed too, so \
+    snapshots of older versions are not reused.
+
+    Args:
+        mP (class): model_params, including connection matrices, etc.
+        exP (class): experiment parameters with some timing info.
+        dt (float): time step.
+        seed (int): [optional] seed of the simulation (or a numpy \
+        SeedSequence). If None (or a Generator), the snapshot is shared by all \
+        unseeded runs of the moth.
+
+    Returns
+    -------
+        key (str)
+            hex digest.
+
+    >>> key = calibration_key(model_params, exp_params, 0.01, seed=1234)
+
+    """
+    h = _hashlib.sha1()
+    h.update(repr(_SNAPSHOT_VERSION).encode())
+    _hash_attrs(h, mP, ignore=_CALIB_IGNORE)
+    timing = [ exP.sim_start, exP.startPreNoiseSpontMean1, exP.stopPreNoiseSpontMean1,
+        exP.startSpontMean2, exP.stopSpontMean2, exP.startSpontMean3,
+        exP.stopSpontMean3, dt ]
+    h.update(repr([float(t) for t in timing]).encode())
+    _hash_seed(h, seed)
+    return h.hexdigest()
+
+def checkpoint_key( mP, exP, feature_array, seed=None, options=() ):
+    """
+    Hash all the inputs of a simulation (and the version of the evolution), \
+    to check that a checkpoint belongs to it (see :func:`sde_evo_mnist`).
+
+    Args:
+        mP (class): model_params, including connection matrices, etc.
+        exP (class): experiment parameters with timing info.
+        feature_array (numpy array): [numFeatures x numStimsPerClass x numClasses]
+        seed (int): [optional] seed of the simulation (or a numpy SeedSequence).
+        options (tuple): [optional] other settings that change the evolution \
+        (eg `sparse`), as reprs.
+
+    Returns
+    -------
+        key (str)
+            hex digest.
+
+    >>> key = checkpoint_key(model_params, exp_params, feature_array, seed=1234)
+
+    """
+    h = _hashlib.sha1()
+    h.update(repr(_SNAPSHOT_VERSION).encode())
+    _hash_attrs(h, mP)
+    _hash_attrs(h, exP)
+    _hash_value(h, _np.asarray(feature_array))
+    _hash_seed(h, seed)
+    h.update(repr(tuple(options)).encode())
+    return h.hexdigest()
+
+def _hash_value(h, value):
+    if isinstance(value, _np.ndarray):
+        h.update(repr((value.shape, value.dtype.str)).encode())
+        h.update(_np.ascontiguousarray(value).tobytes())
+    else:
+        h.update(repr(value).encode())
+
+def _hash_attrs(h, obj, ignore=()):
+    for name in sorted(vars(obj)):
+        if ignore and name.startswith(ignore):
+            continue
+        h.update(name.encode())
+        _hash_value(h, getattr(obj, name))
+
+def _hash_seed(h, seed):
+    if isinstance(seed, _np.random.SeedSequence):
+        h.update(repr((seed.entropy, seed.spawn_key)).encode())
+    elif seed is not None and not isinstance(seed, _np.random.Generator):
+        h.update(repr(int(seed)).encode())
+
+def save_snapshot( path, snapshot ):
+    """
+    Save a snapshot of an evolution (a dict of arrays, eg a calibration \
+    snapshot or a checkpoint) to an .npz file. The file is written under a \
+    temporary name then renamed, so parallel (or interrupted) runs never see \
+    a partial file.
+
+    Args:
+        path (str): .npz file name.
+        snapshot (dict): arrays to save.
+
+    >>> save_snapshot('calibration_cache/calib_<key>.npz', snapshot)
+
+    """
+    folder = _os.path.dirname(path)
+    if folder and not _os.path.isdir(folder):
+        _os.makedirs(folder, exist_ok=True)
+    tmp = '{}.{}.tmp.npz'.format(path[:-len('.npz')], _os.getpid())
+    _np.savez(tmp, **snapshot)
+    _os.replace(tmp, path)
+
+def load_snapshot( path ):
+    """
+    Load a snapshot saved by :func:`save_snapshot`.
+
+    Args:
+        path (str): .npz file name.
+
+    Returns
+    -------
+        snapshot (dict)
+            the saved arrays (None if there is no such file).
+
+    >>> snapshot = load_snapshot('calibration_cache/calib_<key>.npz')
+
+    """
+    if not _os.path.isfile(path):
+        return None
+    with _np.load(path) as f:
+        return {k: f[k] for k in f.files}
+
+def heb_update_PK( w_flat, inds, rows, cols, K, P, heb_tau, die_back_tau,
+    heb_max, dt, bufs, kill_small=False ):
+    """
+    In-place Hebbian update of the existing synapses of a PN to KC connection \
+    matrix (P2K or PI2K). Only the synapses are touched, so no nK x nP outer \
+    product or mask is formed.
+
+    Args:
+        w_flat (numpy array): 1-d view of the weights (the flattened dense matrix, \
+        or the data of a CSR matrix). Updated in place.
+        inds (numpy array): index into `w_flat` of each synapse.
+        rows (numpy array): KC (row) index of each synapse.
+        cols (numpy array): PN (col) index of each synapse.
+        K (numpy array): non-negative KC FRs.
+        P (numpy array): PN FRs.
+        heb_tau (float): learning rate (1/rate).
+        die_back_tau (float): decay rate (1/rate), 0 for no decay. Each step, \
+        the weights first lose w*dt/die_back_tau.
+        heb_max (float): ceiling for the weights.
+        dt (float): time step.
+        bufs (tuple): two preallocated arrays, each the size of `inds`.
+        kill_small (bool): [optional] scale increases by their size relative to \
+        the weight, as done for PI2K.
+
+    >>> heb_update_PK(P2K.reshape(-1), inds, rows, cols, K, P, mP.heb_tau_PK, mP.die_back_tau_PK, mP.hebMaxPK, dt, bufs)
+
+    """
+    dw, w = bufs
+    _np.take(K, rows, out=dw)
+    _np.take(P, cols, out=w)
+    dw *= w
+    dw *= 1/heb_tau
+    _np.take(w_flat, inds, out=w)
+
+    if kill_small:
+        temp = w.copy() # this detour prevents dividing by zero
+        temp[temp == 0] = 1
+        dw *= dw/temp
+
+    # decay the connections if wished: (not used for mnist experiments)
+    if die_back_tau > 0:
+        w -= w*(1/die_back_tau)*dt
+
+    w += dw
+    _np.maximum(w, 0, out=w)
+    _np.minimum(w, heb_max, out=w)
+    w_flat[inds] = w
+
+def heb_update_KE( K2E, K2E_mask, en_inds, E, K, heb_tau, die_back_tau,
+    heb_max, dt, bufs ):
+    """
+    In-place Hebbian update of the KC to EN connection matrix. Only the rows of \
+    the trained ENs are touched.
+
+    Args:
+        K2E (numpy array): [nE x nK] connection matrix. Updated in place.
+        K2E_mask (numpy array): [nE x nK] True where a synapse exists.
+        en_inds (list): indices of the trained ENs (ie the classes being shown).
+        E (numpy array): EN FRs.
+        K (numpy array): KC FRs.
+        heb_tau (float): learning rate (1/rate).
+        die_back_tau (float): decay rate (1/rate) of the inactive connections \
+        of the trained ENs, 0 for no decay.
+        heb_max (float): ceiling for the weights.
+        dt (float): time step.
+        bufs (tuple): two preallocated arrays, each of length nK.
+
+    >>> heb_update_KE(K2E, K2E_mask, [3], E, K, mP.heb_tau_KE, mP.die_back_tau_KE, mP.hebMaxKE, dt, bufs)
+
+    """
+    dk2e, die_back = bufs
+    for j in en_inds:
+        w = K2E[j] # view
+        _np.multiply(K, E[j], out=dk2e)
+        dk2e *= 1/heb_tau
+        dk2e *= K2E_mask[j]
+
+        # inactive connections for this EN die back:
+        if die_back_tau:
+            _np.add(w, 2, out=die_back) # the '+2' allows weights to die to absolute 0
+            die_back *= 1/die_back_tau
+            die_back *= dt
+            die_back *= dk2e == 0
+            w -= die_back
+
+        w += dk2e
+        _np.maximum(w, 0, out=w)
+        _np.minimum(w, heb_max, out=w)
 
 def sde_evo_mnist(tspan, init_cond, time, class_mag_mat, feature_array,
-    octo_hits, mP, exP, seed_val):
+    octo_hits, mP, exP, seed_val, fast_quiescent=False, quiescent_step=0.2,
+    sparse=False, recorders=None, kernel='numpy', schedule=None,
+    calibration_cache=None, checkpoint=None, checkpoint_interval=300):
     """
 
     To include neural noise, evolve the differential equations using Euler-Maruyama, \
@@ -163,6 +683,76 @@ def sde_evo_mnist(tspan, init_cond, time, class_mag_mat, feature_array,
         #. The `mean_spont_FR`s and `std_spont_FR`s are not 'settled' until after \
         the `stopSpontMean3` timepoint.
 
+    *Regarding fast_quiescent:*
+    Most of an MNIST experiment is spent in the gaps between digits, where there \
+    is no stimulus, no octopamine and no Hebbian learning. If `fast_quiescent` is \
+    set, these stretches (after the noise calibration, and once the neurons have \
+    settled for 1 sec after the last event) are advanced in steps of up \
+    to `quiescent_step` seconds: the inputs to each neuron are held fixed over \
+    the step and the decay-plus-noise dynamics are solved exactly (see \
+    :func:`ou_update`). EN values within a step follow the exact (noise-free) \
+    exponential relaxation, so `E` is still filled at every timepoint. This is an \
+    approximation, so it is off by default, and it is not used if neurons other \
+    than ENs are recorded (eg if `mP.saveAllNeuralTimecourses` is set).
+
+    *Regarding recorders:*
+    Only the current FRs are kept during the evolution (the mean_spont_FRs of \
+    the noise calibration are running means, see :class:`record.RunningStats`). \
+    Timecourses are handed to the `recorders` (see :mod:`record`), which can \
+    keep them in memory, stream them to memory-mapped .npy files or to a \
+    function, decimate them, or select neuron types. By default, a \
+    :class:`record.MemoryRecorder` records the ENs (or all neurons, if \
+    `mP.saveAllNeuralTimecourses` is set), and its timecourses are returned \
+    as `T`, `E` and `Y`.
+
+    *Regarding kernel:*
+    With `kernel='numba'`, each time step of the FRs (but not the Hebbian \
+    updates) is done by :func:`kernels.fused_step`, compiled with numba, in a \
+    single pass with no temporaries. It uses the same noise draws as the \
+    default 'numpy' step, so for a given seed the results agree to rounding. \
+    It needs `sparse=False`, and if numba is not installed the 'numpy' step \
+    is used (with a warning).
+
+    *Regarding noise:*
+    The Wiener noise is drawn from a numpy Generator owned by the simulation \
+    (see :func:`sim_rng`), in large blocks of standard normals (see \
+    :func:`noise_blocks`), each time step taking one row for P, PI, L, R and K \
+    (in that order). So separate (eg parallel) simulations do not share random \
+    state.
+
+    *Regarding calibration_cache:*
+    The first part of each simulation (from `sim_start` to `stopSpontMean3`) \
+    lets the neurons settle and calibrates the noise, and does not depend on \
+    the stimuli. If `calibration_cache` is given, the state at the end of it \
+    (FRs, mean_spont_FRs, KC damping floor, RNG state and the EN timecourses so \
+    far) is saved there, named by :func:`calibration_key`, and later runs of \
+    the same moth (with the same seed) start from it. The noise stream is \
+    restarted at this point in every run, so a seeded run gives the same \
+    results with or without the cache. Unseeded runs share the snapshot of \
+    the moth but draw fresh noise after it. The cache is not used if neurons \
+    other than ENs are recorded, or if anything happens (stimuli, octopamine, \
+    learning) before `stopSpontMean3`.
+
+    *Regarding checkpoint:*
+    If `checkpoint` is given, the full state of the evolution loop (time index, \
+    FRs, plastic P2K, PI2K and K2E, calibration state, position in the noise \
+    stream, and the progress of the recorders) is saved there every \
+    `checkpoint_interval` seconds. If the file exists when a run starts, the \
+    run carries on from it, and gives the same results as an uninterrupted \
+    run (a ValueError is raised if the checkpoint is from a run with other \
+    inputs). So an interrupted job is resumed by running it again. The file \
+    is removed when the run completes. Recorders writing to files (eg \
+    :class:`record.NpyRecorder`) must keep the same folder.
+
+    *Regarding sparse:*
+    Each KC receives input from only ~`numPperK` PNs, so most entries of P2K \
+    are zero (and PI2K is empty for mnist). If `sparse` is set, P2K and PI2K \
+    are held in CSR format: the KC inputs are sparse mat-vec products, and \
+    the Hebbian updates touch only the existing synapses (the stored entries of \
+    the CSR matrices, which stay fixed even if a weight decays to 0). K2E and \
+    the L2* matrices are (nearly) dense, so they stay dense. The final P2K is \
+    returned as a dense array either way.
+
     Args:
         tspan (tuple): start and stop timepoints (seconds)
         init_cond (numpy array): [n x 1] starting FRs for all neurons, order-specific
@@ -175,40 +765,66 @@ def sde_evo_mnist(tspan, init_cond, time, class_mag_mat, feature_array,
         octo_hits (numpy array): [1 x length(t)] octopamine strengths at each timepoint.
         mP (class): model_params, including connection matrices, learning rates, etc.
         exP (class): experiment parameters with some timing info.
-        seed_val (int): optional arg for random number generation.
+        seed_val (int): optional arg for random number generation (see \
+        :func:`sim_rng`).
+        fast_quiescent (bool): [optional] advance quiescent stretches in coarse steps.
+        quiescent_step (float): [optional] maximum step size (seconds) in quiescent \
+        stretches.
+        sparse (bool): [optional] use CSR matrices for P2K and PI2K.
+        recorders (list): [optional] :class:`record.Recorder` objects.
+        kernel (str): [optional] 'numpy' or 'numba' (see *Regarding kernel*).
+        schedule (dict): [optional] stimulus events from :func:`stim_schedule` \
+        (computed here if not given).
+        calibration_cache (str): [optional] folder of calibration snapshots (see \
+        *Regarding calibration_cache*).
+        checkpoint (str): [optional] .npz file for checkpoints (see *Regarding \
+        checkpoint*).
+        checkpoint_interval (float): [optional] seconds (wall-clock) between \
+        checkpoints.
 
     Returns:
         this_run (dict):
             - T: [m x 1] timepoints used in evolution (timepoints used in evolution)
+            - E: [m x nE] EN timecourses
             - Y: [m x K] where K contains all FRs for P, L, PI, KC, etc; and each \
             row is the FR at a given timepoint
+            - recordings: (only if `recorders` are given) list with the output \
+            of each recorder. In this case `T` and `E` are taken from the first \
+            recording that includes ENs (if none does, `T` holds all timepoints \
+            and `E` is None).
             - P2K: connection matrix
             - K2E: connection matrix
+            - state: final FRs of each neuron type ('P', ..., 'E'), the \
+            mean_spont_FRs ('mean_spont_P', ...) and 'maxSpontP2KtimesPval'
 
     """
 
-    def piecewise_lin_pseudo_sig(x, span, slope):
-        """
-        Piecewise linear 'sigmoid' used for speed when squashing neural inputs in difference eqns.
+    def wiener(w_sig, mean_spont_, old_, tau_, inputs_, z_):
         """
-        y = x*slope
-        y = _np.maximum(y, -span/2) # replace values below -span/2
-        y = _np.minimum(y, span/2) # replace values above span/2
-        return y
-
-    def wiener(w_sig, mean_spont_, old_, tau_, inputs_):
-        """
-        Calculate wiener noise.
+        Calculate wiener noise (z_ holds standard normal draws).
         """
         d_ = dt*(-old_*tau_ + inputs_)
         # Wiener noise:
-        dW_ = _np.sqrt(dt)*w_sig*mean_spont_*_np.random.normal(0,1,(d_.shape))
+        dW_ = _np.sqrt(dt)*w_sig*mean_spont_*z_
         # combine them:
         return old_ + d_ + dW_
 
-    # if argin seed_val is nonzero, fix the rand seed for reproducible results
-    if seed_val:
-        _np.random.seed(seed_val)  # Reset random state
+    def step(w_sig, mean_spont_, old_, tau_, inputs_, n_steps, z_):
+        """
+        Advance by n_steps time steps: one Euler-Maruyama step, or one exact \
+        OU step over a quiescent stretch.
+        """
+        if n_steps > 1:
+            return ou_update(w_sig, mean_spont_, old_, tau_, inputs_, n_steps*dt, z_)
+        return wiener(w_sig, mean_spont_, old_, tau_, inputs_, z_)
+
+    # the noise is drawn from a Generator owned by this simulation. If argin
+    # seed_val is nonzero, it fixes the seed for reproducible results.
+    # The noise calibration and the rest of the run use separate streams, so
+    # the rest of the run only depends on the state of the second one (see
+    # *Regarding calibration_cache*)
+    rng_calib = sim_rng(seed_val)
+    rng = _np.random.default_rng(rng_calib.integers(2**63 - 1))
 
     spin = '/-\|' # create spinner for progress bar
 
@@ -227,6 +843,10 @@ def sde_evo_mnist(tspan, init_cond, time, class_mag_mat, feature_array,
     wKsig = mP.noiseKvec.squeeze()
     wEsig = mP.noiseEvec.squeeze()
 
+    # the # st devs of the KC inputs to give the correct sparsity (see dK below)
+    numNoOctoStds = _np.sqrt(2)*erfinv(1 - 2*mP.sparsityTarget)
+    numOctoStds = _np.sqrt(2)*erfinv(1 - 2*mP.octoSparsityTarget)
+
     # steady-state RN FR, base + noise:
     RspontRatios = mP.Rspont/mP.Rspont.mean() # used to scale stim inputs
 
@@ -241,38 +861,87 @@ def sde_evo_mnist(tspan, init_cond, time, class_mag_mat, feature_array,
 #-------------------------------------------------------------------------------
 
     dt = round(time[1] - time[0], 2) # this is determined by start, stop and step in calling function
-    N = int( (tspan[1] - tspan[0]) / dt ) # number of steps in noise evolution
-    T = _np.linspace(tspan[0], tspan[1]-dt, N) # the time vector
+    # the time vector: the timepoints of the stimulus and octopamine time courses
+    T = _np.asarray(time)
+    N = len(T) # number of steps in noise evolution
 
 #-------------------------------------------------------------------------------
 
-    P = _np.zeros((nP, N))
-    PI = _np.zeros((mP.nPI, N)) # no PIs for mnist
-    L = _np.zeros((nL, N))
-    R = _np.zeros((nR, N))
-    K = _np.zeros((mP.nK, N))
-    E = _np.zeros((mP.nE, N))
-
-    # initialize the FR matrices with initial conditions
-    P[:,0] = init_cond[ : nP ] # col vector
-    PI[:,0] = init_cond[ nP : nP + mP.nPI ] # no PIs for mnist
-    L[:,0] = init_cond[ nP + mP.nPI : nP + mP.nPI + nL ]
-    R[:,0] = init_cond[ nP + mP.nPI + nL : nP + mP.nPI + nL + nR ]
-    K[:,0] = init_cond[ nP + mP.nPI + nL + nR : nP + mP.nPI + nL + nR + mP.nK ]
-    E[:,0] = init_cond[ -mP.nE : ]
-    # P2Kheb = mP.P2K # '-heb' suffix is used to show that it will vary with time
-    # PI2Kheb = mP.PI2K # no PIs for mnist
-    # K2Eheb = mP.K2E
-
-    P2Kmask = mP.P2K > 0
-    PI2Kmask = mP.PI2K > 0 # no PIs for mnist
+    # initialize the FRs with initial conditions
+    stateP = init_cond[ : nP ] # col vector
+    statePI = init_cond[ nP : nP + mP.nPI ] # no PIs for mnist
+    stateL = init_cond[ nP + mP.nPI : nP + mP.nPI + nL ]
+    stateR = init_cond[ nP + mP.nPI + nL : nP + mP.nPI + nL + nR ]
+    stateK = init_cond[ nP + mP.nPI + nL + nR : nP + mP.nPI + nL + nR + mP.nK ]
+    stateE = init_cond[ -mP.nE : ]
+
+    # windows used to calibrate the noise to the mean spontaneous FRs. No FR
+    # histories are kept: the mean (and std) of the FRs in each window are
+    # updated online (Welford) while the window is open. The recorders get the
+    # timecourses:
+    calib_windows = [ (exP.startPreNoiseSpontMean1, exP.stopPreNoiseSpontMean1),
+                      (exP.startSpontMean2, exP.stopSpontMean2),
+                      (exP.startSpontMean3, exP.stopSpontMean3) ]
+    calib_bounds = _np.cumsum([0, nP, mP.nPI, nL, nR, mP.nK])
+    calib_stats = [ RunningStats((calib_bounds[-1],)) for _ in calib_windows ]
+
+    def calibrate(t):
+        # add the current FRs to any calibration window that is open at time t
+        for w, (start, stop) in enumerate(calib_windows):
+            if start < t < stop:
+                calib_stats[w].update(_np.concatenate((stateP, statePI, stateL,
+                    stateR, stateK)))
+
+    def calib_split(x):
+        # split an [nP + nPI + nL + nR + nK] vector into the 5 neuron types
+        return [ x[a:b] for a, b in zip(calib_bounds[:-1], calib_bounds[1:]) ]
+
+    calibrate(T[0])
+
+    if recorders is None:
+        if mP.saveAllNeuralTimecourses:
+            recorders_ = [MemoryRecorder(populations=POPULATIONS)]
+        else:
+            recorders_ = [MemoryRecorder(populations=('E',))]
+    else:
+        recorders_ = list(recorders)
+    sizes = {'P': nP, 'PI': mP.nPI, 'L': nL, 'R': nR, 'K': mP.nK, 'E': mP.nE}
+    # '-heb' suffix is used to show that it will vary with time. These are the
+    # only copies of the plastic weights, and are updated in place (see HEBBIAN UPDATES)
+    K2Eheb = mP.K2E.copy()
     K2Emask = mP.K2E > 0
-    newP2K = mP.P2K.copy() # initialize
-    newPI2K = mP.PI2K.copy() # no PIs for mnist
-    newK2E = mP.K2E.copy()
-
-    # initialize the counters for the various classes
-    class_counter = _np.zeros(nC)
+    if sparse:
+        # the stored entries of the CSR matrices are the existing synapses, so
+        # they play the role of the masks:
+        P2Kheb = _sparse.csr_matrix(mP.P2K)
+        PI2Kheb = _sparse.csr_matrix(mP.PI2K) # no PIs for mnist
+        P2Krows = _np.repeat(_np.arange(mP.nK), _np.diff(P2Kheb.indptr))
+        P2Kcols = P2Kheb.indices
+        P2Kinds = _np.arange(P2Kheb.nnz)
+        PI2Krows = _np.repeat(_np.arange(mP.nK), _np.diff(PI2Kheb.indptr))
+        PI2Kcols = PI2Kheb.indices
+        PI2Kinds = _np.arange(PI2Kheb.nnz)
+        # flat views of the weights, for the in-place Hebbian updates:
+        flatP2K, flatPI2K = P2Kheb.data, PI2Kheb.data
+    else:
+        P2Kheb = mP.P2K.copy() # initialize
+        PI2Kheb = mP.PI2K.copy() # no PIs for mnist
+        # if original synapse does not exist, it will never grow:
+        P2Krows, P2Kcols = _np.nonzero(mP.P2K > 0)
+        P2Kinds = _np.ravel_multi_index((P2Krows, P2Kcols), mP.P2K.shape)
+        PI2Krows, PI2Kcols = _np.nonzero(mP.PI2K > 0) # no PIs for mnist
+        PI2Kinds = _np.ravel_multi_index((PI2Krows, PI2Kcols), mP.PI2K.shape)
+        flatP2K, flatPI2K = P2Kheb.reshape(-1), PI2Kheb.reshape(-1)
+
+    # preallocated buffers for the Hebbian updates
+    P2Kbufs = (_np.empty(len(P2Kinds)), _np.empty(len(P2Kinds)))
+    PI2Kbufs = (_np.empty(len(PI2Kinds)), _np.empty(len(PI2Kinds)))
+    K2Ebufs = (_np.empty(mP.nK), _np.empty(mP.nK))
+
+    # the stimulus events (ie which image of which class is presented when),
+    # with the images' inputs to the RNs
+    if schedule is None:
+        schedule = stim_schedule(class_mag_mat, feature_array, mP.F2R)
 
     # make a list of Ts for which heb is active
     hebRegion = _np.zeros(T.shape)
@@ -280,6 +949,36 @@ def sde_evo_mnist(tspan, init_cond, time, class_mag_mat, feature_array,
         inds = _np.bitwise_and(T >= exP.hebStarts[i], T <= (exP.hebStarts[i] + exP.hebDurations[i]))
         hebRegion[inds] = 1
 
+    # optional compiled kernel for the time steps
+    if kernel == 'numba':
+        if sparse:
+            raise ValueError('The numba kernel needs dense connection matrices (sparse=False)')
+        if not _kernels.NUMBA_AVAILABLE:
+            _warnings.warn('numba is not installed, so the numpy kernel is used')
+            kernel = 'numpy'
+    elif kernel != 'numpy':
+        raise ValueError(f'Unknown kernel: {kernel}')
+    use_kernel = kernel == 'numba'
+    if use_kernel:
+        kernel_params = _kernels.pack_params(mP, dt, (wPsig, wPIsig, wLsig, wRsig, wKsig))
+
+    # noise, in blocks: each time step takes one row, split into P, PI, L, R, K
+    bounds = _np.cumsum([0, nP, mP.nPI, nL, nR, mP.nK])
+    zsP, zsPI, zsL, zsR, zsK = [slice(a, b) for a, b in zip(bounds[:-1], bounds[1:])]
+    noise_pos = dict() # position in the noise stream (see noise_blocks)
+    noise = noise_blocks(rng_calib, bounds[-1], position=noise_pos)
+
+    # for fast_quiescent: the number of quiescent steps ahead of each step
+    # (coarse steps skip the FRs of all neurons but ENs)
+    only_E = all(set(rec.populations) <= {'E'} for rec in recorders_)
+    if fast_quiescent and only_E:
+        # let the neurons settle for 1 sec (ie 7 time constants) after each event
+        quiet_run = quiescent_run_lengths(class_mag_mat, octo_hits, hebRegion,
+            settle_steps=int(round(1/dt)))
+    else:
+        quiet_run = _np.zeros(N, dtype=int)
+    max_skip = max(int(round(quiescent_step/dt)), 1)
+
     ## DEBUG STEP:
     # import matplotlib.pyplot as _plt
     # fig, ax = _plt.subplots()
@@ -306,9 +1005,105 @@ def sde_evo_mnist(tspan, init_cond, time, class_mag_mat, feature_array,
     # placeholder until we have an estimate based on spontaneous PN firing rates
     maxSpontP2KtimesPval = 10
 
+    # the noise calibration is done at the first timepoint after stopSpontMean3.
+    # Its snapshot can be cached if only the ENs are recorded and nothing but
+    # spontaneous activity happens up to then:
+    after_calib = T > exP.stopSpontMean3
+    i_calib = int(_np.argmax(after_calib)) if after_calib.any() else N
+    snapshot_path, snapshot, E_calib = None, None, None
+    if calibration_cache and only_E and i_calib < N-1 and not (
+        class_mag_mat[:, :i_calib+1].any() or octo_hits[:i_calib+1].any()
+        or hebRegion[:i_calib+1].any() ):
+        snapshot_path = _os.path.join(calibration_cache,
+            'calib_{}.npz'.format(calibration_key(mP, exP, dt, seed_val)))
+    seeded = isinstance(seed_val, _np.random.SeedSequence) or not (
+        seed_val is None or isinstance(seed_val, _np.random.Generator) or seed_val == 0)
+
+    # an earlier checkpoint of this run (see *Regarding checkpoint*):
+    ck = None
+    if checkpoint:
+        ck_key = checkpoint_key(mP, exP, feature_array, seed_val, options=(
+            fast_quiescent, quiescent_step, sparse, kernel, [ (type(rec).__name__,
+            rec.populations, rec.decimate) for rec in recorders_ ]))
+        ck = load_snapshot(checkpoint)
+        if ck is not None and str(ck['key']) != ck_key:
+            raise ValueError(f'The checkpoint {checkpoint} is from a different simulation')
+        last_checkpoint = _time.time()
+    if ck is None and snapshot_path:
+        snapshot = load_snapshot(snapshot_path)
+
+    def save_checkpoint():
+        # the full state of the evolution loop, as arrays:
+        ck = {pop: x for pop, x in zip(POPULATIONS, (stateP, statePI, stateL,
+            stateR, stateK, stateE))}
+        ck.update({'mean_spont_' + pop: x for pop, x in zip(POPULATIONS[:-1],
+            (mean_spont_P, mean_spont_PI, mean_spont_L, mean_spont_R, mean_spont_K))})
+        ck.update({ 'key': ck_key, 'i': i, 'maxSpontP2KtimesPval': maxSpontP2KtimesPval,
+            'meanCalcDone': [meanCalc1Done, meanCalc2Done, meanCalc3Done],
+            'P2K': flatP2K, 'PI2K': flatPI2K, 'K2E': K2Eheb,
+            'noise_pos': _json.dumps(noise_pos),
+            'rng_state': _json.dumps(rng.bit_generator.state) })
+        for w, stats in enumerate(calib_stats):
+            ck[f'calib{w}_count'] = stats.count
+            ck[f'calib{w}_mean'] = stats.mean
+            ck[f'calib{w}_M2'] = stats.M2
+        if E_calib is not None:
+            ck['E_calib'] = E_calib
+        for j, rec in enumerate(recorders_):
+            ck.update({f'rec{j}_{k}': v for k, v in rec.state().items()})
+        save_snapshot(checkpoint, ck)
+
+    i = 0 # i = index of the time point
+    if ck is not None:
+        # carry on from the checkpoint
+        i = int(ck['i'])
+        stateP, statePI, stateL, stateR, stateK, stateE = [ ck[pop]
+            for pop in POPULATIONS ]
+        mean_spont_P, mean_spont_PI, mean_spont_L, mean_spont_R, mean_spont_K = [
+            ck['mean_spont_' + pop] for pop in POPULATIONS[:-1] ]
+        maxSpontP2KtimesPval = float(ck['maxSpontP2KtimesPval'])
+        meanCalc1Done, meanCalc2Done, meanCalc3Done = [ bool(x) for x in ck['meanCalcDone'] ]
+        flatP2K[:], flatPI2K[:], K2Eheb[:] = ck['P2K'], ck['PI2K'], ck['K2E']
+        for w, stats in enumerate(calib_stats):
+            stats.count = int(ck[f'calib{w}_count'])
+            stats.mean, stats.M2 = ck[f'calib{w}_mean'], ck[f'calib{w}_M2']
+        if 'E_calib' in ck:
+            E_calib = ck['E_calib']
+        rng.bit_generator.state = _json.loads(str(ck['rng_state']))
+        noise_pos = _json.loads(str(ck['noise_pos']))
+        noise = noise_blocks(rng_calib if i <= i_calib else rng, bounds[-1],
+            position=noise_pos)
+        for j, rec in enumerate(recorders_):
+            prefix = f'rec{j}_'
+            rec.open(T, sizes, state={ k[len(prefix):]: v for k, v in ck.items()
+                if k.startswith(prefix) })
+    elif snapshot is not None:
+        # start from the end of the noise calibration
+        i = i_calib
+        stateP, statePI, stateL, stateR, stateK, stateE = [ snapshot[pop]
+            for pop in POPULATIONS ]
+        mean_spont_P, mean_spont_PI, mean_spont_L, mean_spont_R, mean_spont_K = [
+            snapshot['mean_spont_' + pop] for pop in POPULATIONS[:-1] ]
+        maxSpontP2KtimesPval = float(snapshot['maxSpontP2KtimesPval'])
+        meanCalc1Done = meanCalc2Done = meanCalc3Done = True
+        if seeded:
+            rng.bit_generator.state = _json.loads(str(snapshot['rng_state']))
+        for rec in recorders_:
+            rec.open(T, sizes)
+            rec.write(0, {'E': snapshot['E_calib']}, n_steps=i_calib+1)
+    else:
+        if snapshot_path:
+            # EN timecourses until the end of the noise calibration
+            E_calib = _np.zeros((i_calib+1, mP.nE))
+            E_calib[0] = stateE
+        for rec in recorders_:
+            rec.open(T, sizes)
+            rec.write(0, {'P': stateP, 'PI': statePI, 'L': stateL, 'R': stateR,
+                'K': stateK, 'E': stateE})
+
     ## Main evolution loop:
     # iterate through time steps to get the full evolution:
-    for i in range(N-1): # i = index of the time point
+    while i < N-1:
         prog = int(15*(i/N))
         remain = 15-prog-1
         mult = 50 # multiplier (spinner speed control)
@@ -316,25 +1111,21 @@ def sde_evo_mnist(tspan, init_cond, time, class_mag_mat, feature_array,
 
         # step = _np.round(time[1] - time[0], 4)
 
-        # if sufficiently early, or we want the entire evo
-        if T[i]<(exP.stopSpontMean3 + 5) or mP.saveAllNeuralTimecourses:
-            oldP = P[:,i]
-            oldPI = PI[:,i] # no PIs for mnist
-            oldL = L[:,i]
-            oldR = R[:,i]
-            oldK = K[:,i]
-        else: # version to save memory:
-            oldP = P.reshape(P.shape[0], -1)[:,-1]
-            oldPI = PI.reshape(PI.shape[0], -1)[:,-1]
-            oldL = L.reshape(L.shape[0], -1)[:,-1]
-            oldR = R.reshape(R.shape[0], -1)[:,-1]
-            oldK = K.reshape(K.shape[0], -1)[:,-1]
-        oldE = E[:,i]
+        oldP = stateP
+        oldPI = statePI # no PIs for mnist
+        oldL = stateL
+        oldR = stateR
+        oldK = stateK
+        oldE = stateE
         oldT = T[i]
 
-        oldP2K = newP2K.copy() # these are inherited from the previous iteration
-        oldPI2K = newPI2K.copy() # no PIs for mnist
-        oldK2E = newK2E.copy()
+        # number of time steps to advance. > 1 only in quiescent stretches after
+        # the noise calibration, when fast_quiescent is set
+        if T[i] >= (exP.stopSpontMean3 + 5):
+            n_steps = max(min(quiet_run[i], max_skip, N-1-i), 1)
+        else:
+            n_steps = 1
+
 
 #-------------------------------------------------------------------------------
 
@@ -351,39 +1142,23 @@ def sde_evo_mnist(tspan, init_cond, time, class_mag_mat, feature_array,
 
         if adjustNoiseFlag1 and not(meanCalc1Done):
             # ie we have not yet calc'ed the noise weight vectors
-            inds = _np.nonzero(_np.logical_and(T > exP.startPreNoiseSpontMean1,
-                T < exP.stopPreNoiseSpontMean1))[0]
-            mean_spont_P = P[:,inds].mean(axis=1)
-            mean_spont_PI = PI[:,inds].mean(axis=1)
-            mean_spont_L = L[:,inds].mean(axis=1)
-            mean_spont_R = R[:,inds].mean(axis=1)
-            mean_spont_K = K[:,inds].mean(axis=1)
-            # mean_spont_E = E[:,inds].mean(axis=1)
+            mean_spont_P, mean_spont_PI, mean_spont_L, mean_spont_R, mean_spont_K = \
+                calib_split(calib_stats[0].mean)
             meanCalc1Done = 1 # so we don't calc this again
 
         if adjustNoiseFlag2 and not(meanCalc2Done):
             # ie we want to calc new noise weight vectors. This stage is surplus
-            inds = _np.nonzero(_np.logical_and(T > exP.startSpontMean2,
-                T < exP.stopSpontMean2))[0]
-            mean_spont_P = P[:,inds].mean(axis=1)
-            mean_spont_PI = PI[:,inds].mean(axis=1)
-            mean_spont_L = L[:,inds].mean(axis=1)
-            mean_spont_R = R[:,inds].mean(axis=1)
-            mean_spont_K = K[:,inds].mean(axis=1)
-            # mean_spont_E = E[:,inds].mean(axis=1)
-            # stdSpontP = P[:,inds].std(axis=1) # for checking progress
+            mean_spont_P, mean_spont_PI, mean_spont_L, mean_spont_R, mean_spont_K = \
+                calib_split(calib_stats[1].mean)
+            # stdSpontP = calib_split(calib_stats[1].std)[0] # for checking progress
             meanCalc2Done = 1 # so we don't calc this again
 
         if adjustNoiseFlag3 and not(meanCalc3Done):
             # we want to calc stdSpontP for use with LH channel and maybe for use in heb
             # maybe we should also use this for noise calcs (eg dWP).
             # But the difference is slight.
-            inds = _np.nonzero(_np.logical_and(T > exP.startSpontMean3,
-                T < exP.stopSpontMean3))[0]
-            ssMeanSpontP = P[:,inds].mean(axis=1) # 'ss' means steady state
-            ssStdSpontP = P[:,inds].std(axis=1)
-            ssMeanSpontPI = PI[:,inds].mean(axis=1) # no PIs for mnist
-            ssStdSpontPI = PI[:,inds].std(axis=1) # no PIs for mnist
+            ssMeanSpontP, ssMeanSpontPI = calib_split(calib_stats[2].mean)[:2] # 'ss' means steady state
+            ssStdSpontP, ssStdSpontPI = calib_split(calib_stats[2].std)[:2] # no PIs for mnist
             meanCalc3Done = 1 # so we don't calc this again
 
             # set a minimum damping on KCs based on spontaneous PN activity,
@@ -394,21 +1169,28 @@ def sde_evo_mnist(tspan, init_cond, time, class_mag_mat, feature_array,
             maxSpontP2KtimesPval = temp.max() # The minimum global damping on the MB
             meanCalc3Done = 1
 
-        # create class_counter - the counters for the various classes
-        if i: # if i is not zero
-            class_counter += _np.logical_and(class_mag_mat[:,i-1]==0, class_mag_mat[:,i]>0)
-
-        # get values of feature inputs at time index i, as a col vector.
+        if i == i_calib:
+            # restart the noise stream, so the rest of the run only depends on
+            # the RNG state here (see *Regarding calibration_cache*)
+            noise_pos = dict()
+            noise = noise_blocks(rng, bounds[-1], position=noise_pos)
+            if E_calib is not None:
+                snapshot = {pop: x for pop, x in zip(POPULATIONS, (stateP,
+                    statePI, stateL, stateR, stateK, stateE))}
+                snapshot.update({'mean_spont_' + pop: x for pop, x in zip(
+                    POPULATIONS[:-1], (mean_spont_P, mean_spont_PI, mean_spont_L,
+                    mean_spont_R, mean_spont_K))})
+                snapshot['maxSpontP2KtimesPval'] = maxSpontP2KtimesPval
+                snapshot['rng_state'] = _json.dumps(rng.bit_generator.state)
+                snapshot['E_calib'] = E_calib
+                save_snapshot(snapshot_path, snapshot)
+                E_calib = None
+
+        # get the stimulus inputs to the RNs at time index i (ie F2R times the
+        # feature inputs), and the classes being presented.
         # This allows for simultaneous inputs by different classes, but current
         #   experiments apply only one class at a time.
-        thisInput = _np.zeros(mP.nF)
-        thisStimClassInd = []
-        for j in range(nC):
-            if class_mag_mat[j,i]: # if class_mag_mat[j,i] is not zero
-                # thisInput += class_mag_mat[j,i]*feature_array[:,int(class_counter[j]),j]
-                imNum = int(class_counter[j] - 1) # indexing: need the '-1' so we don't run out of images
-                thisInput += class_mag_mat[j,i]*feature_array[:,imNum,j]
-                thisStimClassInd.append(j)
+        stimDrive, thisStimClassInd = stim_drive(schedule, class_mag_mat, i)
 
 #-------------------------------------------------------------------------------
 
@@ -418,107 +1200,127 @@ def sde_evo_mnist(tspan, init_cond, time, class_mag_mat, feature_array,
 
 #-------------------------------------------------------------------------------
 
-        # dP:
-        Pinputs = (1 - thisOctoHit*mP.octo2P*mP.octoNegDiscount).squeeze()
-        Pinputs = _np.maximum(Pinputs, 0) # pos. rectify
-        Pinputs *= -mP.L2P.dot(oldL)
-        Pinputs += (mP.R2P.squeeze()*oldR)*(1 + thisOctoHit*mP.octo2P).squeeze()
-        # ie octo increases responsivity to positive inputs and to spont firing, and
-        # decreases (to a lesser degree) responsivity to neg inputs.
-        Pinputs = piecewise_lin_pseudo_sig(Pinputs, mP.cP, pSlope)
+        z = next(noise) # standard normal draws for this step
 
-        # Wiener noise
-        newP = wiener(wPsig, mean_spont_P, oldP, mP.tau_P, Pinputs)
+        if use_kernel and n_steps == 1:
+            # fused (compiled) step, with the same noise draws as below
+            numStds = (1-thisOctoHit)*numNoOctoStds + thisOctoHit*numOctoStds
+            minDamperVal = 1.2*maxSpontP2KtimesPval
+            newP, newPI, newL, newR, newK, newE = _kernels.fused_step(oldP, oldPI,
+                oldL, oldR, oldK, oldE, stimDrive, thisOctoHit, numStds, minDamperVal,
+                P2Kheb, PI2Kheb, K2Eheb, mean_spont_P, mean_spont_PI, mean_spont_L,
+                mean_spont_R, mean_spont_K, z, *kernel_params)
+        else:
+            # dP:
+            Pinputs = (1 - thisOctoHit*mP.octo2P*mP.octoNegDiscount).squeeze()
+            Pinputs = _np.maximum(Pinputs, 0) # pos. rectify
+            Pinputs *= -mP.L2P.dot(oldL)
+            Pinputs += (mP.R2P.squeeze()*oldR)*(1 + thisOctoHit*mP.octo2P).squeeze()
+            # ie octo increases responsivity to positive inputs and to spont firing, and
+            # decreases (to a lesser degree) responsivity to neg inputs.
+            Pinputs = piecewise_lin_pseudo_sig(Pinputs, mP.cP, pSlope)
+
+            # Wiener noise
+            newP = step(wPsig, mean_spont_P, oldP, mP.tau_P, Pinputs, n_steps, z[zsP])
 
 #-------------------------------------------------------------------------------
 
-        # dPI: # no PIs for mnist
-        PIinputs = (1 - thisOctoHit*mP.octo2PI*mP.octoNegDiscount).squeeze()
-        PIinputs = _np.maximum(PIinputs, 0)  # pos. rectify
-        PIinputs *= -mP.L2PI.dot(oldL)
-        PIinputs += mP.R2PI.dot(oldR)*(1 + thisOctoHit*mP.octo2PI).squeeze()
-        # ie octo increases responsivity to positive inputs and to spont firing, and
-        # decreases (to a lesser degree) responsivity to neg inputs.
-        PIinputs = piecewise_lin_pseudo_sig(PIinputs, mP.cPI, piSlope)
+            # dPI: # no PIs for mnist
+            PIinputs = (1 - thisOctoHit*mP.octo2PI*mP.octoNegDiscount).squeeze()
+            PIinputs = _np.maximum(PIinputs, 0)  # pos. rectify
+            PIinputs *= -mP.L2PI.dot(oldL)
+            PIinputs += mP.R2PI.dot(oldR)*(1 + thisOctoHit*mP.octo2PI).squeeze()
+            # ie octo increases responsivity to positive inputs and to spont firing, and
+            # decreases (to a lesser degree) responsivity to neg inputs.
+            PIinputs = piecewise_lin_pseudo_sig(PIinputs, mP.cPI, piSlope)
 
-        # Wiener noise
-        newPI = wiener(wPIsig, mean_spont_PI, oldPI, mP.tau_PI, PIinputs)
+            # Wiener noise
+            newPI = step(wPIsig, mean_spont_PI, oldPI, mP.tau_PI, PIinputs, n_steps, z[zsPI])
 
 #-------------------------------------------------------------------------------
 
-        # dL:
-        Linputs = (1 - thisOctoHit*mP.octo2L*mP.octoNegDiscount).squeeze()
-        Linputs = _np.maximum(Linputs, 0) # pos. rectify
-        Linputs *= -mP.L2L.dot(oldL)
-        Linputs += (mP.R2L.squeeze()*oldR)*(1 + thisOctoHit*mP.octo2L).squeeze()
-        Linputs = piecewise_lin_pseudo_sig(Linputs, mP.cL, lSlope)
+            # dL:
+            Linputs = (1 - thisOctoHit*mP.octo2L*mP.octoNegDiscount).squeeze()
+            Linputs = _np.maximum(Linputs, 0) # pos. rectify
+            Linputs *= -mP.L2L.dot(oldL)
+            Linputs += (mP.R2L.squeeze()*oldR)*(1 + thisOctoHit*mP.octo2L).squeeze()
+            Linputs = piecewise_lin_pseudo_sig(Linputs, mP.cL, lSlope)
 
-        # Wiener noise
-        newL = wiener(wLsig, mean_spont_L, oldL, mP.tau_L, Linputs)
+            # Wiener noise
+            newL = step(wLsig, mean_spont_L, oldL, mP.tau_L, Linputs, n_steps, z[zsL])
 
 #-------------------------------------------------------------------------------
 
-        # dR:
-        # inputs: S = stim,  L = lateral neurons, mP.Rspont = spontaneous FR
-        # NOTE: octo does not affect mP.Rspont. It affects R's response to input odors.
-        Rinputs = (1 - thisOctoHit*mP.octo2R*mP.octoNegDiscount).squeeze()
-        Rinputs = _np.maximum(Rinputs, 0) # pos. rectify Rinputs
-        Rinputs *= -mP.L2R.dot(oldL)
-        neur_act = mP.F2R.dot(thisInput)*RspontRatios.squeeze()
-        neur_act *= (1 + thisOctoHit*mP.octo2R).squeeze()
-        Rinputs += neur_act + mP.Rspont.squeeze()
-        Rinputs = piecewise_lin_pseudo_sig(Rinputs, mP.cR, rSlope)
+            # dR:
+            # inputs: S = stim,  L = lateral neurons, mP.Rspont = spontaneous FR
+            # NOTE: octo does not affect mP.Rspont. It affects R's response to input odors.
+            Rinputs = (1 - thisOctoHit*mP.octo2R*mP.octoNegDiscount).squeeze()
+            Rinputs = _np.maximum(Rinputs, 0) # pos. rectify Rinputs
+            Rinputs *= -mP.L2R.dot(oldL)
+            neur_act = stimDrive*RspontRatios.squeeze()
+            neur_act *= (1 + thisOctoHit*mP.octo2R).squeeze()
+            Rinputs += neur_act + mP.Rspont.squeeze()
+            Rinputs = piecewise_lin_pseudo_sig(Rinputs, mP.cR, rSlope)
 
-        # Wiener noise
-        newR = wiener(wRsig, mean_spont_R, oldR, mP.tau_R, Rinputs)
+            # Wiener noise
+            newR = step(wRsig, mean_spont_R, oldR, mP.tau_R, Rinputs, n_steps, z[zsR])
 
 #-------------------------------------------------------------------------------
 
-        # Enforce sparsity on the KCs:
-        # Global damping on KCs is controlled by mP.sparsityTarget
-        # (during octopamine, by octSparsityTarget).
-        # Assume that inputs to KCs form a gaussian, and use a threshold
-        # calculated via std devs to enforce the correct sparsity.
+            # Enforce sparsity on the KCs:
+            # Global damping on KCs is controlled by mP.sparsityTarget
+            # (during octopamine, by octSparsityTarget).
+            # Assume that inputs to KCs form a gaussian, and use a threshold
+            # calculated via std devs to enforce the correct sparsity.
 
-        # Delays from AL -> MB and AL -> LH -> MB (~30 mSec) are ignored.
+            # Delays from AL -> MB and AL -> LH -> MB (~30 mSec) are ignored.
 
-        # the # st devs to give the correct sparsity
-        numNoOctoStds = _np.sqrt(2)*erfinv(1 - 2*mP.sparsityTarget)
-        numOctoStds = _np.sqrt(2)*erfinv(1 - 2*mP.octoSparsityTarget)
-        # select for either octo or no-octo
-        numStds = (1-thisOctoHit)*numNoOctoStds + thisOctoHit*numOctoStds
-        # set a minimum damping based on spontaneous PN activity, so that
-        # the MB is silent absent odor
-        minDamperVal = 1.2*maxSpontP2KtimesPval
-        thisKinput = oldP2K.dot(oldP) - oldPI2K.dot(oldPI) # (no PIs for mnist, only Ps)
+            # select for either octo or no-octo
+            numStds = (1-thisOctoHit)*numNoOctoStds + thisOctoHit*numOctoStds
+            # set a minimum damping based on spontaneous PN activity, so that
+            # the MB is silent absent odor
+            minDamperVal = 1.2*maxSpontP2KtimesPval
+            P2Kinput = P2Kheb.dot(oldP)
+            PI2Kinput = PI2Kheb.dot(oldPI) # no PIs for mnist
+            thisKinput = P2Kinput - PI2Kinput # (no PIs for mnist, only Ps)
 
-        damper = thisKinput.mean() + numStds*thisKinput.std()
-        damper = max(damper, minDamperVal)
+            damper = thisKinput.mean() + numStds*thisKinput.std()
+            damper = max(damper, minDamperVal)
 
-        dampening = (damper*mP.kGlobalDampVec).squeeze() + oldPI2K.dot(oldPI)
-        pos_octo = _np.maximum(1 - mP.octo2K*thisOctoHit, 0).squeeze()
+            dampening = (damper*mP.kGlobalDampVec).squeeze() + PI2Kinput
+            pos_octo = _np.maximum(1 - mP.octo2K*thisOctoHit, 0).squeeze()
 
-        Kinputs = oldP2K.dot(oldP)*(1 + thisOctoHit*mP.octo2K).squeeze() # but note that mP.octo2K == 0
-        Kinputs -= dampening*pos_octo # but no PIs for mnist
-        Kinputs = piecewise_lin_pseudo_sig(Kinputs, mP.cK, kSlope)
+            Kinputs = P2Kinput*(1 + thisOctoHit*mP.octo2K).squeeze() # but note that mP.octo2K == 0
+            Kinputs -= dampening*pos_octo # but no PIs for mnist
+            Kinputs = piecewise_lin_pseudo_sig(Kinputs, mP.cK, kSlope)
 
-        # Wiener noise
-        newK = wiener(wKsig, mean_spont_K, oldK, mP.tau_K, Kinputs)
+            # Wiener noise
+            newK = step(wKsig, mean_spont_K, oldK, mP.tau_K, Kinputs, n_steps, z[zsK])
 
 #-------------------------------------------------------------------------------
 
-        # Readout neurons E (EN = 'extrinsic neurons'):
-        # These are readouts, so there is no sigmoid.
-        # mP.octo2E == 0, since we are not stimulating ENs with octo.
-        # dWE == 0 since we assume no noise in ENs.
-        Einputs = oldK2E.dot(oldK)
-        # oldK2E.dot(oldK)*(1 + thisOctoHit*mP.octo2E) # mP.octo2E == 0
-        dE = dt*( -oldE*mP.tau_E + Einputs )
+            # Readout neurons E (EN = 'extrinsic neurons'):
+            # These are readouts, so there is no sigmoid.
+            # mP.octo2E == 0, since we are not stimulating ENs with octo.
+            # dWE == 0 since we assume no noise in ENs.
+            Einputs = K2Eheb.dot(oldK)
+            # K2Eheb.dot(oldK)*(1 + thisOctoHit*mP.octo2E) # mP.octo2E == 0
+            if n_steps > 1:
+                # exact relaxation towards Einputs/tau_E, at each of the skipped timepoints
+                E_mu = Einputs/mP.tau_E
+                decays = _np.exp(-mP.tau_E*dt*_np.arange(1, n_steps+1))
+                E_fill = E_mu[_np.newaxis,:] + \
+                    decays[:-1,_np.newaxis]*(oldE - E_mu)[_np.newaxis,:]
+                for rec in recorders_:
+                    rec.write(i+1, {'E': E_fill}, n_steps-1)
+                newE = E_mu + (oldE - E_mu)*decays[-1]
+            else:
+                dE = dt*( -oldE*mP.tau_E + Einputs )
 
-        # Wiener noise
-        dWE = 0 # noise = 0 => dWE == 0
-        # combine them
-        newE = oldE + dE + dWE # always non-neg
+                # Wiener noise
+                dWE = 0 # noise = 0 => dWE == 0
+                # combine them
+                newE = oldE + dE + dWE # always non-neg
 
 #-------------------------------------------------------------------------------
 
@@ -537,102 +1339,73 @@ def sde_evo_mnist(tspan, init_cond, time, class_mag_mat, feature_array,
             nonNegNewK = _np.maximum(newK, 0) # since newK has not yet been made non-neg
 
             ## dP2K:
-            dp2k = (1/mP.heb_tau_PK) * nonNegNewK.reshape(-1, 1).dot(oldP.reshape(-1, 1).T)
-            dp2k *= P2Kmask #  if original synapse does not exist, it will never grow
-
-            # decay some P2K connections if wished: (not used for mnist experiments)
-            if mP.die_back_tau_PK > 0:
-                oldP2K *= -(1/mP.die_back_tau_PK)*dt
-
-            newP2K = _np.maximum(oldP2K + dp2k, 0)
-            newP2K = _np.minimum(newP2K, mP.hebMaxPK)
-
-#-------------------------------------------------------------------------------
+            heb_update_PK(flatP2K, P2Kinds, P2Krows, P2Kcols, nonNegNewK, oldP,
+                mP.heb_tau_PK, mP.die_back_tau_PK, mP.hebMaxPK, dt, P2Kbufs)
 
             ## dPI2K: # no PIs for mnist
-            dpi2k = (1/mP.heb_tau_PIK) * nonNegNewK.reshape(-1, 1).dot(oldPI.reshape(-1, 1).T)
-            dpi2k *= PI2Kmask # if original synapse does not exist, it will never grow
-
-            # kill small increases:
-            temp = oldPI2K.copy() # this detour prevents dividing by zero
-            temp[temp == 0] = 1
-            keepMask = dpi2k/temp
-            keepMask = keepMask.reshape(dpi2k.shape)
-            dpi2k *= keepMask
-            if mP.die_back_tau_PIK > 0:
-                oldPI2K -= oldPI2K*(1/die_back_tau_PIK)*dt
-            newPI2K = _np.maximum(oldPI2K + dpi2k, 0)
-            newPI2K = _np.minimum(newPI2K, mP.hebMaxPIK)
-
-#-------------------------------------------------------------------------------
+            heb_update_PK(flatPI2K, PI2Kinds, PI2Krows, PI2Kcols, nonNegNewK, oldPI,
+                mP.heb_tau_PIK, mP.die_back_tau_PIK, mP.hebMaxPIK, dt, PI2Kbufs,
+                kill_small=True)
 
             ## dK2E:
-            #tempK = oldK
             # oldK is already nonNeg
-            dk2e = (1/mP.heb_tau_KE) * newE.reshape(-1, 1).dot(oldK.reshape(-1, 1).T)
-            dk2e *= K2Emask
-
-            # restrict changes to just the i'th row of mP.K2E, where i = ind of training stim
-            restrictK2Emask = _np.zeros(mP.K2E.shape)
-            restrictK2Emask[thisStimClassInd,:] = 1
-            dk2e *= restrictK2Emask
+            # restrict changes to just the rows of mP.K2E of the training stim
+            heb_update_KE(K2Eheb, K2Emask, thisStimClassInd, newE, oldK,
+                mP.heb_tau_KE, mP.die_back_tau_KE, mP.hebMaxKE, dt, K2Ebufs)
 
 #-------------------------------------------------------------------------------
 
-            # inactive connections for this EN die back:
-            if mP.die_back_tau_KE:
-                # restrict dieBacks to only the trained EN
-                targetMask = _np.zeros(dk2e.shape)
-                targetMask[ dk2e == 0 ] = 1
-                targetMask *= restrictK2Emask
-                dieBack = (oldK2E + 2)*(1/mP.die_back_tau_KE)*dt
-                # the '+1' allows weights to die to absolute 0
-                oldK2E -= targetMask*dieBack
-
-            newK2E = oldK2E + dk2e
-            newK2E = _np.maximum(newK2E, 0)
-            newK2E = _np.minimum(newK2E, mP.hebMaxKE)
-
-        else: # case: no heb or no octo
-            newP2K = oldP2K.copy()
-            newPI2K = oldPI2K.copy() # no PIs for mnist
-            newK2E = oldK2E.copy()
-
-#-------------------------------------------------------------------------------
-
-        # update the evolution matrices, disallowing negative FRs.
-        if T[i]<(exP.stopSpontMean3 + 5) or mP.saveAllNeuralTimecourses:
-            # case: do not save AL and MB neural timecourses after the noise
-            #   calibration is done, to save on memory
-            P[:,i+1] = _np.maximum(newP, 0)
-            PI[:,i+1] = _np.maximum(newPI, 0) # no PIs for mnist
-            L[:,i+1] = _np.maximum(newL, 0)
-            R[:,i+1] = _np.maximum(newR, 0)
-            K[:,i+1] = _np.maximum(newK, 0)
-        else:
-            P = _np.maximum(newP, 0)
-            PI = _np.maximum(newPI, 0) # no PIs for mnist
-            L = _np.maximum(newL, 0)
-            R = _np.maximum(newR, 0)
-            K = _np.maximum(newK, 0)
-
-        E[:,i+1] = newE # always save full EN timecourses
+        # update the FRs, disallowing negative FRs.
+        stateP = _np.maximum(newP, 0)
+        statePI = _np.maximum(newPI, 0) # no PIs for mnist
+        stateL = _np.maximum(newL, 0)
+        stateR = _np.maximum(newR, 0)
+        stateK = _np.maximum(newK, 0)
+        stateE = newE
+        if not meanCalc3Done:
+            # case: still in the noise calibration
+            calibrate(T[i+n_steps])
+        if E_calib is not None:
+            E_calib[i+1] = stateE
+
+        for rec in recorders_:
+            rec.write(i+n_steps, {'P': stateP, 'PI': statePI, 'L': stateL,
+                'R': stateR, 'K': stateK, 'E': stateE})
+
+        i += n_steps
+
+        if checkpoint and i < N-1 and _time.time() - last_checkpoint > checkpoint_interval:
+            save_checkpoint()
+            last_checkpoint = _time.time()
 
     print('\r')
     # Time-step simulation is now over.
+    if checkpoint and _os.path.isfile(checkpoint):
+        _os.remove(checkpoint) # the run is complete
 
     this_run = dict() # pre-allocate
-    # combine so that each row of fn output Y is a col of [P; PI; L; R; K]
-    if mP.saveAllNeuralTimecourses:
-        Y = _np.vstack((P, PI, L, R, K, E))
-        this_run['Y'] = Y.T
+    recordings = [rec.close() for rec in recorders_]
+    if recorders is None:
+        # each row of Y holds [P, PI, L, R, K, E] at a given timepoint
+        this_run['Y'] = recordings[0]['Y'] if mP.saveAllNeuralTimecourses else []
+        this_run['T'] = recordings[0]['T'] # store T as a col
+        this_run['E'] = recordings[0]['E'] # length(T) x mP.nE matrix
     else:
+        this_run['recordings'] = recordings
+        with_E = [r for r in recordings if 'E' in r]
+        this_run['T'] = with_E[0]['T'] if with_E else T
+        this_run['E'] = with_E[0]['E'] if with_E else None
         this_run['Y'] = []
-
-    this_run['T'] = T.T # store T as a col
-    this_run['E'] = E.T # length(T) x mP.nE matrix
-    this_run['P2Kfinal'] = oldP2K
-    this_run['K2Efinal'] = oldK2E
+    # the full time vector (T and E are decimated if their recorder decimates)
+    this_run['T_sim'] = T
+    this_run['P2Kfinal'] = P2Kheb.toarray() if sparse else P2Kheb
+    this_run['K2Efinal'] = K2Eheb
+    # final FRs and noise calibration, eg to run the trained moth on new digits
+    this_run['state'] = {pop: x for pop, x in zip(POPULATIONS, (stateP, statePI,
+        stateL, stateR, stateK, stateE))}
+    this_run['state'].update({'mean_spont_' + pop: x for pop, x in zip(POPULATIONS[:-1],
+        (mean_spont_P, mean_spont_PI, mean_spont_L, mean_spont_R, mean_spont_K))})
+    this_run['state']['maxSpontP2KtimesPval'] = maxSpontP2KtimesPval
 
     return this_run
 
@@ -643,6 +1416,10 @@ def collect_stats(self, sim_results, exp_params, class_labels, show_time_plots,
     Collect stats (median, mean, and std of FR) for each digit, pre- and post-training. \
     Digits are referred to as odors, or as odor puffs.
 
+    If the simulation was run with a :class:`record.StatsRecorder`, its EN peak \
+    responses and spontaneous FR stats (collected during the simulation) are \
+    used, and the EN timecourses are not needed (except for `show_time_plots`).
+
     Args:
         sim_results (dict): simulation results (output from :func:`sde_wrap`)
         exp_params (class): timing info about experiment, eg when stimuli are given
@@ -678,22 +1455,38 @@ def collect_stats(self, sim_results, exp_params, class_labels, show_time_plots,
                 std of post_spont
     """
 
-    # concurrent octopamine
+    # concurrent octopamine (octo_hits is on the full time vector, even if T is
+    # decimated by a recorder)
     if sim_results['octo_hits'].max() > 0:
-        octo_times = sim_results['T'][ sim_results['octo_hits'] > 0 ]
+        octo_times = sim_results.get('T_sim', sim_results['T'])[ sim_results['octo_hits'] > 0 ]
     else:
         octo_times = []
 
+    # EN stats collected during the simulation (if any)
+    en_stats = [r for r in sim_results.get('recordings', []) if 'stim_peaks' in r]
+    en_stats = en_stats[0] if en_stats else None
+
+    # T is sorted, so each time window is a range of indices:
+    def window(start, stop):
+        return _np.searchsorted(sim_results['T'], start, side='right'), \
+            _np.searchsorted(sim_results['T'], stop, side='left')
+
     # calc spont stats
-    pre_spont = sim_results['E'][ _np.logical_and(exp_params.preHebSpontStart < sim_results['T'],
-                                    sim_results['T'] < exp_params.preHebSpontStop) ]
-    post_spont = sim_results['E'][ _np.logical_and(exp_params.postHebSpontStart < sim_results['T'],
-                                    sim_results['T'] < exp_params.postHebSpontStop) ]
+    if en_stats:
+        pre_heb_mean = en_stats['pre_spont_mean']
+        pre_heb_std = en_stats['pre_spont_std']
+        post_heb_mean = en_stats['post_spont_mean']
+        post_heb_std = en_stats['post_spont_std']
+    else:
+        lo, hi = window(exp_params.preHebSpontStart, exp_params.preHebSpontStop)
+        pre_spont = sim_results['E'][lo:hi]
+        lo, hi = window(exp_params.postHebSpontStart, exp_params.postHebSpontStop)
+        post_spont = sim_results['E'][lo:hi]
 
-    pre_heb_mean = pre_spont.mean()
-    pre_heb_std = pre_spont.std()
-    post_heb_mean = post_spont.mean()
-    post_heb_std = post_spont.std()
+        pre_heb_mean = pre_spont.mean()
+        pre_heb_std = pre_spont.std()
+        post_heb_mean = post_spont.mean()
+        post_heb_std = post_spont.std()
 
     ## Set regions to examine:
     # 1. data from exp_params
@@ -705,72 +1498,71 @@ def collect_stats(self, sim_results, exp_params, class_labels, show_time_plots,
     # pre-allocate list of empty dicts
     results = [dict() for i in range(sim_results['nE'])]
 
+    ## calculate pre- and post-train odor response stats
+    # assumes that there is at least 1 sec on either side of an odor without octo
+
+    # peak response of each EN to each stim: max FR in t-1 < T < t+1
+    if en_stats:
+        stim_peaks = en_stats['stim_peaks']
+    else:
+        lo, hi = window(stim_starts - 1, stim_starts + 1)
+        E = sim_results['E']
+        n_T = len(sim_results['T'])
+        stim_peaks = _np.full((len(stim_starts), sim_results['nE']), _np.nan)
+        ok = lo < hi # (empty windows give nan, ie are ignored)
+        if ok.any():
+            # one pass over E: the maxes over [lo, hi) are every other entry
+            inds = _np.column_stack((lo[ok], _np.minimum(hi[ok], n_T - 1))).ravel()
+            stim_peaks[ok] = _np.maximum.reduceat(E, inds, axis=0)[::2]
+            # reduceat can't end a range at len(T), so do these directly:
+            for i in _np.nonzero(ok & (hi == n_T))[0]:
+                stim_peaks[i] = E[lo[i]:].max(axis=0)
+
+    # Note: to find no-octo stim_starts, there is a certain amount of machinery
+    # in order to mesh with the timing data from the experiment.
+    # For some reason octo_times are not recorded exactly as listed in format
+    # short mode. So we need to use abs difference > small thresh, rather
+    # than ~ismember(t, octo_times):
+    small = 1e-8 # .00000001
+    if len(octo_times)==0:
+        no_octo = _np.ones(len(stim_starts), dtype=bool)
+    else:
+        no_octo = _np.abs(octo_times[_np.newaxis,:] - stim_starts[:,_np.newaxis]).min(axis=1) > small
+    # assign no-octo, PRE-train response val (or -1 as flag)
+    use_pre = (len(octo_times)==0) | (no_octo & (stim_starts < exp_params.startTrain))
+    # assign no-octo, POST-train response val (or -1)
+    use_post = (len(octo_times)!=0) & no_octo & (stim_starts > exp_params.endTrain)
+    # [numStims x numENs]:
+    all_pre_train_resp = _np.where(use_pre[:,_np.newaxis], stim_peaks, -1)
+    all_post_train_resp = _np.where(use_post[:,_np.newaxis], stim_peaks, -1)
+
+    # calc no-octo stats for each odor, pre and post train, for all ENs at once:
+    # [numOdors x numStims x numENs], with nan for the stims to leave out
+    in_class = (which_class[_np.newaxis,:] == class_labels[:,_np.newaxis])[:,:,_np.newaxis]
+    def class_stats(train_resp):
+        # SA means 'sniffsAveraged': the average responses over all sniffs for each sample
+        SA = _np.where(in_class & (train_resp >= 0), train_resp, _np.nan)
+        num_puffs = (~_np.isnan(SA)).sum(axis=1)
+        none = num_puffs == 0
+        with _np.errstate(invalid='ignore', divide='ignore'), _warnings.catch_warnings():
+            _warnings.simplefilter('ignore', RuntimeWarning) # all-nan classes
+            mean_resp = _np.where(none, -1, _np.nanmean(SA, axis=1))
+            median_resp = _np.where(none, -1, _np.nanmedian(SA, axis=1))
+            std_resp = _np.where(none, -1, _np.nanstd(SA, axis=1))
+        return mean_resp, median_resp, std_resp, num_puffs.astype(float)
+
+    all_pre_stats = class_stats(all_pre_train_resp)
+    all_post_stats = class_stats(all_post_train_resp)
+
     # make one stats plot per EN. Loop through ENs:
     for en_ind in range(sim_results['nE']):
 
-        en_resp = sim_results['E'][:, en_ind]
-
-        ## calculate pre- and post-train odor response stats
-        # assumes that there is at least 1 sec on either side of an odor without octo
-
-        # pre-allocate for loop
-        pre_train_resp = _np.full(len(stim_starts), _np.nan)
-        post_train_resp = _np.full(len(stim_starts), _np.nan)
-
-        for i, t in enumerate(stim_starts):
-            # Note: to find no-octo stim_starts, there is a certain amount of machinery
-            # in order to mesh with the timing data from the experiment.
-            # For some reason octo_times are not recorded exactly as listed in format
-            # short mode. So we need to use abs difference > small thresh, rather
-            # than ~ismember(t, octo_times):
-            small = 1e-8 # .00000001
-            # assign no-octo, PRE-train response val (or -1)
-            pre_train_resp[i] = -1 # as flag
-            if (len(octo_times)==0) or ((abs(octo_times - t).min() > small) and (t < exp_params.startTrain)):
-                resp_ind = _np.logical_and(t-1 < sim_results['T'], sim_results['T'] < t+1)
-                pre_train_resp[i] = en_resp[resp_ind].max()
-
-            # assign no-octo, POST-train response val (or -1)
-            post_train_resp[i] = -1
-            if len(octo_times)!=0:
-                if (abs(octo_times - t).min() > small) and (t > exp_params.endTrain):
-                    resp_ind = _np.logical_and(t-1 < sim_results['T'], sim_results['T'] < t+1)
-                    post_train_resp[i] = en_resp[resp_ind].max()
-
-        # pre-allocate for loop
-        pre_mean_resp, pre_median_resp, pre_std_resp, pre_num_puffs, post_mean_resp, \
-            post_median_resp, post_std_resp, post_num_puffs = \
-            [_np.full(len(class_labels), _np.nan) for _ in range(8)]
-
-        # calc no-octo stats for each odor, pre and post train:
-        for k, cl in enumerate(class_labels):
-            current_class = which_class==cl
-            pre_SA = pre_train_resp[_np.logical_and(pre_train_resp>=0, current_class)]
-            post_SA = post_train_resp[_np.logical_and(post_train_resp>=0, current_class)]
-
-            ## calculate the averaged sniffs of each sample: SA means 'sniffsAveraged'
-            # this will contain the average responses over all sniffs for each sample
-            if len(pre_SA)==0:
-                pre_mean_resp[k] = -1
-                pre_median_resp[k] = -1
-                pre_std_resp[k] = -1
-                pre_num_puffs[k] = 0
-            else:
-                pre_mean_resp[k] = pre_SA.mean()
-                pre_median_resp[k] = _np.median(pre_SA)
-                pre_std_resp[k] = pre_SA.std()
-                pre_num_puffs[k] = len(pre_SA)
-
-            if len(post_SA)==0:
-                post_mean_resp[k] = -1
-                post_median_resp[k] = -1
-                post_std_resp[k] = -1
-                post_num_puffs[k] = 0
-            else:
-                post_mean_resp[k] = post_SA.mean()
-                post_median_resp[k] = _np.median(post_SA)
-                post_std_resp[k] = post_SA.std()
-                post_num_puffs[k] = len(post_SA)
+        pre_train_resp = all_pre_train_resp[:, en_ind]
+        post_train_resp = all_post_train_resp[:, en_ind]
+        pre_mean_resp, pre_median_resp, pre_std_resp, pre_num_puffs = \
+            [x[:, en_ind] for x in all_pre_stats]
+        post_mean_resp, post_median_resp, post_std_resp, post_num_puffs = \
+            [x[:, en_ind] for x in all_post_stats]
 
         # # to plot +/- 1 std of % change in mean_resp, we want the std of our
         # # estimate of the mean = std_resp/sqrt(numPuffs). Make this calc:
@@ -834,13 +1626,13 @@ def collect_stats(self, sim_results, exp_params, class_labels, show_time_plots,
         results[en_ind]['post_mean_resp'] = post_mean_resp
         results[en_ind]['post_std_resp'] = post_std_resp
         # spont responses, pre and post training
-        results[en_ind]['pre_spont_mean'] = pre_spont.mean()
-        results[en_ind]['pre_spont_std'] = pre_spont.std()
-        results[en_ind]['post_spont_mean'] = post_spont.mean()
-        results[en_ind]['post_spont_std'] = post_spont.std()
+        results[en_ind]['pre_spont_mean'] = pre_heb_mean
+        results[en_ind]['pre_spont_std'] = pre_heb_std
+        results[en_ind]['post_spont_mean'] = post_heb_mean
+        results[en_ind]['post_spont_std'] = post_heb_std
 
     ## Plot EN timecourses normalized by mean digit response
-    if show_time_plots:
+    if show_time_plots and sim_results['E'] is not None:
 
         # go through each EN
         for en_ind in range(sim_results['nE']): # recal EN1 targets digit class 1, EN2 targets digit class 2, etc
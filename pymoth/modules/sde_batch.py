@@ -0,0 +1,478 @@
+#!/usr/bin/env python3
+
+"""
+
+.. module:: sde_batch
+   :platform: Unix
+   :synopsis: Run batched (multi-moth) stochastic differential equation simulations.
+
+.. moduleauthor:: Adam P. Jones <ajones173@gmail.com>
+
+"""
+import numpy as _np
+from scipy.special import erfinv
+from .sde import stim_timecourses, stim_schedule, stim_drive, piecewise_lin_pseudo_sig, \
+    noise_blocks
+
+def sde_wrap_batch( model_params_list, exp_params, feature_array, seed=None ):
+    """
+    Runs the SDE time-stepped evolution of neural firing rates for a batch of moths, \
+    in a single vectorized time loop.
+
+    The moths must share an architecture (ie the same numbers of features, PNs, \
+    KCs and ENs), but may differ in their connection matrices (eg different seeds) \
+    and their learning rates (eg different `goal` values). Every moth is run through \
+    the same experiment, ie the same stimuli at the same times.
+
+    Args:
+        model_params_list (list): model_params objects (with connection matrices, \
+        etc), one for each moth.
+        exp_params (class): object with timing info about experiment, eg when stimuli are given.
+        feature_array (numpy array): stimuli (numFeatures x numStimsPerClass x numClasses).
+        seed (int): [optional] seed for the noise (or a numpy SeedSequence). Each \
+        moth gets its own noise stream, spawned from it (see \
+        :func:`sde_evo_mnist_batch`). If None, it is drawn from numpy's global \
+        random state.
+
+    Returns:
+        sim_results_list (list): one sim_results dict (as returned by :func:`sde_wrap`) \
+        for each moth.
+
+    >>> sim_results_list = sde_wrap_batch([model_params_a, model_params_b], exp_params, feature_array)
+
+    """
+
+    ##TEST that the moths share an architecture
+    for attr in ['nF', 'nP', 'nPI', 'nK', 'nE']:
+        sizes = set([getattr(mP, attr) for mP in model_params_list])
+        if len(sizes) > 1:
+            raise ValueError('All moths in a batch must have the same {}, got {}'.format(
+                attr, sorted(sizes)))
+
+    # Define Stimuli and Octopamine time courses:
+    time, class_mag_mat, octo_hits = stim_timecourses(exp_params)
+
+    # initial conditions for Y, one row per moth. [ P, PI, L, R, K, E ]
+    init_cond = _np.stack([ _np.concatenate((_np.ones(mP.nP), _np.ones(mP.nPI),
+        _np.ones(mP.nG), mP.Rspont, _np.ones(mP.nK), _np.zeros(mP.nE)), axis=None)
+        for mP in model_params_list ])
+
+    tspan = ( exp_params.sim_start, exp_params.sim_stop )
+    seed_val = seed # to free up or fix randn
+
+    # run the SDE evolution:
+    this_run = sde_evo_mnist_batch(tspan, init_cond, time, class_mag_mat, feature_array,
+        octo_hits, model_params_list, exp_params, seed_val )
+
+    # split the batch back into one sim_results dict per moth:
+    sim_results_list = []
+    for b, mP in enumerate(model_params_list):
+        sim_results_list.append({
+                        'T' : this_run['T'], # timing information
+                        'E' : this_run['E'][b],
+                        'octo_hits' : octo_hits,
+                        'K2Efinal' : this_run['K2Efinal'][b],
+                        'P2Kfinal' : this_run['P2Kfinal'][b],
+                        'nE' : mP.nE
+                    })
+
+    return sim_results_list
+
+def sde_evo_mnist_batch(tspan, init_cond, time, class_mag_mat, feature_array,
+    octo_hits, mPs, exP, seed_val):
+    """
+
+    Batched version of :func:`sde_evo_mnist`. The state of B moths is stacked \
+    into [B x n] arrays and their connection matrices into [B x n x m] tensors, \
+    so each time step is a handful of batched matrix products rather than B \
+    separate Python-level steps.
+
+    The noise calibration follows the same 'stepped' scheme as :func:`sde_evo_mnist`, \
+    but the mean spontaneous FRs are accumulated as running sums, so no neural \
+    timecourses other than the ENs are kept.
+
+    Each moth draws its noise from its own numpy Generator, seeded by a child of \
+    `SeedSequence(seed_val)` (see `SeedSequence.spawn`), laid out as in \
+    :func:`sde_evo_mnist`. So moth b of a batch sees the same noise as a single \
+    run with `seed_val` set to the b-th child.
+
+    Args:
+        tspan (tuple): start and stop timepoints (seconds)
+        init_cond (numpy array): [B x n] starting FRs for all neurons of each moth, \
+        order-specific
+        time (numpy array): [start:step:stop] vector of timepoints for stepping \
+        through the evolution.
+        class_mag_mat (numpy array): [# of different classes X vector of time points] \
+        each entry is the strength of a digit presentation.
+        feature_array (numpy array): [numFeatures x numStimsPerClass x numClasses]
+        octo_hits (numpy array): [1 x length(t)] octopamine strengths at each timepoint.
+        mPs (list): model_params of each moth, including connection matrices, learning rates, etc.
+        exP (class): experiment parameters with some timing info.
+        seed_val (int): optional arg for random number generation (an int or a \
+        numpy SeedSequence; if None or 0, drawn from numpy's global random state).
+
+    Returns:
+        this_run (dict):
+            - T: [m x 1] timepoints used in evolution
+            - E: [B x m x nE] EN timecourses of each moth
+            - P2Kfinal: [B x nK x nP] connection matrices
+            - K2Efinal: [B x nE x nK] connection matrices
+
+    """
+
+    # one noise Generator per moth, spawned from seed_val:
+    if not isinstance(seed_val, _np.random.SeedSequence):
+        if not seed_val:
+            seed_val = _np.random.randint(0, 2**63 - 1, dtype=_np.int64)
+        seed_val = _np.random.SeedSequence(int(seed_val))
+    rngs_calib = [ _np.random.default_rng(child) for child in seed_val.spawn(len(mPs)) ]
+    # (as in sde_evo_mnist, the rest of the run after the noise calibration
+    # uses separate streams)
+    rngs = [ _np.random.default_rng(r.integers(2**63 - 1)) for r in rngs_calib ]
+
+    spin = '/-\|' # create spinner for progress bar
+
+    def stack(name, shape, default=None):
+        # stack an attribute of every moth into a [B x shape] array
+        return _np.stack([ _np.asarray(getattr(mP, name, default), dtype=float).reshape(shape)
+            for mP in mPs ])
+
+    def scalar(name):
+        # stack a scalar attribute of every moth into a [B x 1] col vector
+        return _np.array([ float(getattr(mP, name)) for mP in mPs ]).reshape(-1, 1)
+
+    def bdot(M, x):
+        # batched matrix-vector product: [B x n x m] . [B x m] -> [B x n]
+        return _np.matmul(M, x[:, :, _np.newaxis])[:, :, 0]
+
+    # numbers of objects
+    (nC,_) = class_mag_mat.shape
+    B = len(mPs)
+    nP = mPs[0].nG
+    nL = mPs[0].nG
+    nR = mPs[0].nG
+    nPI = mPs[0].nPI
+    nK = mPs[0].nK
+    nE = mPs[0].nE
+
+    ## noise in individual neuron FRs, one row per moth
+    wPsig = stack('noisePvec', -1)
+    wPIsig = stack('noisePIvec', -1) # no PIs for mnist
+    wLsig = stack('noiseLvec', -1)
+    wRsig = stack('noiseRvec', -1)
+    wKsig = stack('noiseKvec', -1)
+
+    # connection matrices and per-neuron vectors
+    Rspont = stack('Rspont', -1)
+    RspontRatios = Rspont/Rspont.mean(axis=1, keepdims=True) # used to scale stim inputs
+    F2R = stack('F2R', (nR, -1))
+    R2P = stack('R2P', -1)
+    R2L = stack('R2L', -1)
+    R2PI = stack('R2PI', (nPI, nR))
+    L2P = stack('L2P', (nP, nL))
+    L2L = stack('L2L', (nL, nL))
+    L2R = stack('L2R', (nR, nL))
+    L2PI = stack('L2PI', (nPI, nL))
+    octo2P = stack('octo2P', -1)
+    octo2PI = stack('octo2PI', -1)
+    octo2L = stack('octo2L', -1)
+    octo2R = stack('octo2R', -1)
+    octo2K = stack('octo2K', -1)
+    kGlobalDampVec = stack('kGlobalDampVec', -1)
+
+    P2Kinit = stack('P2K', (nK, nP))
+    P2K = P2Kinit.copy() # '-heb' weights, these will vary with time
+    PI2K = stack('PI2K', (nK, nPI), default=_np.zeros((nK, nPI))) # no PIs for mnist
+    K2E = stack('K2E', (nE, nK))
+    P2Kmask = P2K > 0
+    PI2Kmask = PI2K > 0 # no PIs for mnist
+    K2Emask = K2E > 0
+
+    # scalar params, as [B x 1] col vectors
+    tau_P, tau_PI, tau_L, tau_R, tau_K, tau_E = [ scalar(n) for n in
+        ['tau_P', 'tau_PI', 'tau_L', 'tau_R', 'tau_K', 'tau_E'] ]
+    cP, cPI, cL, cR, cK = [ scalar(n) for n in ['cP', 'cPI', 'cL', 'cR', 'cK'] ]
+    slope_param = scalar('slope_param')
+    octoNegDiscount = scalar('octoNegDiscount')
+
+    ## param for sigmoid that squashes inputs to neurons:
+    # the slope at x = 0 = mP.slope_param*span/4
+    pSlope = slope_param*cP/4
+    piSlope = slope_param*cPI/4 # no PIs for mnist
+    lSlope = slope_param*cL/4
+    rSlope = slope_param*cR/4
+    kSlope = slope_param*cK/4
+
+    # the # st devs to give the correct sparsity
+    numNoOctoStds = _np.sqrt(2)*erfinv(1 - 2*scalar('sparsityTarget'))
+    numOctoStds = _np.sqrt(2)*erfinv(1 - 2*scalar('octoSparsityTarget'))
+
+    # Hebbian learning rates, shaped to broadcast against the [B x n x m] weights
+    heb_tau_PK = scalar('heb_tau_PK')[:, :, _np.newaxis]
+    heb_tau_PIK = scalar('heb_tau_PIK')[:, :, _np.newaxis]
+    heb_tau_KE = scalar('heb_tau_KE')[:, :, _np.newaxis]
+    hebMaxPK = scalar('hebMaxPK')[:, :, _np.newaxis]
+    hebMaxPIK = scalar('hebMaxPIK')[:, :, _np.newaxis]
+    hebMaxKE = scalar('hebMaxKE')[:, :, _np.newaxis]
+    die_back_tau_PK = scalar('die_back_tau_PK')[:, :, _np.newaxis]
+    die_back_tau_PIK = scalar('die_back_tau_PIK')[:, :, _np.newaxis]
+    die_back_tau_KE = scalar('die_back_tau_KE')[:, :, _np.newaxis]
+
+#-------------------------------------------------------------------------------
+
+    dt = round(time[1] - time[0], 2) # this is determined by start, stop and step in calling function
+    # the time vector: the timepoints of the stimulus and octopamine time courses
+    T = _np.asarray(time)
+    N = len(T) # number of steps in noise evolution
+
+    def wiener(w_sig, mean_spont_, old_, tau_, inputs_, z_):
+        # Euler-Maruyama step with Wiener noise, for all moths at once
+        d_ = dt*(-old_*tau_ + inputs_)
+        dW_ = _np.sqrt(dt)*w_sig*mean_spont_*z_
+        return old_ + d_ + dW_
+
+    def decay_rate(tau_):
+        # die-back rate per step, 0 for moths with no die-back
+        return _np.divide(dt, tau_, out=_np.zeros_like(tau_), where=tau_ > 0)
+
+#-------------------------------------------------------------------------------
+
+    # initialize the FR matrices with initial conditions
+    bounds = _np.cumsum([0, nP, nPI, nL, nR, nK, nE])
+    P, PI, L, R, K, E = [ init_cond[:, bounds[j]:bounds[j+1]].copy() for j in range(6) ]
+    nAL = bounds[5] # number of P, PI, L, R and K neurons
+
+    # noise, in blocks: each time step takes a [B x nAL] row, split as the FRs
+    noise = noise_blocks(rngs_calib, nAL)
+    # the noise calibration is done at the first timepoint after stopSpontMean3
+    after_calib = T > exP.stopSpontMean3
+    i_calib = int(_np.argmax(after_calib)) if after_calib.any() else N
+
+    # only the EN timecourses are kept
+    E_hist = _np.zeros((B, N, nE))
+    E_hist[:, 0, :] = E
+
+    # the stimulus events, with the images' inputs to the RNs of each moth
+    schedule = stim_schedule(class_mag_mat, feature_array, F2R)
+
+    # make a list of Ts for which heb is active
+    hebRegion = _np.zeros(T.shape)
+    for i in range(len(exP.hebStarts)):
+        inds = _np.bitwise_and(T >= exP.hebStarts[i], T <= (exP.hebStarts[i] + exP.hebDurations[i]))
+        hebRegion[inds] = 1
+
+#-------------------------------------------------------------------------------
+
+    # windows used to calibrate the noise to the mean spontaneous FRs. The
+    # mean spont FRs are accumulated as running sums while the windows are open.
+    calib_windows = [ (exP.startPreNoiseSpontMean1, exP.stopPreNoiseSpontMean1),
+                      (exP.startSpontMean2, exP.stopSpontMean2),
+                      (exP.startSpontMean3, exP.stopSpontMean3) ]
+    calib_sums = _np.zeros((len(calib_windows), B, nAL))
+    calib_counts = _np.zeros(len(calib_windows))
+    calib_done = [False]*len(calib_windows)
+
+    def accumulate(t):
+        # add the current FRs to any calibration window that is open at time t
+        for w, (start, stop) in enumerate(calib_windows):
+            if start < t < stop:
+                calib_sums[w] += _np.concatenate((P, PI, L, R, K), axis=1)
+                calib_counts[w] += 1
+
+    accumulate(T[0])
+
+    mean_spont_P = _np.zeros((B, nP))
+    mean_spont_PI = _np.zeros((B, nPI)) # no PIs for mnist
+    mean_spont_L = _np.zeros((B, nL))
+    mean_spont_R = _np.zeros((B, nR))
+    mean_spont_K = _np.zeros((B, nK))
+
+    # placeholder until we have an estimate based on spontaneous PN firing rates
+    maxSpontP2KtimesPval = 10*_np.ones(B)
+
+    ## Main evolution loop:
+    # iterate through time steps to get the full evolution:
+    for i in range(N-1): # i = index of the time point
+        prog = int(15*(i/N))
+        remain = 15-prog-1
+        mult = 50 # multiplier (spinner speed control)
+        print(f"{spin[int((i%(len(spin)*mult))/mult)]} SDE evolution (batch of {B}):[{prog*'*'}{remain*' '}]", end='\r')
+
+        oldP, oldPI, oldL, oldR, oldK, oldE = P, PI, L, R, K, E
+        oldT = T[i]
+
+#-------------------------------------------------------------------------------
+
+        # calibrate the noise (windows 1 and 2), and the minimum KC damping
+        # (window 3), once the corresponding window has closed:
+        for w, (_, stop) in enumerate(calib_windows):
+            if oldT > stop and not calib_done[w]:
+                mean_spont = calib_sums[w]/calib_counts[w]
+                if w < 2:
+                    mean_spont_P, mean_spont_PI, mean_spont_L, mean_spont_R, mean_spont_K = \
+                        [ mean_spont[:, bounds[j]:bounds[j+1]] for j in range(5) ]
+                else:
+                    ssMeanSpontP = mean_spont[:, :nP] # 'ss' means steady state
+                    # set a minimum damping on KCs based on spontaneous PN activity,
+                    # sufficient to silence the MB silent absent odor.
+                    # ignore the top K input as an outlier, ie take the 2nd highest:
+                    temp = _np.sort(bdot(P2Kinit, ssMeanSpontP), axis=1)
+                    maxSpontP2KtimesPval = temp[:, -2] # The minimum global damping on the MB
+                calib_done[w] = True # so we don't calc this again
+
+        if i == i_calib:
+            noise = noise_blocks(rngs, nAL) # switch to the post-calibration streams
+
+        # get the stimulus inputs to the RNs at time index i, and the classes
+        # being presented (the stimuli are shared by all moths)
+        stimDrive, thisStimClassInd = stim_drive(schedule, class_mag_mat, i)
+
+        # get value at t for octopamine:
+        thisOctoHit = octo_hits[i]
+
+        z = next(noise) # standard normal draws for this step, [B x nAL]
+
+#-------------------------------------------------------------------------------
+
+        # dP:
+        Pinputs = _np.maximum(1 - thisOctoHit*octo2P*octoNegDiscount, 0) # pos. rectify
+        Pinputs *= -bdot(L2P, oldL)
+        Pinputs += (R2P*oldR)*(1 + thisOctoHit*octo2P)
+        Pinputs = piecewise_lin_pseudo_sig(Pinputs, cP, pSlope)
+        newP = wiener(wPsig, mean_spont_P, oldP, tau_P, Pinputs,
+            z[:, bounds[0]:bounds[1]])
+
+        # dPI: # no PIs for mnist
+        PIinputs = _np.maximum(1 - thisOctoHit*octo2PI*octoNegDiscount, 0)
+        PIinputs *= -bdot(L2PI, oldL)
+        PIinputs += bdot(R2PI, oldR)*(1 + thisOctoHit*octo2PI)
+        PIinputs = piecewise_lin_pseudo_sig(PIinputs, cPI, piSlope)
+        newPI = wiener(wPIsig, mean_spont_PI, oldPI, tau_PI, PIinputs,
+            z[:, bounds[1]:bounds[2]])
+
+        # dL:
+        Linputs = _np.maximum(1 - thisOctoHit*octo2L*octoNegDiscount, 0)
+        Linputs *= -bdot(L2L, oldL)
+        Linputs += (R2L*oldR)*(1 + thisOctoHit*octo2L)
+        Linputs = piecewise_lin_pseudo_sig(Linputs, cL, lSlope)
+        newL = wiener(wLsig, mean_spont_L, oldL, tau_L, Linputs,
+            z[:, bounds[2]:bounds[3]])
+
+        # dR:
+        Rinputs = _np.maximum(1 - thisOctoHit*octo2R*octoNegDiscount, 0)
+        Rinputs *= -bdot(L2R, oldL)
+        neur_act = stimDrive*RspontRatios
+        neur_act *= (1 + thisOctoHit*octo2R)
+        Rinputs += neur_act + Rspont
+        Rinputs = piecewise_lin_pseudo_sig(Rinputs, cR, rSlope)
+        newR = wiener(wRsig, mean_spont_R, oldR, tau_R, Rinputs,
+            z[:, bounds[3]:bounds[4]])
+
+#-------------------------------------------------------------------------------
+
+        # Enforce sparsity on the KCs, with a separate global damping for each moth:
+        numStds = (1-thisOctoHit)*numNoOctoStds + thisOctoHit*numOctoStds
+        minDamperVal = 1.2*maxSpontP2KtimesPval
+        P2KtimesP = bdot(P2K, oldP)
+        PI2KtimesPI = bdot(PI2K, oldPI)
+        thisKinput = P2KtimesP - PI2KtimesPI # (no PIs for mnist, only Ps)
+
+        damper = thisKinput.mean(axis=1) + numStds[:, 0]*thisKinput.std(axis=1)
+        damper = _np.maximum(damper, minDamperVal)
+
+        dampening = damper[:, _np.newaxis]*kGlobalDampVec + PI2KtimesPI
+        pos_octo = _np.maximum(1 - octo2K*thisOctoHit, 0)
+
+        Kinputs = P2KtimesP*(1 + thisOctoHit*octo2K) # but note that mP.octo2K == 0
+        Kinputs -= dampening*pos_octo # but no PIs for mnist
+        Kinputs = piecewise_lin_pseudo_sig(Kinputs, cK, kSlope)
+        newK = wiener(wKsig, mean_spont_K, oldK, tau_K, Kinputs,
+            z[:, bounds[4]:bounds[5]])
+
+        # Readout neurons E: no sigmoid, no noise
+        Einputs = bdot(K2E, oldK)
+        newE = oldE + dt*( -oldE*tau_E + Einputs ) # always non-neg
+
+#-------------------------------------------------------------------------------
+
+    ## HEBBIAN UPDATES:
+
+        # As in sde_evo_mnist, but for all moths at once. The weights are only
+        # read before this point in each step, so they are updated in place.
+        if hebRegion[i]:
+            nonNegNewK = _np.maximum(newK, 0) # since newK has not yet been made non-neg
+
+            ## dP2K:
+            dp2k = (1/heb_tau_PK) * (nonNegNewK[:, :, _np.newaxis]*oldP[:, _np.newaxis, :])
+            dp2k *= P2Kmask #  if original synapse does not exist, it will never grow
+            # decay some P2K connections if wished: (not used for mnist experiments)
+            P2K -= P2K*decay_rate(die_back_tau_PK)
+            P2K += dp2k
+            _np.maximum(P2K, 0, out=P2K)
+            _np.minimum(P2K, hebMaxPK, out=P2K)
+
+            ## dPI2K: # no PIs for mnist
+            dpi2k = (1/heb_tau_PIK) * (nonNegNewK[:, :, _np.newaxis]*oldPI[:, _np.newaxis, :])
+            dpi2k *= PI2Kmask
+            # kill small increases:
+            temp = PI2K.copy() # this detour prevents dividing by zero
+            temp[temp == 0] = 1
+            dpi2k *= dpi2k/temp
+            PI2K -= PI2K*decay_rate(die_back_tau_PIK)
+            PI2K += dpi2k
+            _np.maximum(PI2K, 0, out=PI2K)
+            _np.minimum(PI2K, hebMaxPIK, out=PI2K)
+
+            ## dK2E:
+            dk2e = (1/heb_tau_KE) * (newE[:, :, _np.newaxis]*oldK[:, _np.newaxis, :])
+            dk2e *= K2Emask
+            # restrict changes to just the rows of K2E of the training stim
+            restrictK2Emask = _np.zeros((nE, 1))
+            restrictK2Emask[thisStimClassInd] = 1
+            dk2e *= restrictK2Emask
+
+            # inactive connections for this EN die back:
+            targetMask = (dk2e == 0)*restrictK2Emask
+            K2E -= targetMask*(K2E + 2)*decay_rate(die_back_tau_KE)
+            K2E += dk2e
+            _np.maximum(K2E, 0, out=K2E)
+            _np.minimum(K2E, hebMaxKE, out=K2E)
+
+#-------------------------------------------------------------------------------
+
+        # update the states, disallowing negative FRs.
+        P = _np.maximum(newP, 0)
+        PI = _np.maximum(newPI, 0) # no PIs for mnist
+        L = _np.maximum(newL, 0)
+        R = _np.maximum(newR, 0)
+        K = _np.maximum(newK, 0)
+        E = newE
+
+        E_hist[:, i+1, :] = newE # always save full EN timecourses
+        accumulate(T[i+1])
+
+    print('\r')
+    # Time-step simulation is now over.
+
+    this_run = dict() # pre-allocate
+    this_run['T'] = T.T # store T as a col
+    this_run['E'] = E_hist # B x length(T) x mP.nE
+    this_run['P2Kfinal'] = P2K
+    this_run['K2Efinal'] = K2E
+
+    return this_run
+
+# MIT license:
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+# associated documentation files (the "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+# The above copyright notice and this permission notice shall be included in all copies or substantial
+# portions of the Software.
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN
+# AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
@@ -1,5 +1,6 @@
 from ..MNIST_all import test_MNIST
-from . import test_classify, test_generate, test_params
+from . import test_classify, test_generate, test_kernels, test_params, \
+    test_predict, test_record, test_sde, test_sde_batch
 
 def main():
 
@@ -9,7 +10,17 @@ def main():
 
     test_generate.main()
 
+    test_kernels.main()
+
     test_params.main()
 
+    test_predict.main()
+
+    test_record.main()
+
+    test_sde.main()
+
+    test_sde_batch.main()
+
 if __name__ == '__main__':
     main()
@@ -1,17 +1,20 @@
 #!/usr/bin/env python3
 import os
+import shutil
 import numpy as np
 
 # import packages and modules
 from .generate import generate_ds_mnist, extract_mnist_feature_array, \
-    crop_downsample_vectorize_images, average_image_stack, select_active_pixels
+    crop_downsample_vectorize_images, average_image_stack, select_active_pixels, \
+    preprocessing_stats, iter_feature_chunks, write_feature_array, select_active_pixel_sets
+from ..MNIST_all.MNIST_store import open_store
 
 def main():
 
     print('Testing generate module:')
 
     # generate dummy data
-    mnist_fname = '/tmp/MNIST_all.npy'
+    mnist_dir = '/tmp/MNIST_all'
 
     class_labels = np.array([0, 1, 2, 3, 4, 5, 6, 7, 8, 9])
     max_ind = 999
@@ -21,7 +24,7 @@ def main():
     screen_size = (1920, 1080)
 
     ## test generate_ds_mnist
-    generate_ds_mnist(
+    dataset = generate_ds_mnist(
                       max_ind,
                       class_labels,
                       crop,
@@ -36,11 +39,20 @@ def main():
                      )
     print('\tgenerate_ds_mnist function test passed')
 
-    # load mnist
-    mnist = np.load(mnist_fname, allow_pickle = True).item()
+    # the second call loads the cached output
+    cached = generate_ds_mnist( max_ind, class_labels, crop, downsample_ratio,
+        downsample_method, [i for i in range(550,1000)], 6, [i for i in range(550,1000)],
+        85, screen_size, '', 0 )
+    assert np.array_equal( cached[0], dataset[0] )
+    assert np.array_equal( cached[1], dataset[1] ) and cached[2] == dataset[2]
+    shutil.rmtree('/tmp/MNIST_all_cache')
+    print('\tgenerate_ds_mnist cache test passed')
+
+    # load mnist (reads the arrays into memory, as the data files are removed next)
+    mnist = { k : np.array(v) for k, v in open_store(mnist_dir).items() }
 
     # remove temporary data files
-    os.remove(mnist_fname)
+    shutil.rmtree(mnist_dir)
 
     ## test extract_mnist_feature_array
     # extract_mnist_feature_array( mnist, labels, image_indices, phase_label )
@@ -50,6 +62,9 @@ def main():
                     range(max_ind+1),
                     'train'
                     )
+    # each class gets its first images, in their original order, on [0 1]
+    first_images = mnist['train_images'][mnist['train_labels']==3][:max_ind+1]
+    assert np.array_equal( dummy_image_array[...,3], first_images/256 )
     print('\textract_mnist_feature_array function test passed')
 
     # test crop_downsample_vectorize_images
@@ -60,8 +75,33 @@ def main():
                     downsample_ratio,
                     downsample_method
                     )
+    # both methods give [#pixels x #images], each image normalized by its max
+    for method in (0, 1):
+        im_col_array = crop_downsample_vectorize_images( dummy_image_array[...,0],
+            crop, downsample_ratio, method )
+        assert im_col_array.shape == (144, max_ind+1)
+        assert np.allclose( im_col_array.max(axis=0), 1 )
+    # method 0 sums the square patches aligned with the (cropped) image
+    fixed_image = np.zeros((6, 6))
+    fixed_image[1:5, 1:5] = [[1, 2, 0, 0], [3, 4, 0, 0], [0, 0, 0, 0], [6, 0, 0, 0]]
+    assert np.allclose( crop_downsample_vectorize_images(fixed_image[np.newaxis], 1, 2, 0)[:,0],
+        np.array([10, 0, 6, 0])/10 )
     print('\tcrop_downsample_vectorize_images function test passed')
 
+    # test preprocessing_stats, iter_feature_chunks and write_feature_array
+    overall_ave, active_pixel_inds = preprocessing_stats( mnist, class_labels, crop,
+        downsample_ratio, downsample_method, range(100), 6, range(100), 85, screen_size )
+    test_images = mnist['test_images'][:250]
+    chunks = list(iter_feature_chunks( test_images, crop, downsample_ratio,
+        downsample_method, overall_ave, 6, active_pixel_inds, chunk_size=100 ))
+    assert [ chunk.shape for chunk in chunks ] == [ (len(active_pixel_inds), n) for n in (100, 100, 50) ]
+    test_X = write_feature_array( '/tmp/test_X.npy', test_images, crop, downsample_ratio,
+        downsample_method, overall_ave, 6, active_pixel_inds, chunk_size=100 )
+    assert np.array_equal( test_X, np.hstack(chunks) )
+    del test_X
+    os.remove('/tmp/test_X.npy')
+    print('\tchunked preprocessing test passed')
+
 
     im_z, im_height, im_width, label_len = dummy_image_array.shape
     dummy_feature_array = np.ones((144, im_z, label_len))
@@ -77,5 +117,14 @@ def main():
     select_active_pixels(dummy_feature_array, 85, screen_size)
     print('\tselect_active_pixels function test passed')
 
+    # test select_active_pixel_sets( feature_array, num_features_list )
+    random_feature_array = np.random.rand(144, 20, 10)
+    active_pixel_sets = select_active_pixel_sets(random_feature_array, [10, 85])
+    for num_features, active_pixel_inds in zip([10, 85], active_pixel_sets):
+        assert np.array_equal( active_pixel_inds,
+            select_active_pixels(random_feature_array, num_features, screen_size) )
+        assert len(active_pixel_inds) >= num_features
+    print('\tselect_active_pixel_sets function test passed')
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+# import packages and modules
+import numpy as np
+from . import kernels
+from .kernels import pack_params, fused_step
+from .params import ModelParams, ExpParams
+from .sde import sde_wrap
+
+def main():
+
+    print('Testing kernels module:')
+
+    # create dummy moth
+    model_params = ModelParams( 20, 10 )
+    model_params.create_connection_matrix()
+    nP, nPI, nK, nE = model_params.nP, model_params.nPI, model_params.nK, model_params.nE
+    sigs = (model_params.noisePvec, model_params.noisePIvec, model_params.noiseLvec,
+        model_params.noiseRvec, model_params.noiseKvec)
+
+    # test pack_params
+    params = pack_params( model_params, 0.02, sigs )
+    print('\tpack_params function test passed')
+
+    # test fused_step
+    new = fused_step( np.ones(nP), np.ones(nPI), np.ones(nP), np.ones(nP), np.ones(nK),
+        np.zeros(nE), np.random.rand(nP), 0.0, 1.6, 10.0, model_params.P2K,
+        model_params.PI2K, model_params.K2E, np.ones(nP), np.ones(nPI), np.ones(nP),
+        np.ones(nP), np.ones(nK), np.random.normal(0, 1, 3*nP + nPI + nK), *params )
+    assert [len(x) for x in new] == [nP, nPI, nP, nP, nK, nE]
+    assert all(np.isfinite(x).all() for x in new)
+    print('\tfused_step function test passed')
+
+    # test that the fused kernel matches the numpy step, for a fixed seed.
+    # Without numba the kernel is forced on anyway, running as (slow) plain
+    # python, and fast_quiescent cuts the number of single steps it takes
+    dummy_exp_params = ExpParams( np.array(range(10)), np.array(range(10)), 1 )
+    dummy_feature_array = np.random.rand( 20, 3, 10 )
+    numpy_results = sde_wrap( model_params, dummy_exp_params, dummy_feature_array,
+        fast_quiescent=True, seed=5 )
+    numba_available = kernels.NUMBA_AVAILABLE
+    kernels.NUMBA_AVAILABLE = True
+    try:
+        kernel_results = sde_wrap( model_params, dummy_exp_params, dummy_feature_array,
+            fast_quiescent=True, kernel='numba', seed=5 )
+    finally:
+        kernels.NUMBA_AVAILABLE = numba_available
+    assert np.allclose( kernel_results['E'], numpy_results['E'] )
+    assert np.allclose( kernel_results['K2Efinal'], numpy_results['K2Efinal'] )
+    print('\tfused kernel vs numpy step test passed')
+
+if __name__ == '__main__':
+    main()
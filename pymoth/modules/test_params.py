@@ -16,6 +16,13 @@ def main():
     model_params.create_connection_matrix()
     print('\tcreate_connection_matrix method test passed')
 
+    # test ModelParams.set_goal( goal )
+    P2K = model_params.P2K.copy()
+    model_params.set_goal( 5 )
+    assert model_params.heb_tau_KE == ModelParams( 10, 5 ).heb_tau_KE
+    assert np.array_equal( model_params.P2K, P2K )
+    print('\tset_goal method test passed')
+
     # test ExpParams(train_classes, class_labels, val_per_class )
     experiment_params =  ExpParams( np.array(range(10)), np.array(range(10)), 1 )
     print('\tExpParams class test passed')
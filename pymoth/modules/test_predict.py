@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+# import packages and modules
+import numpy as np
+from .sde import sde_wrap, collect_stats
+from .predict import en_peak_responses, en_resp, classify_log_likelihood
+from .params import ModelParams, ExpParams
+
+def main():
+
+    print('Testing predict module:')
+
+    # train a dummy moth
+    model_params = ModelParams( 20, 15 )
+    model_params.create_connection_matrix()
+    # 2 baseline, 1 training and 2 post-training digits per class:
+    dummy_exp_params =  ExpParams( np.array(range(10)), np.array(range(10)), 2 )
+    dummy_feature_array = np.random.rand( 20, 5, 10 )
+    sim_results = sde_wrap( model_params, dummy_exp_params, dummy_feature_array, seed=1 )
+
+    # test en_peak_responses
+    test_X = np.random.rand( 30, 20 )
+    peaks = en_peak_responses( model_params, dummy_exp_params, sim_results, test_X, seed=2 )
+    assert peaks.shape == (30, model_params.nE)
+    assert np.all( peaks >= 0 )
+    # the same seed gives the same responses:
+    assert np.array_equal( peaks, en_peak_responses( model_params, dummy_exp_params,
+        sim_results, test_X, seed=2 ) )
+    # the noiseless responses are deterministic, and close to the noisy ones:
+    det_peaks = en_peak_responses( model_params, dummy_exp_params, sim_results, test_X,
+        noise=False )
+    assert np.allclose( det_peaks, en_peak_responses( model_params, dummy_exp_params,
+        sim_results, test_X, noise=False, batch_size=7 ) )
+    assert np.corrcoef( det_peaks.ravel(), peaks.ravel() )[0,1] > 0.9
+    print('\ten_peak_responses method test passed')
+
+    # the frozen moth gives the post-training responses of the simulation:
+    class_labels = np.arange(10)
+    EN_resp_trained = collect_stats( None, sim_results, dummy_exp_params, class_labels, 0, 0 )
+    post_peaks = en_peak_responses( model_params, dummy_exp_params, sim_results,
+        dummy_feature_array[:, 3:5, :].transpose(2, 1, 0).reshape(20, 20), noise=False )
+    post_means = post_peaks.reshape(10, 2, -1).mean(axis=1).T
+    sim_means = np.array([ resp['post_mean_resp'] for resp in EN_resp_trained ])
+    assert np.corrcoef( post_means.ravel(), sim_means.ravel() )[0,1] > 0.9
+    print('\ten_peak_responses post-training test passed')
+
+    # test classify_log_likelihood against the post-training stats of the
+    # simulation (no labels of the digits being classified are used)
+    pred_classes, likelihoods = classify_log_likelihood( peaks, EN_resp_trained )
+    assert pred_classes.shape == (30,)
+    assert likelihoods.shape == (30, 10)
+    assert np.all( np.isfinite(likelihoods) )
+    assert np.array_equal( pred_classes, np.argmin(likelihoods, axis=1) )
+
+    # test en_resp and classify_log_likelihood, with a separate calibration set
+    calib_X = np.random.rand( 30, 20 )
+    calib_y = np.repeat( np.arange(10), 3 )
+    calib_peaks = en_peak_responses( model_params, dummy_exp_params, sim_results, calib_X,
+        seed=3 )
+    EN_resp = en_resp( calib_peaks, calib_y, class_labels )
+    assert len(EN_resp) == model_params.nE
+    assert EN_resp[0]['post_mean_resp'].shape == (10,)
+    pred_classes, likelihoods = classify_log_likelihood( peaks, EN_resp )
+    assert pred_classes.shape == (30,)
+    assert likelihoods.shape == (30, 10)
+
+    # classes with a single calibration digit (std 0) or none (std -1) are
+    # never predicted:
+    calib_y = np.array( [0] + [1]*2 + list(np.repeat( np.arange(2, 9), 3 )) )
+    EN_resp = en_resp( calib_peaks[:len(calib_y)], calib_y, class_labels )
+    assert np.all( EN_resp[0]['post_std_resp'][[0, 9]] == [0, -1] )
+    pred_classes, likelihoods = classify_log_likelihood( peaks, EN_resp )
+    assert np.all( np.isinf(likelihoods[:, [0, 9]]) )
+    assert np.all( np.isfinite(likelihoods[:, 1:9]) )
+    assert np.all( (pred_classes >= 1) & (pred_classes <= 8) )
+    # with no usable class, classify_log_likelihood raises:
+    try:
+        classify_log_likelihood( peaks, en_resp( calib_peaks[:1], [0], class_labels ) )
+        assert False
+    except ValueError:
+        pass
+    print('\tclassify_log_likelihood method test passed')
+
+if __name__ == '__main__':
+    main()
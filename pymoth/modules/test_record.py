@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+# import packages and modules
+import tempfile
+import numpy as np
+from .record import MemoryRecorder, NpyRecorder, CallbackRecorder, StatsRecorder
+from .params import ExpParams
+
+def main():
+
+    print('Testing record module:')
+
+    # dummy timecourses: 100 timepoints of 3 PNs and 2 ENs
+    T = np.arange(100)*0.02
+    sizes = {'P': 3, 'PI': 0, 'L': 3, 'R': 3, 'K': 4, 'E': 2}
+    P = np.random.rand(100, 3)
+    E = np.random.rand(100, 2)
+
+    def run(rec):
+        rec.open(T, sizes)
+        rec.write(0, {'P': P[0], 'E': E[0]})
+        rec.write(1, {'E': E[1:10]}, 9) # a block of timepoints
+        for i in range(10, 100):
+            rec.write(i, {'P': P[i], 'E': E[i]})
+        return rec.close()
+
+    # test MemoryRecorder
+    recording = run(MemoryRecorder(populations=('E',), decimate=3))
+    assert np.array_equal(recording['E'], E[::3])
+    assert np.array_equal(recording['T'], T[::3])
+    print('\tMemoryRecorder class test passed')
+
+    # test NpyRecorder
+    recording = run(NpyRecorder(tempfile.mkdtemp(), populations=('E',), chunk_size=7))
+    assert np.array_equal(recording['E'], E)
+    print('\tNpyRecorder class test passed')
+
+    # test CallbackRecorder
+    chunks = []
+    run(CallbackRecorder(lambda t, chunk: chunks.append(chunk['E'].copy()),
+        decimate=2, chunk_size=10))
+    assert np.array_equal(np.concatenate(chunks), E[::2])
+    print('\tCallbackRecorder class test passed')
+
+    # test resuming a recording from its state
+    def run_resumed(make_rec):
+        rec = make_rec()
+        rec.open(T, sizes)
+        for i in range(50):
+            rec.write(i, {'E': E[i]})
+        state = rec.state()
+        rec = make_rec() # eg after an interruption
+        rec.open(T, sizes, state=state)
+        for i in range(50, 100):
+            rec.write(i, {'E': E[i]})
+        return rec.close()
+    folder = tempfile.mkdtemp()
+    recording = run_resumed(lambda: NpyRecorder(folder, chunk_size=7))
+    assert np.array_equal(recording['E'], E)
+    recording = run_resumed(lambda: MemoryRecorder(decimate=3))
+    assert np.array_equal(recording['E'], E[::3])
+    print('\tRecorder resume test passed')
+
+    # test StatsRecorder
+    exp_params = ExpParams( np.array(range(10)), np.array(range(10)), 1 )
+    T = np.arange(exp_params.sim_start, exp_params.sim_stop, 0.02)
+    E = np.random.rand(len(T), 2)
+    rec = StatsRecorder(exp_params, chunk_size=333)
+    rec.open(T, sizes)
+    for i in range(len(T)):
+        rec.write(i, {'E': E[i]})
+    stats = rec.close()
+    t = stats['stim_starts'][-1]
+    assert np.allclose(stats['stim_peaks'][-1], E[(t-1 < T) & (T < t+1)].max(axis=0))
+    pre_spont = E[(exp_params.preHebSpontStart < T) & (T < exp_params.preHebSpontStop)]
+    assert np.isclose(stats['pre_spont_mean'], pre_spont.mean())
+    assert np.isclose(stats['pre_spont_std'], pre_spont.std())
+    # windows with no timepoints give nan (as in collect_stats)
+    rec = StatsRecorder(exp_params, chunk_size=333)
+    T_short = T[T < t - 2]
+    rec.open(T_short, sizes)
+    for i in range(len(T_short)):
+        rec.write(i, {'E': E[i]})
+    stats = rec.close()
+    assert np.all(np.isnan(stats['stim_peaks'][-1]))
+    assert np.allclose(stats['stim_peaks'][0],
+        E[(stats['stim_starts'][0]-1 < T) & (T < stats['stim_starts'][0]+1)].max(axis=0))
+    print('\tStatsRecorder class test passed')
+
+if __name__ == '__main__':
+    main()
@@ -2,23 +2,82 @@
 
 # import packages and modules
 import numpy as np
-from .sde import sde_wrap
+from .sde import sde_wrap, heb_update_PK, collect_stats, stim_timecourses
 from .params import ModelParams, ExpParams
+from .record import MemoryRecorder
 
 def main():
 
-    print('Testing params module:')
+    print('Testing sde module:')
 
     # create dummy data
-    dummy_model_params = ModelParams( 10, 10 )
+    dummy_model_params = ModelParams( 20, 10 )
     dummy_model_params.create_connection_matrix()
     dummy_exp_params =  ExpParams( np.array(range(10)), np.array(range(10)), 1 )
-    import pdb; pdb.set_trace()
+    dummy_feature_array = np.random.rand( 20, 3, 10 )
 
     # test sde_wrap
-    sde_wrap( dummy_model_params, dummy_exp_params, dummy_feature_array )
+    sim_results = sde_wrap( dummy_model_params, dummy_exp_params, dummy_feature_array, seed=1 )
     print('\tsde_wrap method test passed')
 
-    # test sde_evo_mnist
-    # sde_evo_mnist(tspan, init_cond, time, class_mag_mat, feature_array,
-    #     octo_hits, mP, exP, seed_val)
+    # test stim_timecourses: the stimuli and octopamine start (and stop) at their
+    # times on the time vector that the evolution steps on, so each stimulus
+    # is inside its full +/- 1 sec window of collect_stats
+    time, class_mag_mat, octo_hits = stim_timecourses( dummy_exp_params )
+    T = sim_results['T']
+    assert np.allclose( T, time )
+    dt = T[1] - T[0]
+    tol = dummy_exp_params.lpParam + dt # the low pass spreads the edges
+    def edges( on ):
+        steps = np.diff( np.concatenate(([0], on.astype(int), [0])) )
+        return T[steps[:-1] == 1], T[np.nonzero(steps[1:] == -1)[0]]
+    puffs = dummy_exp_params.classMags > 0
+    stim_starts = dummy_exp_params.stimStarts[puffs]
+    stim_stops = stim_starts + dummy_exp_params.durations[puffs]
+    onsets, offsets = edges( class_mag_mat.max(axis=0) > 0 )
+    order = np.argsort(stim_starts)
+    assert np.allclose( onsets, stim_starts[order], atol=tol )
+    assert np.allclose( offsets, stim_stops[order], atol=tol )
+    for start, onset, offset in zip(stim_starts[order], onsets, offsets):
+        in_window = (start - 1 < T) & (T < start + 1)
+        assert in_window.sum() >= round(2/dt) - 1
+        assert start - 1 < onset and offset < start + 1
+    octo_starts = np.array(dummy_exp_params.octoStart)
+    octo_onsets, octo_offsets = edges( octo_hits > 0 )
+    assert np.allclose( octo_onsets, octo_starts, atol=tol )
+    assert np.allclose( octo_offsets, octo_starts + dummy_exp_params.durationOcto, atol=tol )
+    print('\tstim_timecourses function test passed')
+
+    # test collect_stats( self, sim_results, exp_params, class_labels, show_time_plots,
+    #     show_acc_plots ), on a run recorded by a decimating recorder
+    class_labels = np.array(range(10))
+    results = collect_stats( None, sim_results, dummy_exp_params, class_labels, 0, 0 )
+    decimated_results = sde_wrap( dummy_model_params, dummy_exp_params, dummy_feature_array,
+        recorders=[MemoryRecorder(populations=('E',), decimate=5)], seed=1 )
+    assert len(decimated_results['T']) < len(decimated_results['octo_hits'])
+    decimated = collect_stats( None, decimated_results, dummy_exp_params, class_labels, 0, 0 )
+    # the same stims are used (only the peaks are taken from fewer timepoints)
+    for en_ind in range(len(results)):
+        assert np.array_equal( decimated[en_ind]['post_train_resp'] >= 0,
+            results[en_ind]['post_train_resp'] >= 0 )
+    print('\tcollect_stats function test passed')
+
+    # test heb_update_PK( w_flat, inds, rows, cols, K, P, heb_tau, die_back_tau,
+    #     heb_max, dt, bufs )
+    # the die-back decays each synapse by w*dt/die_back_tau, before the Hebbian growth
+    w = np.array([[0.5, 0.0], [1.0, 2.0]])
+    inds = np.array([0, 2, 3]) # the synapses (not the zero weight)
+    rows, cols = np.unravel_index(inds, w.shape)
+    K = np.array([0.0, 2.0])
+    P = np.array([3.0, 1.0])
+    dt, heb_tau, die_back_tau, heb_max = 0.02, 10.0, 4.0, 1.5
+    expected = w.copy()
+    expected[rows, cols] = np.clip( w[rows, cols]*(1 - dt/die_back_tau) +
+        K[rows]*P[cols]/heb_tau, 0, heb_max )
+    heb_update_PK( w.reshape(-1), inds, rows, cols, K, P, heb_tau, die_back_tau,
+        heb_max, dt, (np.empty(3), np.empty(3)) )
+    assert np.allclose( w, expected )
+    print('\theb_update_PK function test passed')
+
+if __name__ == '__main__':
+    main()
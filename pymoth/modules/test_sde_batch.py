@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+# import packages and modules
+import numpy as np
+from .sde_batch import sde_wrap_batch
+from .sde import sde_wrap
+from .params import ModelParams, ExpParams
+
+def main():
+
+    print('Testing sde_batch module:')
+
+    # create a batch of dummy moths, with different learning rates
+    dummy_moths = []
+    for goal in [10, 15]:
+        model_params = ModelParams( 20, goal )
+        model_params.create_connection_matrix()
+        dummy_moths.append(model_params)
+    dummy_exp_params =  ExpParams( np.array(range(10)), np.array(range(10)), 1 )
+    dummy_feature_array = np.random.rand( 20, 3, 10 )
+
+    # test sde_wrap_batch
+    sim_results_list = sde_wrap_batch( dummy_moths, dummy_exp_params, dummy_feature_array )
+    assert len(sim_results_list) == len(dummy_moths)
+    assert sim_results_list[0]['E'].shape == (len(sim_results_list[0]['T']), 10)
+    print('\tsde_wrap_batch method test passed')
+
+    # moth b of a seeded batch matches sde_wrap seeded with the b-th child
+    # of the SeedSequence (a moth can have NaN FRs if one of its PIs gets no
+    # glomeruli, see ModelParams.create_connection_matrix, so NaNs must match too)
+    sim_results_list = sde_wrap_batch( dummy_moths, dummy_exp_params, dummy_feature_array,
+        seed=3 )
+    children = np.random.SeedSequence(3).spawn(len(dummy_moths))
+    for model_params, child, batch_results in zip(dummy_moths, children, sim_results_list):
+        single_results = sde_wrap( model_params, dummy_exp_params, dummy_feature_array,
+            seed=child )
+        assert np.allclose( batch_results['E'], single_results['E'],
+            equal_nan=True )
+        assert np.allclose( batch_results['K2Efinal'], single_results['K2Efinal'],
+            equal_nan=True )
+        assert np.allclose( batch_results['P2Kfinal'], single_results['P2Kfinal'],
+            equal_nan=True )
+    print('\tsde_wrap_batch vs sde_wrap test passed')
+
+if __name__ == '__main__':
+    main()
@@ -19,20 +19,26 @@ setuptools.setup(
     py_modules=[
         'pymoth.modules.classify',
         'pymoth.modules.generate',
+        'pymoth.modules.kernels',
         'pymoth.modules.params',
+        'pymoth.modules.predict',
+        'pymoth.modules.record',
         'pymoth.modules.sde',
+        'pymoth.modules.sde_batch',
         'pymoth.modules.show_figs',
         'pymoth.MNIST_all.MNIST_make_all',
+        'pymoth.MNIST_all.MNIST_read',
+        'pymoth.MNIST_all.MNIST_store',
         # 'sample_experiment',
     ],
     install_requires=[
           'matplotlib',
           'scikit-learn',
-          'scikit-image',
           'pillow',
-          'keras',
-          'tensorflow',
     ],
+    extras_require={
+          'numba': ['numba'], # compiled kernel for the SDE simulation
+    },
     classifiers=[
         "Programming Language :: Python :: 3.6",
         "License :: OSI Approved :: MIT License",